@@ -0,0 +1,199 @@
+import os
+from threading import Lock
+
+from collections.abc import Callable, Iterator
+
+import dotenv
+from flask import Blueprint, Flask, Response, current_app, make_response, render_template, request
+from werkzeug.local import LocalProxy
+
+from assets import Asset, AssetBundle, IMMUTABLE, REVALIDATE
+from database import DBHelper
+from enums import HTTP, Page, Method
+from handlers import API, ENDPOINTS, IMPORT_CHUNK_SIZE, Reply, Upload, run
+from metrics import Metrics
+from queries import Query
+from serializer import create_serializer
+from telegram_auth import TelegramAuth
+from tokens import TokenCache
+
+
+pages = Blueprint('pages', __name__)
+api = Blueprint('api', __name__, url_prefix='/method')
+
+_database: DBHelper | None = None
+_database_pid: int | None = None
+_database_lock = Lock()
+
+
+def create_app() -> Flask:
+    dotenv.load_dotenv()
+
+    debug_assets = os.environ.get('DEBUG_ASSETS', '').lower() in ('1', 'true', 'yes')
+
+    # Static files are served by the pages blueprint from a precompressed, content-hashed bundle
+    app = Flask(__name__, template_folder='web/templates', static_folder=None)
+    app.secret_key = os.environ['APP_KEY']
+    app.config['DATABASE'] = {
+        'host': os.environ['POSTGRES_HOST'],
+        'port': int(os.environ['POSTGRES_PORT']),
+        'user': os.environ['POSTGRES_USER'],
+        'password': os.environ['POSTGRES_PASSWD'],
+        'dbname': os.environ['POSTGRES_DBNAME'],
+        'pool_min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 0)),
+        'pool_max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 0)),
+        'pool_timeout': float(os.environ.get('POSTGRES_POOL_TIMEOUT', 30.0)),
+        'statistics_ttl': float(os.environ.get('STATISTICS_TTL', 5.0)),
+        'statistics_estimate': os.environ.get('STATISTICS_ESTIMATE', '').lower() in ('1', 'true', 'yes'),
+        'cache_size': int(os.environ.get('USER_CACHE_SIZE', 1000)),
+        'purge_interval': float(os.environ.get('PURGE_INTERVAL', 30.0)),
+        'purge_batch_size': int(os.environ.get('PURGE_BATCH_SIZE', 1000)),
+        'purge_delay': float(os.environ.get('PURGE_DELAY', 0.1))
+    }
+    app.jinja_env.auto_reload = debug_assets
+
+    # The accepted algorithms are pinned here instead of being taken from the untrusted token header
+    app.extensions['token_cache'] = TokenCache(
+        app.secret_key,
+        os.environ.get('JWT_ALGORITHMS', 'HS256').split(','),
+        int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+    )
+    app.extensions['serializer'] = create_serializer(os.environ.get('JSON_SERIALIZER', 'auto'))
+    app.extensions['telegram_auth'] = TelegramAuth(os.environ['BOT_TOKEN'], int(os.environ.get('LOGIN_REPLAY_CACHE_SIZE', 100000)))
+
+    app.extensions['metrics'] = Metrics(os.environ.get('METRICS', '').lower() in ('1', 'true', 'yes'))
+    Query.instrumented = app.extensions['metrics'].enabled
+    Query.slow_threshold = float(os.environ['SLOW_QUERY_MS']) / 1000 if os.environ.get('SLOW_QUERY_MS') else None
+
+    app.extensions['assets'] = AssetBundle(os.path.join(app.root_path, 'web/static'), production=not debug_assets)
+    app.jinja_env.globals['asset_url'] = app.extensions['assets'].url
+
+    # The page templates don't depend on the request, so in production they are rendered and compressed once at startup
+    app.extensions['pages'] = {}
+    if not debug_assets:
+        with app.app_context():
+            for page in Page:
+                app.extensions['pages'][page] = Asset.create(render_template(f'{page.value}.html').encode(), 'text/html; charset=utf-8')
+
+    app.extensions['api'] = API(database, app.extensions['serializer'], app.extensions['token_cache'], app.extensions['telegram_auth'], app.extensions['metrics'])
+
+    app.register_blueprint(pages)
+    app.register_blueprint(api)
+
+    # Create the database and apply migrations once, without keeping a connection that would be shared across fork
+    DBHelper(**{k: v for k, v in app.config['DATABASE'].items() if not k.startswith(('pool_', 'purge_')) and k != 'cache_size'}).close()
+
+    return app
+
+
+def get_database() -> DBHelper:
+    global _database, _database_pid
+    if _database is not None and _database_pid == os.getpid():
+        return _database
+    with _database_lock:
+        # A connection pool inherited through fork is unusable, so every process opens its own
+        if _database is None or _database_pid != os.getpid():
+            _database = DBHelper(**current_app.config['DATABASE'], migrate=False)
+            _database_pid = os.getpid()
+        return _database
+
+
+def close_database():
+    global _database
+    with _database_lock:
+        if _database is not None and _database_pid == os.getpid():
+            _database.close()
+        _database = None
+
+
+database: DBHelper = LocalProxy(get_database) # type: ignore
+
+
+
+def APIView(method: Method) -> Callable[[], Response]:
+    upload: bool = ENDPOINTS[method].upload
+
+    def inner() -> Response:
+        handlers: API = current_app.extensions['api']
+        raw_token: str | None = request.headers.get('X-Notes-Auth-Token')
+        if upload:
+            chunks: Iterator[bytes] = iter(lambda: request.stream.read(IMPORT_CHUNK_SIZE), b'')
+            return APIResponse(run(handlers.handle(method, None, raw_token, request.if_none_match, Upload(chunks, request.content_encoding == 'gzip'))))
+        return APIResponse(run(handlers.handle(method, request.get_data(), raw_token, request.if_none_match)))
+
+    inner.__name__ = method.value
+    return inner
+
+
+def APIResponse(reply: Reply) -> Response:
+    r = Response(reply.render(current_app.extensions['serializer']), reply.status, content_type=reply.content_type) # type: ignore
+    if reply.content_encoding is not None:
+        r.content_encoding = reply.content_encoding
+    if reply.etag is not None:
+        r.set_etag(reply.etag)
+    return r
+
+
+def StaticPage(page: Page) -> Response:
+    asset: Asset | None = current_app.extensions['pages'].get(page)
+    if asset is None:
+        asset = Asset.create(render_template(f'{page.value}.html').encode(), 'text/html; charset=utf-8', False)
+    return StaticResponse(asset, REVALIDATE)
+
+
+def StaticResponse(asset: Asset, cache_control: str) -> Response:
+    body, encoding, etag = asset.select([value for value, quality in request.accept_encodings if quality > 0])
+    r = make_response(body)
+    r.content_type = asset.content_type
+    if encoding is not None:
+        r.content_encoding = encoding
+    if asset.encodings:
+        r.vary.add('Accept-Encoding')
+    r.set_etag(etag)
+    r.headers['Cache-Control'] = cache_control
+    return r.make_conditional(request)
+
+
+
+@pages.get('/')
+def main() -> Response:
+    return StaticPage(Page.Main)
+
+
+@pages.get(f'/{Page.Books.value}')
+def books() -> Response:
+    return StaticPage(Page.Books)
+
+
+@pages.get(f'/{Page.Notes.value}')
+def notes() -> Response:
+    return StaticPage(Page.Notes)
+
+
+@pages.get(f'/{Page.TaskLists.value}')
+def task_lists() -> Response:
+    return StaticPage(Page.TaskLists)
+
+
+@pages.get('/static/<path:filename>')
+def static_file(filename: str) -> Response:
+    found: tuple[Asset, bool] | None = current_app.extensions['assets'].get(filename)
+    if found is None:
+        return Response(status=HTTP.NotFound.value)
+
+    # Hashed file names change with the content, so they can be cached forever
+    asset, hashed = found
+    return StaticResponse(asset, IMMUTABLE if hashed else REVALIDATE)
+
+
+@pages.get('/metrics')
+def get_metrics() -> Response:
+    if not current_app.extensions['metrics'].enabled:
+        return Response(status=HTTP.NotFound.value)
+
+    return Response(current_app.extensions['api'].render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+
+for method in ENDPOINTS:
+    api.add_url_rule(f'/{method.value}', method.value, APIView(method), methods=['POST'])
@@ -0,0 +1,180 @@
+import asyncio
+import os
+from typing import Any
+
+import dotenv
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from quart import Quart, Request, Response, render_template, request
+
+from assets import Asset, AssetBundle, IMMUTABLE, REVALIDATE
+from async_database import AsyncDBHelper
+from enums import HTTP, Page, Method
+from handlers import API, ENDPOINTS, MAX_IMPORT_SIZE, Reply, Upload, run_async
+from metrics import Metrics
+from queries import Query
+from serializer import create_serializer
+from telegram_auth import TelegramAuth
+from tokens import TokenCache
+
+
+dotenv.load_dotenv()
+
+debug_assets = os.environ.get('DEBUG_ASSETS', '').lower() in ('1', 'true', 'yes')
+
+
+class NotesRequest(Request):
+
+    def __init__(self, method: str, scheme: str, path: str, *args: Any, max_content_length: int | None = None, **kwargs: Any) -> None:
+        # Imports are streamed in a single body, so the default limit is only meant for regular calls
+        if path == f'/method/{Method.ImportData.value}':
+            max_content_length = MAX_IMPORT_SIZE
+        super().__init__(method, scheme, path, *args, max_content_length=max_content_length, **kwargs)
+
+
+app = Quart(__name__, template_folder='web/templates', static_folder=None)
+app.request_class = NotesRequest
+app.secret_key = os.environ['APP_KEY']
+app.jinja_env.auto_reload = debug_assets
+
+token_cache = TokenCache(app.secret_key, os.environ.get('JWT_ALGORITHMS', 'HS256').split(','), int(os.environ.get('TOKEN_CACHE_SIZE', 10000)))
+serializer = create_serializer(os.environ.get('JSON_SERIALIZER', 'auto'))
+assets = AssetBundle(os.path.join(app.root_path, 'web/static'), production=not debug_assets)
+rendered_pages: dict[Page, Asset] = {}
+telegram_auth = TelegramAuth(os.environ['BOT_TOKEN'], int(os.environ.get('LOGIN_REPLAY_CACHE_SIZE', 100000)))
+
+metrics = Metrics(os.environ.get('METRICS', '').lower() in ('1', 'true', 'yes'))
+Query.instrumented = metrics.enabled
+Query.slow_threshold = float(os.environ['SLOW_QUERY_MS']) / 1000 if os.environ.get('SLOW_QUERY_MS') else None
+
+# The database is attached once the server starts, importing this module doesn't connect or migrate anything
+handlers = API(None, serializer, token_cache, telegram_auth, metrics)
+
+
+app.jinja_env.globals['asset_url'] = assets.url
+
+
+@app.before_serving
+async def render_pages():
+    if not debug_assets:
+        for page in Page:
+            rendered_pages[page] = Asset.create((await render_template(f'{page.value}.html')).encode(), 'text/html; charset=utf-8')
+
+
+@app.before_serving
+async def open_database():
+    handlers.database = AsyncDBHelper(
+        os.environ['POSTGRES_HOST'], int(os.environ['POSTGRES_PORT']), os.environ['POSTGRES_USER'], os.environ['POSTGRES_PASSWD'], os.environ['POSTGRES_DBNAME'],
+        pool_min_size=int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 4)),
+        pool_max_size=int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 32)),
+        pool_timeout=float(os.environ.get('POSTGRES_POOL_TIMEOUT', 30.0)),
+        statistics_ttl=float(os.environ.get('STATISTICS_TTL', 5.0)),
+        statistics_estimate=os.environ.get('STATISTICS_ESTIMATE', '').lower() in ('1', 'true', 'yes'),
+        cache_size=int(os.environ.get('USER_CACHE_SIZE', 1000)),
+        purge_interval=float(os.environ.get('PURGE_INTERVAL', 30.0)),
+        purge_batch_size=int(os.environ.get('PURGE_BATCH_SIZE', 1000)),
+        purge_delay=float(os.environ.get('PURGE_DELAY', 0.1))
+    )
+    await handlers.database.open()
+
+
+@app.after_serving
+async def close_database():
+    if handlers.database is not None:
+        await handlers.database.close()
+        handlers.database = None
+
+
+
+def APIView(method: Method):
+    upload: bool = ENDPOINTS[method].upload
+
+    async def inner() -> Response:
+        raw_token: str | None = request.headers.get('X-Notes-Auth-Token')
+        if upload:
+            return APIResponse(await run_async(handlers.handle(method, None, raw_token, request.if_none_match, Upload(request.body, request.content_encoding == 'gzip'))))
+        return APIResponse(await run_async(handlers.handle(method, await request.get_data(), raw_token, request.if_none_match)))
+
+    inner.__name__ = method.value
+    return inner
+
+
+def APIResponse(reply: Reply) -> Response:
+    r = Response(reply.render(serializer), reply.status, content_type=reply.content_type) # type: ignore
+    if reply.content_encoding is not None:
+        r.content_encoding = reply.content_encoding
+    if reply.etag is not None:
+        r.set_etag(reply.etag)
+    return r
+
+
+async def StaticPage(page: Page) -> Response:
+    asset: Asset | None = rendered_pages.get(page)
+    if asset is None:
+        asset = Asset.create((await render_template(f'{page.value}.html')).encode(), 'text/html; charset=utf-8', False)
+    return await StaticResponse(asset, REVALIDATE)
+
+
+async def StaticResponse(asset: Asset, cache_control: str) -> Response:
+    body, encoding, etag = asset.select([value for value, quality in request.accept_encodings if quality > 0])
+    r = Response(body, content_type=asset.content_type)
+    if encoding is not None:
+        r.content_encoding = encoding
+    if asset.encodings:
+        r.vary.add('Accept-Encoding')
+    r.set_etag(etag)
+    r.headers['Cache-Control'] = cache_control
+    return await r.make_conditional(request)
+
+
+
+@app.get('/')
+async def main() -> Response:
+    return await StaticPage(Page.Main)
+
+
+@app.get(f'/{Page.Books.value}')
+async def books() -> Response:
+    return await StaticPage(Page.Books)
+
+
+@app.get(f'/{Page.Notes.value}')
+async def notes() -> Response:
+    return await StaticPage(Page.Notes)
+
+
+@app.get(f'/{Page.TaskLists.value}')
+async def task_lists() -> Response:
+    return await StaticPage(Page.TaskLists)
+
+
+@app.get('/static/<path:filename>')
+async def static_file(filename: str) -> Response:
+    found: tuple[Asset, bool] | None = assets.get(filename)
+    if found is None:
+        return Response(b'', HTTP.NotFound.value)
+
+    # Hashed file names change with the content, so they can be cached forever
+    asset, hashed = found
+    return await StaticResponse(asset, IMMUTABLE if hashed else REVALIDATE)
+
+
+@app.get('/metrics')
+async def get_metrics() -> Response:
+    if not metrics.enabled:
+        return Response(b'', HTTP.NotFound.value)
+
+    return Response(handlers.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+
+for method in ENDPOINTS:
+    app.add_url_rule(f'/method/{method.value}', method.value, APIView(method), methods=['POST'])
+
+
+if __name__ == '__main__':
+    config = Config()
+    config.bind = [f"{os.environ['LISTEN_ADDR']}:{os.environ['LISTEN_PORT']}"]
+    config.certfile = os.environ['TLS_CERT']
+    config.keyfile = os.environ['TLS_KEY']
+    asyncio.run(serve(app, config)) # type: ignore
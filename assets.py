@@ -0,0 +1,100 @@
+import gzip
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from hashlib import blake2b
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+
+# Bodies this small gain nothing from compression once the headers are counted
+MIN_COMPRESS_SIZE = 256
+
+
+def content_type(name: str) -> str:
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return f'{mimetype}; charset=utf-8' if mimetype.startswith('text/') or mimetype in ('application/javascript', 'application/json') else mimetype
+
+
+@dataclass(slots=True)
+class Asset:
+    data: bytes
+    content_type: str
+    etag: str
+    encodings: dict[str, bytes] = field(default_factory=dict)
+
+
+    @classmethod
+    def create(cls, data: bytes, content_type: str, compress: bool = True) -> 'Asset':
+        asset = cls(data, content_type, blake2b(data, digest_size=16).hexdigest())
+        if compress and len(data) >= MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                asset.encodings['br'] = brotli.compress(data, quality=11)
+            asset.encodings['gzip'] = gzip.compress(data, 9, mtime=0)
+            # A compressed variant is only kept if it actually saves bytes
+            asset.encodings = {encoding: body for encoding, body in asset.encodings.items() if len(body) < len(data)}
+        return asset
+
+
+    def select(self, accepted: list[str]) -> tuple[bytes, str | None, str]:
+        for encoding in accepted:
+            if (body := self.encodings.get(encoding)) is not None:
+                # Every representation needs its own strong validator
+                return body, encoding, f'{self.etag}-{encoding}'
+        return self.data, None, self.etag
+
+
+class AssetBundle:
+
+    def __init__(self, folder: str, url_prefix: str = '/static', production: bool = True) -> None:
+        self.__folder = folder
+        self.__url_prefix = url_prefix
+        self.__production = production
+
+        self.__urls: dict[str, str] = {}
+        self.__assets: dict[str, tuple[Asset, bool]] = {}
+
+        if production:
+            self.__load()
+
+
+    @property
+    def production(self) -> bool:
+        return self.__production
+
+
+    def url(self, name: str) -> str:
+        return f'{self.__url_prefix}/{self.__urls.get(name, name)}'
+
+
+    def get(self, name: str) -> tuple[Asset, bool] | None:
+        # Outside of production the files are read again on every request so edits show up without a restart
+        if not self.__production:
+            self.__load()
+        return self.__assets.get(name)
+
+
+    def __load(self) -> None:
+        urls: dict[str, str] = {}
+        assets: dict[str, tuple[Asset, bool]] = {}
+
+        for root, _, files in os.walk(self.__folder):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.__folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = Asset.create(f.read(), content_type(name), self.__production)
+
+                assets[name] = (asset, False)
+                if self.__production:
+                    stem, extension = os.path.splitext(name)
+                    urls[name] = f'{stem}.{asset.etag[:12]}{extension}'
+                    assets[urls[name]] = (asset, True)
+
+        self.__urls, self.__assets = urls, assets
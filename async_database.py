@@ -0,0 +1,477 @@
+from asyncio import CancelledError, Event, Lock, Task as AsyncTask, create_task, sleep, wait_for
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from time import monotonic, perf_counter
+from typing import IO, Any, TypeVar
+from uuid import UUID, uuid4
+
+import psycopg
+from psycopg.pq import TransactionStatus
+from psycopg.rows import AsyncRowFactory, args_row, tuple_row
+from psycopg_pool import AsyncConnectionPool
+
+from database import DBHelper, User, UserStatistics, Book, Note, TaskList, Task, NotExistsException
+from queries import TABLE_NOTES, TABLE_TASK_LISTS, Query, Queries
+from user_cache import CHANNEL, TOPIC_USER, TOPIC_VERSION, TOPIC_BOOKS, TOPIC_TASK_LISTS, UserCache, notes_topic
+
+
+T = TypeVar('T')
+
+
+class AsyncDBHelper:
+
+    __STREAM_CHUNK_SIZE = 500
+    __COPY_CHUNK_SIZE = 65536
+
+
+    def __init__(self, host: str, port: int, user: str, password: str, dbname: str, pool_min_size: int = 4, pool_max_size: int = 32, pool_timeout: float = 30.0, statistics_ttl: float = 5.0, statistics_estimate: bool = False, cache_size: int = 0, purge_interval: float = 0.0, purge_batch_size: int = 1000, purge_delay: float = 0.1) -> None:
+
+        # Creating the database and applying migrations is a one-off, blocking startup step
+        DBHelper(host, port, user, password, dbname).close()
+
+        self.__conninfo = f'host={host} port={port} user={user} password={password} dbname={dbname}'
+        self.__pool = AsyncConnectionPool(
+            self.__conninfo,
+            kwargs={'autocommit': True},
+            min_size=max(pool_min_size, 1),
+            max_size=max(pool_min_size, pool_max_size),
+            timeout=pool_timeout,
+            configure=self.__configure,
+            check=AsyncConnectionPool.check_connection,
+            name='notes-async',
+            open=False
+        )
+
+        self.__session: ContextVar[psycopg.AsyncConnection | None] = ContextVar('session', default=None)
+
+        self.__statistics_ttl = statistics_ttl
+        self.__statistics_estimate = statistics_estimate
+        self.__statistics_lock = Lock()
+        self.__statistics: dict[str, int] = {}
+        self.__statistics_expires_at = 0.0
+
+        self.__cache: UserCache | None = UserCache(cache_size) if cache_size > 0 else None
+        self.__cache_id = uuid4().hex
+        self.__listener: AsyncTask | None = None
+
+        self.__purge_interval = purge_interval
+        self.__purge_batch_size = purge_batch_size
+        self.__purge_delay = purge_delay
+        self.__purger: AsyncTask | None = None
+        self.__purger_wakeup = Event()
+
+
+    async def __configure(self, connection: psycopg.AsyncConnection):
+        connection.prepared_max = max(connection.prepared_max, len(Query.registry))
+
+
+    async def open(self):
+        await self.__pool.open(wait=True)
+        if self.__cache is not None:
+            self.__listener = create_task(self.__listen())
+        if self.__purge_interval > 0:
+            self.__purger = create_task(self.__purge())
+
+
+    async def close(self):
+        for task in (self.__listener, self.__purger):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except CancelledError:
+                    pass
+        self.__listener = self.__purger = None
+        await self.__pool.close()
+
+
+    @asynccontextmanager
+    async def session(self, snapshot: bool = False) -> AsyncIterator[None]:
+        if self.__session.get() is not None:
+            yield
+            return
+        async with self.__pool.connection() as connection:
+            token = self.__session.set(connection)
+            try:
+                if snapshot:
+                    async with connection.transaction():
+                        await connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+                        yield
+                else:
+                    yield
+            finally:
+                self.__session.reset(token)
+
+
+    @asynccontextmanager
+    async def __connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        if (connection := self.__session.get()) is not None:
+            yield connection
+        else:
+            async with self.__pool.connection() as connection:
+                yield connection
+
+
+    async def __cached(self, key: tuple[Any, ...], load: Callable[[], Awaitable[T]]) -> T:
+        # A snapshot may predate writes that were already invalidated, so its reads neither use nor fill the cache
+        if self.__cache is None or ((connection := self.__session.get()) is not None and connection.info.transaction_status != TransactionStatus.IDLE):
+            return await load()
+        if (value := self.__cache.get(key)) is not None:
+            return value
+        started = self.__cache.begin()
+        value = await load()
+        if value is not None:
+            self.__cache.put(key, value, started)
+        return value
+
+
+    @asynccontextmanager
+    async def __invalidating(self, user_id: int, *topics: str, transaction: bool = False) -> AsyncIterator[tuple[psycopg.AsyncCursor, str | None]]:
+        # The payload is passed to the write statement itself, which notifies the other workers when it commits
+        payload: str | None = f'{self.__cache_id} {user_id} {",".join(topics)}' if self.__cache is not None else None
+        async with self.__connection() as connection, connection.transaction() if transaction else nullcontext(), connection.cursor() as cursor:
+            yield cursor, payload
+        # Entries are dropped only once the write is committed, otherwise a concurrent read could cache the old rows again
+        if self.__cache is not None:
+            self.__cache.invalidate(user_id, list(topics))
+
+
+    async def __listen(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.__conninfo, autocommit=True) as connection:
+                    await connection.execute(f'LISTEN "{CHANNEL}"')
+                    # Invalidations sent while nobody was listening are lost, so everything cached before is dropped
+                    self.__cache.clear(enabled=True) # type: ignore
+                    async for notify in connection.notifies():
+                        self.__receive(notify.payload)
+            except psycopg.Error:
+                self.__cache.clear(enabled=False) # type: ignore
+                await sleep(1.0)
+
+
+    def __receive(self, payload: str):
+        sender, user_id, topics = payload.split(' ', 2) if payload.count(' ') >= 2 else ('', '', '')
+        if sender and sender != self.__cache_id:
+            self.__cache.invalidate(int(user_id), topics.split(',')) # type: ignore
+
+
+    async def __purge(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.__conninfo, autocommit=True) as connection, connection.cursor() as cursor:
+                    await self.__configure(connection)
+                    while True:
+                        if await self.__purge_batch(cursor):
+                            await sleep(self.__purge_delay)
+                            continue
+                        try:
+                            await wait_for(self.__purger_wakeup.wait(), self.__purge_interval)
+                        except TimeoutError:
+                            pass
+                        self.__purger_wakeup.clear()
+            except psycopg.Error:
+                await sleep(1.0)
+
+
+    async def __purge_batch(self, cursor: psycopg.AsyncCursor) -> int:
+        purged = 0
+        for query in (Queries.PurgeNotes, Queries.PurgeBooks, Queries.PurgeTasks, Queries.PurgeTaskLists):
+            await self.__execute(cursor, query, (self.__purge_batch_size, ))
+            purged += cursor.rowcount
+        return purged
+
+
+    def cache_stats(self) -> dict[str, float]:
+        return self.__cache.stats() if self.__cache else {}
+
+
+    def pool_stats(self) -> dict[str, int]:
+        stats = self.__pool.get_stats()
+        return {
+            'pool_min': stats.get('pool_min', 0),
+            'pool_max': stats.get('pool_max', 0),
+            'pool_size': stats.get('pool_size', 0),
+            'pool_available': stats.get('pool_available', 0),
+            'in_use': stats.get('pool_size', 0) - stats.get('pool_available', 0),
+            'requests_waiting': stats.get('requests_waiting', 0),
+            'requests_num': stats.get('requests_num', 0),
+            'requests_queued': stats.get('requests_queued', 0),
+            'requests_wait_ms': stats.get('requests_wait_ms', 0),
+            'requests_timeouts': stats.get('requests_errors', 0),
+            'connections_lost': stats.get('connections_lost', 0),
+            'connections_errors': stats.get('connections_errors', 0)
+        }
+
+
+    def query_stats(self) -> dict[str, dict[str, float]]:
+        return {name: query.stats() for name, query in Query.registry.items()}
+
+
+
+    async def get_statistics(self) -> dict[str, int]:
+        async with self.__statistics_lock:
+            if monotonic() < self.__statistics_expires_at:
+                return dict(self.__statistics)
+
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                await self.__execute(cursor, Queries.EstimateStatistics if self.__statistics_estimate else Queries.GetStatistics)
+                statistics: dict[str, int] = {TABLE_NOTES: 0, TABLE_TASK_LISTS: 0} | dict(await cursor.fetchall())
+
+            self.__statistics = statistics
+            self.__statistics_expires_at = monotonic() + self.__statistics_ttl
+            return dict(statistics)
+
+
+
+    async def get_user_statistics(self, user_id: int) -> UserStatistics | None:
+        async with self.__connection() as connection, connection.cursor() as cursor:
+            await self.__execute(cursor, Queries.GetUserStatistics, (user_id, ), args_row(UserStatistics))
+            return await cursor.fetchone()
+
+
+
+    async def get_user_version(self, user_id: int) -> int | None:
+        async def load() -> int | None:
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                await self.__execute(cursor, Queries.GetUserVersion, (user_id, ))
+                return result[0] if (result := await cursor.fetchone()) else None
+        return await self.__cached((user_id, TOPIC_VERSION), load)
+
+
+    async def get_book_version(self, owner_id: int, book_id: UUID) -> int | None:
+        async def load() -> int | None:
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                await self.__execute(cursor, Queries.GetBookVersion, (owner_id, book_id))
+                return result[0] if (result := await cursor.fetchone()) else None
+        return await self.__cached((owner_id, notes_topic(book_id), TOPIC_VERSION), load)
+
+
+
+    async def get_user(self, id: int) -> User | None:
+        async def load() -> User | None:
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                await self.__execute(cursor, Queries.GetUser, (id, ), args_row(User))
+                return await cursor.fetchone()
+        return await self.__cached((id, TOPIC_USER), load)
+
+
+    async def upsert_user(self, id: int, username: str | None, first_name: str, last_name: str | None):
+        async with self.__invalidating(id, TOPIC_USER, TOPIC_VERSION) as (cursor, notify):
+            await self.__execute(cursor, Queries.UpsertUser, (id, username, first_name, last_name, notify))
+
+
+
+    async def get_books(self, user_id: int, after: tuple[str, UUID] | None = None, limit: int | None = None) -> list[tuple[Book, int]]:
+        async def load() -> list[tuple[Book, int]]:
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                if after:
+                    await self.__execute(cursor, Queries.GetBooksAfter, (user_id, *after, limit))
+                else:
+                    await self.__execute(cursor, Queries.GetBooks, (user_id, limit))
+                return [(Book(*row[:-1]), row[-1]) for row in await cursor.fetchall()]
+        return await self.__cached((user_id, TOPIC_BOOKS, after, limit), load)
+
+
+    async def stream_books(self, user_id: int) -> AsyncIterator[tuple[Book, int]]:
+        return ((Book(*row[:-1]), row[-1]) async for row in self.__stream(Queries.StreamBooks, (user_id, None)))
+
+
+    async def create_book(self, owner_id: int, title: str) -> Book:
+        async with self.__invalidating(owner_id, TOPIC_BOOKS, TOPIC_VERSION) as (cursor, notify):
+            await self.__execute(cursor, Queries.CreateBook, (owner_id, title, owner_id, notify), args_row(Book))
+            return await cursor.fetchone() # type: ignore
+
+
+    async def delete_book(self, owner_id: int, book_id: UUID) -> Book | None:
+        async with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION) as (cursor, notify):
+            await self.__execute(cursor, Queries.DeleteBook, (owner_id, book_id, owner_id, notify), args_row(Book))
+            book: Book | None = await cursor.fetchone()
+        self.__purger_wakeup.set()
+        return book
+
+
+
+    async def get_notes(self, owner_id: int, book_id: UUID, after: UUID | None = None, limit: int | None = None) -> list[Note]:
+        async def load() -> list[Note]:
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                if after:
+                    await self.__execute(cursor, Queries.GetNotesAfter, (after, limit, owner_id, book_id), args_row(Note))
+                else:
+                    await self.__execute(cursor, Queries.GetNotes, (limit, owner_id, book_id), args_row(Note))
+                if not (notes := await cursor.fetchall()):
+                    raise NotExistsException
+                return [note for note in notes if note.id is not None]
+        return await self.__cached((owner_id, notes_topic(book_id), after, limit), load)
+
+
+    async def stream_notes(self, owner_id: int, book_id: UUID) -> AsyncIterator[Note]:
+        async with self.__connection() as connection, connection.cursor() as cursor:
+            await self.__check_user_book_exists(cursor, owner_id, book_id)
+        return self.__stream(Queries.StreamNotes, (book_id, ), args_row(Note))
+
+
+    async def search_notes(self, owner_id: int, query: str, after: tuple[float, UUID] | None = None, limit: int | None = None) -> list[tuple[Note, float]]:
+        async with self.__connection() as connection, connection.cursor() as cursor:
+            if after:
+                await self.__execute(cursor, Queries.SearchNotesAfter, (query, owner_id, after[0], after[0], after[1], limit))
+            else:
+                await self.__execute(cursor, Queries.SearchNotes, (query, owner_id, limit))
+            return [(Note(*row[:-1]), row[-1]) for row in await cursor.fetchall()]
+
+
+    async def create_note(self, owner_id: int, book_id: UUID, title: str, text: str) -> Note:
+        async with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION) as (cursor, notify):
+            await self.__execute(cursor, Queries.CreateNote, (title, text, owner_id, book_id, owner_id, notify), args_row(Note))
+            if not (note := await cursor.fetchone()):
+                raise NotExistsException
+            return note
+
+
+    async def create_notes(self, owner_id: int, book_id: UUID, notes: list[tuple[str, str]]) -> list[Note]:
+        async with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION, transaction=True) as (cursor, notify):
+            await self.__lock_user_book(cursor, owner_id, book_id)
+            if not notes:
+                return []
+            titles, texts = zip(*notes)
+            await self.__execute(cursor, Queries.CreateNotes, (book_id, list(titles), list(texts), len(notes), owner_id, notify), args_row(Note))
+            return await cursor.fetchall()
+
+
+    async def delete_note(self, owner_id: int, book_id: UUID, note_id: UUID) -> Note | None:
+        async with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION) as (cursor, notify):
+            await self.__execute(cursor, Queries.DeleteNote, (owner_id, book_id, note_id, owner_id, notify))
+            book_exists, *result = await cursor.fetchone() # type: ignore
+            if not book_exists:
+                raise NotExistsException
+            return Note(*result) if result[0] is not None else None
+
+
+
+    async def get_task_lists(self, owner_id: int) -> list[tuple[TaskList, list[Task]]]:
+        async def load() -> list[tuple[TaskList, list[Task]]]:
+            async with self.__connection() as connection, connection.cursor() as cursor:
+                await self.__execute(cursor, Queries.GetTaskLists, (owner_id, ))
+                rows = await cursor.fetchall()
+
+            result: dict[UUID, tuple[TaskList, list[Task]]] = {}
+            for row in rows:
+                if row[0] not in result:
+                    result[row[0]] = (TaskList(*row[:3]), [])
+                if row[3] is not None:
+                    result[row[0]][1].append(Task(*row[3:]))
+
+            return list(result.values())
+        return await self.__cached((owner_id, TOPIC_TASK_LISTS), load)
+
+
+    async def create_task_list(self, owner_id: int, title: str, tasks: list[str]) -> tuple[TaskList, list[Task]]:
+        async with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            await self.__execute(cursor, Queries.CreateTaskList, (owner_id, title, owner_id, notify), args_row(TaskList))
+            _tasklist: TaskList = await cursor.fetchone() # type: ignore
+            return _tasklist, await self.__insert_tasks(cursor, owner_id, _tasklist.id, tasks, notify)
+
+
+    async def create_tasks(self, owner_id: int, task_list_id: UUID, tasks: list[str]) -> list[Task]:
+        async with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            await self.__lock_user_task_list(cursor, owner_id, task_list_id)
+            return await self.__insert_tasks(cursor, owner_id, task_list_id, tasks, notify)
+
+
+    async def delete_task_list(self, owner_id: int, task_list_id: UUID) -> TaskList | None:
+        async with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION) as (cursor, notify):
+            await self.__execute(cursor, Queries.DeleteTaskList, (owner_id, task_list_id, owner_id, notify), args_row(TaskList))
+            task_list: TaskList | None = await cursor.fetchone()
+        self.__purger_wakeup.set()
+        return task_list
+
+
+    async def update_tasks(self, owner_id: int, changes: list[tuple[UUID, str | None, bool | None, int | None]]) -> list[Task]:
+        ids, texts, dones, positions = (list(column) for column in zip(*changes))
+        async with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            await self.__execute(cursor, Queries.UpdateTasks, (ids, texts, dones, positions, owner_id, owner_id, notify), args_row(Task))
+            tasks: list[Task] = await cursor.fetchall()
+            # Any missing task was either not found or owned by someone else, the whole update is rolled back then
+            if len(tasks) != len(changes):
+                raise NotExistsException
+            return tasks
+
+
+
+    async def export_data(self, owner_id: int) -> AsyncIterator[Book | Note | TaskList | Task]:
+        async with self.__connection() as connection, connection.transaction():
+            await connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            for query, row_factory in ((Queries.ExportBooks, args_row(Book)), (Queries.ExportNotes, args_row(Note)), (Queries.ExportTaskLists, args_row(TaskList)), (Queries.ExportTasks, args_row(Task))):
+                async with connection.cursor(name=f'export_{uuid4().hex}', row_factory=row_factory) as cursor:
+                    cursor.itersize = AsyncDBHelper.__STREAM_CHUNK_SIZE
+                    started = perf_counter()
+                    try:
+                        await cursor.execute(query.sql, (owner_id, )) # type: ignore
+                    finally:
+                        query.record(perf_counter() - started, 0, (owner_id, ))
+                    async for row in cursor:
+                        yield row
+
+
+    async def import_data(self, owner_id: int, rows: dict[type, IO[bytes]], statistics: UserStatistics):
+        amounts: dict[type, int] = {Book: statistics.books, Note: statistics.notes, TaskList: statistics.task_lists, Task: statistics.tasks}
+        async with self.__invalidating(owner_id, TOPIC_BOOKS, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            await self.__execute(cursor, Queries.LockUser, (owner_id, ))
+            if not await cursor.fetchone():
+                raise NotExistsException
+            for kind, query in ((Book, Queries.CopyBooks), (Note, Queries.CopyNotes), (TaskList, Queries.CopyTaskLists), (Task, Queries.CopyTasks)):
+                started = perf_counter()
+                async with cursor.copy(query.sql) as copy: # type: ignore
+                    while data := rows[kind].read(AsyncDBHelper.__COPY_CHUNK_SIZE):
+                        await copy.write(data)
+                query.record(perf_counter() - started, amounts[kind])
+            await self.__execute(cursor, Queries.AddUserStatistics, (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks, owner_id, notify))
+
+
+
+    async def __execute(self, cursor: psycopg.AsyncCursor, query: Query, params: tuple[Any, ...] | None = None, row_factory: AsyncRowFactory | None = None):
+        if row_factory:
+            cursor.row_factory = row_factory
+        started = perf_counter()
+        try:
+            await cursor.execute(query.sql, params, prepare=query.prepare) # type: ignore
+        finally:
+            query.record(perf_counter() - started, cursor.rowcount, params)
+
+
+    async def __stream(self, query: Query, params: tuple[Any, ...], row_factory: AsyncRowFactory = tuple_row) -> AsyncIterator[Any]:
+        async with self.__connection() as connection, connection.transaction(), connection.cursor(name=f'stream_{uuid4().hex}', row_factory=row_factory) as cursor:
+            cursor.itersize = AsyncDBHelper.__STREAM_CHUNK_SIZE
+            started = perf_counter()
+            try:
+                await cursor.execute(query.sql, params) # type: ignore
+            finally:
+                query.record(perf_counter() - started, 0, params)
+            async for row in cursor:
+                yield row
+
+
+    async def __insert_tasks(self, cursor: psycopg.AsyncCursor, owner_id: int, task_list_id: UUID, tasks: list[str], notify: str | None) -> list[Task]:
+        if not tasks:
+            return []
+        await self.__execute(cursor, Queries.InsertTasks, (task_list_id, tasks, task_list_id, len(tasks), owner_id, notify), args_row(Task))
+        return await cursor.fetchall()
+
+
+    async def __check_user_book_exists(self, cursor: psycopg.AsyncCursor, owner_id: int, book_id: UUID):
+        await self.__execute(cursor, Queries.CheckUserBookExists, (owner_id, book_id))
+        if not (result[0] if (result := await cursor.fetchone()) else False):
+            raise NotExistsException
+
+
+    async def __lock_user_book(self, cursor: psycopg.AsyncCursor, owner_id: int, book_id: UUID):
+        await self.__execute(cursor, Queries.LockUserBook, (owner_id, book_id))
+        if not await cursor.fetchone():
+            raise NotExistsException
+
+
+    async def __lock_user_task_list(self, cursor: psycopg.AsyncCursor, owner_id: int, task_list_id: UUID):
+        await self.__execute(cursor, Queries.LockUserTaskList, (owner_id, task_list_id))
+        if not await cursor.fetchone():
+            raise NotExistsException
@@ -0,0 +1,339 @@
+import argparse
+import hmac
+import json
+import os
+import ssl
+import sys
+from hashlib import sha256
+from http.client import HTTPConnection, HTTPSConnection
+from random import Random
+from statistics import quantiles
+from threading import Event, Thread, local
+from time import perf_counter, sleep, time
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+import dotenv
+import jwt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enums import HTTP, Method
+from seed import FIRST_USER_ID, WORDS
+
+
+PAGE_SIZE = 100
+
+
+class HTTPTarget:
+
+    def __init__(self, url: str, insecure: bool = False) -> None:
+        parts = urlsplit(url)
+        self.__https = parts.scheme == 'https'
+        self.__host = parts.hostname or '127.0.0.1'
+        self.__port = parts.port or (443 if self.__https else 80)
+        self.__context = ssl._create_unverified_context() if insecure else ssl.create_default_context()
+        self.__local = local()
+
+
+    def post(self, path: str, body: bytes, headers: dict[str, str]) -> tuple[int, str | None, bytes]:
+        # Every driver thread keeps one keep-alive connection, like a browser tab would
+        if (connection := getattr(self.__local, 'connection', None)) is None:
+            connection = HTTPSConnection(self.__host, self.__port, context=self.__context) if self.__https else HTTPConnection(self.__host, self.__port)
+            self.__local.connection = connection
+        try:
+            connection.request('POST', path, body, {'Content-Type': 'application/json', **headers})
+            response = connection.getresponse()
+            return response.status, response.getheader('ETag'), response.read()
+        except (OSError, ConnectionError):
+            connection.close()
+            self.__local.connection = None
+            raise
+
+
+class AppTarget:
+
+    def __init__(self) -> None:
+        from app import create_app
+        self.__app = create_app()
+        self.__local = local()
+
+
+    def post(self, path: str, body: bytes, headers: dict[str, str]) -> tuple[int, str | None, bytes]:
+        if (client := getattr(self.__local, 'client', None)) is None:
+            client = self.__local.client = self.__app.test_client()
+        response = client.post(path, data=body, headers={'Content-Type': 'application/json', **headers})
+        return response.status_code, response.headers.get('ETag'), response.get_data()
+
+
+class Recorder:
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.not_modified: dict[str, int] = {}
+        self.recording = False
+
+
+    def record(self, name: str, elapsed: float, status: int, ok: bool):
+        if not self.recording:
+            return
+        # list.append and dict updates are atomic under the GIL, every thread can record without a lock
+        self.latencies.setdefault(name, []).append(elapsed * 1000)
+        if status == HTTP.NotModified.value:
+            self.not_modified[name] = self.not_modified.get(name, 0) + 1
+        elif not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+class Session:
+
+    def __init__(self, user_id: int, token: str) -> None:
+        self.user_id = user_id
+        self.token = token
+        self.etags: dict[str, tuple[str, Any]] = {}
+        self.books: list[str] = []
+        self.notes: dict[str, list[str]] = {}
+        self.tasks: dict[str, bool] = {}
+
+
+class Driver:
+
+    def __init__(self, target: HTTPTarget | AppTarget, recorder: Recorder, users: int, secret_key: str, algorithm: str, bot_token: str) -> None:
+        self.__target = target
+        self.__recorder = recorder
+        self.__users = users
+        self.__secret_key = secret_key
+        self.__algorithm = algorithm
+        self.__login_key = sha256(bot_token.encode()).digest()
+
+        # Relative weights of the calls a page load or a click turns into
+        self.__mix: list[tuple[Callable[[Session, Random], None], int]] = [
+            (self.get_me, 12),
+            (self.get_books, 15),
+            (self.get_notes, 20),
+            (self.get_task_lists, 15),
+            (self.search_notes, 5),
+            (self.update_tasks, 10),
+            (self.create_note, 4),
+            (self.delete_note, 2),
+            (self.create_task_list, 1),
+            (self.get_user_statistics, 3),
+            (self.get_statistics, 3),
+            (self.page_load, 5),
+            (self.login, 2)
+        ]
+
+
+    def run(self, random: Random, stop: Event):
+        actions, weights = zip(*self.__mix)
+        # Sessions are per thread, two threads picking the same user behave like two open tabs
+        sessions: dict[int, Session] = {}
+        while not stop.is_set():
+            user_id = FIRST_USER_ID + random.randrange(self.__users)
+            if (session := sessions.get(user_id)) is None:
+                session = sessions[user_id] = Session(user_id, self.sign_token(user_id))
+            random.choices(actions, weights)[0](session, random)
+
+
+    def call(self, name: str, session: Session | None, method: Method, params: dict[str, Any], revalidate: bool = False) -> Any:
+        body = json.dumps(params).encode()
+        headers: dict[str, str] = {'X-Notes-Auth-Token': session.token} if session else {}
+        key = f'{method.value}:{body.decode()}'
+        if revalidate and session and key in session.etags:
+            headers['If-None-Match'] = f'"{session.etags[key][0]}"'
+
+        started = perf_counter()
+        try:
+            status, etag, data = self.__target.post(f'/method/{method.value}', body, headers)
+        except OSError:
+            self.__recorder.record(name, perf_counter() - started, 0, False)
+            return None
+        elapsed = perf_counter() - started
+
+        if status == HTTP.NotModified.value and session:
+            self.__recorder.record(name, elapsed, status, True)
+            return session.etags[key][1]
+
+        try:
+            response = json.loads(data)
+        except ValueError:
+            response = {'ok': False}
+        self.__recorder.record(name, elapsed, status, bool(response.get('ok')))
+        if not response.get('ok'):
+            return None
+        if revalidate and session and etag and status == HTTP.OK.value:
+            session.etags[key] = (etag.strip('"'), response['result'])
+        return response['result']
+
+
+    def sign_token(self, user_id: int) -> str:
+        now = int(time())
+        return jwt.encode({'sub': user_id, 'iat': now, 'exp': now + 86400}, self.__secret_key, algorithm=self.__algorithm)
+
+
+    def login(self, session: Session, random: Random):
+        # Every payload is unique, the server rejects replayed login data
+        params: dict[str, Any] = {'id': session.user_id, 'first_name': 'Bench', 'last_name': f'User {session.user_id}', 'username': f'bench_{session.user_id}', 'auth_date': int(time()), 'photo_url': f'https://t.me/i/{random.getrandbits(64):x}.jpg'}
+        data_check_string = '\n'.join(f'{k}={params[k]}' for k in sorted(params))
+        params['hash'] = hmac.new(self.__login_key, data_check_string.encode(), sha256).hexdigest()
+        if (result := self.call(Method.Login.value, None, Method.Login, params)) is not None:
+            session.token = result['auth_token']
+
+
+    def get_me(self, session: Session, _: Random):
+        self.call(Method.GetMe.value, session, Method.GetMe, {}, True)
+
+
+    def get_statistics(self, session: Session, _: Random):
+        self.call(Method.GetStatistics.value, None, Method.GetStatistics, {})
+
+
+    def get_user_statistics(self, session: Session, _: Random):
+        self.call(Method.GetUserStatistics.value, session, Method.GetUserStatistics, {})
+
+
+    def get_books(self, session: Session, _: Random):
+        if (result := self.call(Method.GetBooks.value, session, Method.GetBooks, {'limit': PAGE_SIZE}, True)) is not None:
+            session.books = [book['id'] for book, _ in result['entries']]
+
+
+    def get_notes(self, session: Session, random: Random):
+        if not session.books:
+            return self.get_books(session, random)
+        book_id = random.choice(session.books)
+        if (result := self.call(Method.GetNotes.value, session, Method.GetNotes, {'book_id': book_id, 'limit': PAGE_SIZE}, True)) is not None:
+            session.notes[book_id] = [note['id'] for note in result['notes']]
+
+
+    def search_notes(self, session: Session, random: Random):
+        self.call(Method.SearchNotes.value, session, Method.SearchNotes, {'query': random.choice(WORDS)})
+
+
+    def create_note(self, session: Session, random: Random):
+        if not session.books:
+            return self.get_books(session, random)
+        book_id = random.choice(session.books)
+        if (result := self.call(Method.CreateNote.value, session, Method.CreateNote, {'book_id': book_id, 'title': 'load test', 'text': f'note {random.getrandbits(32)}'})) is not None:
+            session.notes.setdefault(book_id, []).append(result['note']['id'])
+
+
+    def delete_note(self, session: Session, random: Random):
+        candidates = [book_id for book_id, notes in session.notes.items() if notes]
+        if not candidates:
+            return self.get_notes(session, random)
+        book_id = random.choice(candidates)
+        note_id = session.notes[book_id].pop(random.randrange(len(session.notes[book_id])))
+        self.call(Method.DeleteNote.value, session, Method.DeleteNote, {'book_id': book_id, 'id': note_id})
+
+
+    def get_task_lists(self, session: Session, _: Random):
+        if (result := self.call(Method.GetTaskLists.value, session, Method.GetTaskLists, {}, True)) is not None:
+            session.tasks = {task['id']: task['is_done'] for entry in result['entries'] for task in entry['tasks']}
+
+
+    def create_task_list(self, session: Session, random: Random):
+        self.call(Method.CreateTaskList.value, session, Method.CreateTaskList, {'title': 'load test', 'tasks': [f'task {i}' for i in range(random.randint(1, 8))]})
+
+
+    def update_tasks(self, session: Session, random: Random):
+        if not session.tasks:
+            return self.get_task_lists(session, random)
+        task_id = random.choice(list(session.tasks))
+        if self.call(Method.UpdateTasks.value, session, Method.UpdateTasks, {'tasks': [{'id': task_id, 'is_done': not session.tasks[task_id]}]}) is not None:
+            session.tasks[task_id] = not session.tasks[task_id]
+
+
+    def page_load(self, session: Session, _: Random):
+        self.call('batch(get_me,get_books)', session, Method.Batch, {'calls': [{'method': Method.GetMe.value}, {'method': Method.GetBooks.value, 'params': {'limit': PAGE_SIZE}}]})
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    cuts = quantiles(values, n=100, method='inclusive') if len(values) > 1 else [values[0]] * 99
+    return {'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98], 'mean': sum(values) / len(values), 'max': max(values)}
+
+
+def query_totals() -> dict[str, tuple[int, float]]:
+    from queries import Query
+    return {name: (query.calls, query.total_time) for name, query in Query.registry.items()}
+
+
+def main() -> None:
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description='Replay a mix of authenticated API calls and report per-method latency percentiles')
+    parser.add_argument('--url', help='server to load, e.g. https://127.0.0.1:8443, the app runs in process when omitted')
+    parser.add_argument('--insecure', action='store_true', help='skip TLS certificate verification')
+    parser.add_argument('--dbname', default=os.environ.get('BENCHMARK_DBNAME', 'notes_benchmark'), help='seeded database the in-process app uses')
+    parser.add_argument('--users', type=int, default=1000, help='seeded users to spread the load over')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5.0, help='unmeasured seconds before the measurement')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    if args.url:
+        target: HTTPTarget | AppTarget = HTTPTarget(args.url, args.insecure)
+    else:
+        os.environ['POSTGRES_DBNAME'] = args.dbname
+        os.environ.setdefault('POSTGRES_POOL_MIN_SIZE', '1')
+        os.environ.setdefault('POSTGRES_POOL_MAX_SIZE', str(args.threads))
+        target = AppTarget()
+
+    recorder = Recorder()
+    driver = Driver(target, recorder, args.users, os.environ['APP_KEY'], os.environ.get('JWT_ALGORITHMS', 'HS256').split(',')[0], os.environ['BOT_TOKEN'])
+
+    stop = Event()
+    threads = [Thread(target=driver.run, args=(Random(args.seed + i), stop), daemon=True) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    sleep(args.warmup)
+    queries_before = query_totals()
+    recorder.recording = True
+    started = perf_counter()
+    sleep(args.duration)
+    recorder.recording = False
+    elapsed = perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    methods = {
+        name: {'calls': len(values), 'errors': recorder.errors.get(name, 0), 'not_modified': recorder.not_modified.get(name, 0), **percentiles(values)}
+        for name, values in sorted(recorder.latencies.items())
+    }
+    total = sum(method['calls'] for method in methods.values())
+    report: dict[str, Any] = {
+        'config': {key: getattr(args, key) for key in ('url', 'dbname', 'users', 'threads', 'duration', 'warmup', 'seed')},
+        'elapsed_s': elapsed,
+        'requests': total,
+        'throughput_rps': total / elapsed,
+        'methods': methods
+    }
+    if not args.url:
+        # Only the in-process app shares the statement counters with the driver
+        report['queries'] = {}
+        for name, (calls, seconds) in query_totals().items():
+            calls_before, seconds_before = queries_before.get(name, (0, 0.0))
+            if calls > calls_before:
+                report['queries'][name] = {'calls': calls - calls_before, 'mean_ms': (seconds - seconds_before) * 1000 / (calls - calls_before)}
+
+    baseline: dict[str, Any] = json.load(open(args.baseline))['methods'] if args.baseline else {}
+
+    print(f'{total} requests in {elapsed:.1f}s, {total / elapsed:.0f} req/s')
+    print(f'{"method":<28} {"calls":>7} {"errors":>7} {"304":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}' + (f' {"p95 vs base":>12}' if baseline else ''))
+    for name, method in methods.items():
+        line = f'{name:<28} {method["calls"]:>7} {method["errors"]:>7} {method["not_modified"]:>6} {method["p50"]:>8.2f} {method["p95"]:>8.2f} {method["p99"]:>8.2f}'
+        if baseline:
+            line += f' {(method["p95"] / baseline[name]["p95"] - 1) * 100:>+11.1f}%' if name in baseline else f' {"-":>12}'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
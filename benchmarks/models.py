@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import tracemalloc
+from statistics import median
+from time import perf_counter
+from uuid import UUID
+
+import dotenv
+import psycopg
+from psycopg.rows import args_row
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DBHelper, Note
+
+
+USER_ID = 1_000_000_002
+ROWS = 100_000
+REPEATS = 5
+
+
+class LegacyNote:
+
+    def __init__(self, id: UUID, book_id: UUID, title: str, text: str) -> None:
+        self.id: UUID = id
+        self.book_id: UUID = book_id
+        self.title: str = title
+        self.text: str = text
+
+
+def fetch_legacy(connection: psycopg.Connection, book_id: UUID) -> list[LegacyNote]:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT "id", "book_id", "title", "text" FROM "notes" WHERE "book_id" = %s', (book_id, ))
+        return [LegacyNote(*row) for row in cursor.fetchall()]
+
+
+def fetch_slots(connection: psycopg.Connection, book_id: UUID) -> list[Note]:
+    with connection.cursor(row_factory=args_row(Note)) as cursor:
+        cursor.execute('SELECT "id", "book_id", "title", "text" FROM "notes" WHERE "book_id" = %s', (book_id, ))
+        return cursor.fetchall()
+
+
+def measure(f) -> tuple[float, float, float]:
+    timings = []
+    for _ in range(REPEATS):
+        started = perf_counter()
+        f()
+        timings.append(perf_counter() - started)
+
+    tracemalloc.start()
+    result = f()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return median(timings) * 1000, retained / ROWS, peak / 2 ** 20
+
+
+def main() -> None:
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description='Compare the memory and time of fetching notes into dict-backed and slotted objects')
+    parser.add_argument('--dbname', default='notes_benchmark_models', help='throwaway database to create and drop, never point this at real data')
+    args = parser.parse_args()
+    if args.dbname == os.environ.get('POSTGRES_DBNAME'):
+        parser.error('the benchmark database is dropped afterwards, it must not be the application one')
+
+    host, port = os.environ['POSTGRES_HOST'], int(os.environ['POSTGRES_PORT'])
+    user, password = os.environ['POSTGRES_USER'], os.environ['POSTGRES_PASSWD']
+
+    try:
+        # Creates the database and applies the migrations
+        database = DBHelper(host, port, user, password, args.dbname)
+        connection = psycopg.connect(f'host={host} port={port} user={user} password={password} dbname={args.dbname}', autocommit=True)
+        database.upsert_user(USER_ID, None, 'benchmark', None)
+
+        try:
+            book = database.create_book(USER_ID, 'benchmark')
+            connection.execute('''
+                INSERT INTO "notes" ("book_id", "title", "text")
+                SELECT %s, 'note ' || "i", repeat('lorem ipsum ', 8)
+                FROM generate_series(1, %s) AS "i"
+            ''', (book.id, ROWS))
+
+            print(f'{"model":<12} {"ms":>10} {"B/row":>10} {"peak MiB":>10}')
+            for name, f in (('dict', lambda: fetch_legacy(connection, book.id)), ('slots', lambda: fetch_slots(connection, book.id)), ('get_notes', lambda: database.get_notes(USER_ID, book.id))):
+                ms, per_row, peak = measure(f)
+                print(f'{name:<12} {ms:>10.1f} {per_row:>10.0f} {peak:>10.1f}')
+        finally:
+            connection.close()
+            database.close()
+    finally:
+        with psycopg.connect(f'host={host} port={port} user={user} password={password}', autocommit=True) as maintenance:
+            maintenance.execute(f'DROP DATABASE IF EXISTS "{args.dbname}" WITH (FORCE)') # type: ignore
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import dotenv
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DBHelper
+
+
+FIRST_USER_ID = 1_100_000_000
+
+WORDS = (
+    'заметка', 'кошка', 'собака', 'список', 'покупки', 'молоко', 'хлеб', 'работа', 'встреча', 'отчёт',
+    'проект', 'идея', 'книга', 'фильм', 'музыка', 'путешествие', 'билеты', 'отпуск', 'врач', 'спорт',
+    'note', 'meeting', 'release', 'deploy', 'postgres', 'python', 'flask', 'index', 'query', 'cache'
+)
+
+
+def words(amount: str) -> str:
+    # Correlated with the outer row through the amount expression, so every row gets its own random text
+    return f'''(
+        SELECT string_agg(("words")[1 + floor(random() * {len(WORDS)})::int], ' ')
+        FROM generate_series(1, {amount}), (SELECT %(words)s::text[] AS "words") AS "vocabulary"
+    )'''
+
+
+def seed(connection: psycopg.Connection, users: int, books: int, notes: int, task_lists: int, tasks: int, random_seed: float):
+    params = {'first': FIRST_USER_ID, 'last': FIRST_USER_ID + users - 1, 'books': books, 'notes': notes, 'task_lists': task_lists, 'tasks': tasks, 'words': list(WORDS)}
+
+    with connection.transaction():
+        connection.execute('SELECT setseed(%s)', (random_seed, ))
+        connection.execute('DELETE FROM "users" WHERE "id" >= %s', (FIRST_USER_ID, ))
+
+        connection.execute('''
+            INSERT INTO "users" ("id", "username", "first_name", "last_name")
+            SELECT "id", 'bench_' || "id", 'Bench', 'User ' || "id"
+            FROM generate_series(%(first)s::int, %(last)s::int) AS "id"
+        ''', params)
+
+        connection.execute('''
+            INSERT INTO "books" ("owner_id", "title")
+            SELECT "owner_id", 'Book ' || "i"
+            FROM generate_series(%(first)s::int, %(last)s::int) AS "owner_id", generate_series(1, %(books)s) AS "i"
+        ''', params)
+
+        connection.execute(f'''
+            INSERT INTO "notes" ("book_id", "title", "text")
+            SELECT "books"."id", left({words('2 + "i" %% 3')}, 64), {words('20 + "i" %% 60')}
+            FROM "books", generate_series(1, %(notes)s) AS "i"
+            WHERE "books"."owner_id" >= %(first)s
+        ''', params)
+
+        connection.execute('''
+            INSERT INTO "task_lists" ("owner_id", "title")
+            SELECT "owner_id", 'List ' || "i"
+            FROM generate_series(%(first)s::int, %(last)s::int) AS "owner_id", generate_series(1, %(task_lists)s) AS "i"
+        ''', params)
+
+        connection.execute(f'''
+            INSERT INTO "tasks" ("task_list_id", "text", "is_done", "position")
+            SELECT "task_lists"."id", left({words('1 + "i" %% 4')}, 64), random() < 0.3, "i" - 1
+            FROM "task_lists", generate_series(1, %(tasks)s) AS "i"
+            WHERE "task_lists"."owner_id" >= %(first)s
+        ''', params)
+
+        connection.execute('''
+            INSERT INTO "user_statistics" ("user_id", "books", "notes", "task_lists", "tasks", "done_tasks")
+            SELECT
+                "users"."id",
+                %(books)s,
+                %(books)s * %(notes)s,
+                %(task_lists)s,
+                %(task_lists)s * %(tasks)s,
+                (SELECT COUNT(1) FROM "tasks" JOIN "task_lists" ON "tasks"."task_list_id" = "task_lists"."id" WHERE "task_lists"."owner_id" = "users"."id" AND "tasks"."is_done")
+            FROM "users"
+            WHERE "users"."id" >= %(first)s
+        ''', params)
+
+    connection.execute('ANALYZE')
+
+
+def main() -> None:
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description='Seed a throwaway database with benchmark users and their data')
+    parser.add_argument('--dbname', default=os.environ.get('BENCHMARK_DBNAME', 'notes_benchmark'), help='database to create and fill, never point this at real data')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=5, help='books per user')
+    parser.add_argument('--notes', type=int, default=20, help='notes per book')
+    parser.add_argument('--task-lists', type=int, default=3, help='task lists per user')
+    parser.add_argument('--tasks', type=int, default=8, help='tasks per task list')
+    parser.add_argument('--seed', type=float, default=0.42, help='random seed in [-1, 1], the same seed gives the same data')
+    args = parser.parse_args()
+
+    host, port = os.environ['POSTGRES_HOST'], int(os.environ['POSTGRES_PORT'])
+    user, password = os.environ['POSTGRES_USER'], os.environ['POSTGRES_PASSWD']
+
+    # Creates the database and applies the migrations
+    DBHelper(host, port, user, password, args.dbname).close()
+
+    started = perf_counter()
+    with psycopg.connect(f'host={host} port={port} user={user} password={password} dbname={args.dbname}', autocommit=True) as connection:
+        seed(connection, args.users, args.books, args.notes, args.task_lists, args.tasks, args.seed)
+    elapsed = perf_counter() - started
+
+    notes = args.users * args.books * args.notes
+    tasks = args.users * args.task_lists * args.tasks
+    print(f'seeded {args.dbname}: {args.users} users, {args.users * args.books} books, {notes} notes, {args.users * args.task_lists} task lists, {tasks} tasks in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+from collections import OrderedDict
+from statistics import median
+from time import perf_counter
+from typing import Any
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Book, Note, TaskList, Task
+from serializer import Serializer, create_serializer, orjson
+
+
+REPEATS = 50
+
+
+def legacy_json(obj: Any) -> dict[str, Any]:
+    if isinstance(obj, (Book, TaskList)):
+        return {'id': str(obj.id), 'owner_id': obj.owner_id, 'title': obj.title}
+    if isinstance(obj, Note):
+        return {'id': str(obj.id), 'book_id': str(obj.book_id), 'title': obj.title, 'text': obj.text}
+    return {'id': str(obj.id), 'task_list_id': str(obj.task_list_id), 'title': obj.title, 'is_done': obj.is_done, 'position': obj.position}
+
+
+def legacy_result(result: dict[str, Any]) -> bytes:
+    return json.dumps(OrderedDict([('ok', True), ('result', result)])).encode()
+
+
+def payloads() -> dict[str, tuple[Any, Any]]:
+    books = [(Book(uuid4(), 1, f'Book number {i}'), i % 50) for i in range(1000)]
+    notes = [Note(uuid4(), uuid4(), f'Заметка {i}', 'Lorem ipsum dolor sit amet, "consectetur" adipiscing elit.\n' * 16) for i in range(1000)]
+    task_lists = [(TaskList(uuid4(), 1, f'List {i}'), [Task(uuid4(), uuid4(), f'Task {j}', j % 3 == 0, j) for j in range(20)]) for i in range(100)]
+
+    return {
+        'get_books 1000': (
+            lambda: legacy_result({'entries': [(legacy_json(book), amount) for book, amount in books], 'next': None}),
+            {'entries': books, 'next': None}
+        ),
+        'get_notes 1000x1KB': (
+            lambda: legacy_result({'notes': [legacy_json(note) for note in notes], 'next': None}),
+            {'notes': notes, 'next': None}
+        ),
+        'get_task_lists 100x20': (
+            lambda: legacy_result({'entries': [{'task_list': legacy_json(task_list), 'tasks': [legacy_json(task) for task in tasks]} for task_list, tasks in task_lists]}),
+            {'entries': [{'task_list': task_list, 'tasks': tasks} for task_list, tasks in task_lists]}
+        )
+    }
+
+
+def measure(f) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        started = perf_counter()
+        f()
+        timings.append(perf_counter() - started)
+    return median(timings) * 1000
+
+
+def main() -> None:
+    serializers: list[Serializer] = [create_serializer('json')] + ([create_serializer('orjson')] if orjson is not None else [])
+
+    print(f'{"payload":<24} {"legacy ms":>10}' + ''.join(f' {serializer.name + " ms":>10}' for serializer in serializers))
+    for name, (legacy, result) in payloads().items():
+        expected = json.loads(legacy())
+        for serializer in serializers:
+            assert json.loads(serializer.dumps({'ok': True, 'result': result})) == expected, serializer.name
+        timings = [measure(lambda: serializer.dumps({'ok': True, 'result': result})) for serializer in serializers]
+        print(f'{name:<24} {measure(legacy):>10.2f}' + ''.join(f' {timing:>10.2f}' for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import os
+import sys
+from statistics import median
+from time import perf_counter
+
+import dotenv
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DBHelper, TaskList, Task
+
+
+USER_ID = 1_000_000_001
+LIST_COUNTS = (1, 10, 50, 200)
+TASKS_PER_LIST = 5
+REPEATS = 20
+
+
+class RoundTripCounter:
+
+    def __init__(self) -> None:
+        self.amount = 0
+        self.__execute = psycopg.Cursor.execute
+
+    def __enter__(self) -> 'RoundTripCounter':
+        counter = self
+
+        def execute(cursor, *args, **kwargs):
+            counter.amount += 1
+            return counter.__execute(cursor, *args, **kwargs)
+
+        psycopg.Cursor.execute = execute # type: ignore
+        return self
+
+    def __exit__(self, *_) -> None:
+        psycopg.Cursor.execute = self.__execute # type: ignore
+
+
+def get_task_lists_n_plus_one(connection: psycopg.Connection, owner_id: int) -> list[tuple[TaskList, list[Task]]]:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT "id", "owner_id", "title" FROM "task_lists" WHERE "owner_id" = %s AND "deleted_at" IS NULL', (owner_id, ))
+        task_lists = [TaskList(*row) for row in cursor.fetchall()]
+        result = []
+        for task_list in task_lists:
+            cursor.execute('SELECT "id", "task_list_id", "text", "is_done", "position" FROM "tasks" WHERE "task_list_id" = %s', (task_list.id, ))
+            result.append((task_list, [Task(*row) for row in cursor.fetchall()]))
+        return result
+
+
+def measure(f) -> tuple[int, float]:
+    with RoundTripCounter() as counter:
+        f()
+    timings = []
+    for _ in range(REPEATS):
+        started = perf_counter()
+        f()
+        timings.append(perf_counter() - started)
+    return counter.amount, median(timings) * 1000
+
+
+def main() -> None:
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description='Compare round trips and time of loading task lists one by one and with a join')
+    parser.add_argument('--dbname', default='notes_benchmark_task_lists', help='throwaway database to create and drop, never point this at real data')
+    args = parser.parse_args()
+    if args.dbname == os.environ.get('POSTGRES_DBNAME'):
+        parser.error('the benchmark database is dropped afterwards, it must not be the application one')
+
+    host, port = os.environ['POSTGRES_HOST'], int(os.environ['POSTGRES_PORT'])
+    user, password = os.environ['POSTGRES_USER'], os.environ['POSTGRES_PASSWD']
+
+    try:
+        # Creates the database and applies the migrations
+        database = DBHelper(host, port, user, password, args.dbname)
+        connection = psycopg.connect(f'host={host} port={port} user={user} password={password} dbname={args.dbname}', autocommit=True)
+        database.upsert_user(USER_ID, None, 'benchmark', None)
+
+        print(f'{"lists":>6} {"n+1 trips":>10} {"n+1 ms":>10} {"join trips":>11} {"join ms":>10}')
+        created = 0
+        try:
+            for amount in LIST_COUNTS:
+                for i in range(created, amount):
+                    database.create_task_list(USER_ID, f'list {i}', [f'task {j}' for j in range(TASKS_PER_LIST)])
+                created = amount
+
+                legacy_trips, legacy_ms = measure(lambda: get_task_lists_n_plus_one(connection, USER_ID))
+                joined_trips, joined_ms = measure(lambda: database.get_task_lists(USER_ID))
+                print(f'{amount:>6} {legacy_trips:>10} {legacy_ms:>10.2f} {joined_trips:>11} {joined_ms:>10.2f}')
+        finally:
+            connection.close()
+            database.close()
+    finally:
+        with psycopg.connect(f'host={host} port={port} user={user} password={password}', autocommit=True) as maintenance:
+            maintenance.execute(f'DROP DATABASE IF EXISTS "{args.dbname}" WITH (FORCE)') # type: ignore
+
+
+if __name__ == '__main__':
+    main()
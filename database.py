@@ -1,344 +1,687 @@
-from typing import Any
-from uuid import UUID
+import os
+import re
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from threading import Event, Lock, RLock, Thread
+from time import monotonic, perf_counter, sleep
+from typing import IO, Any, TypeVar
+from uuid import UUID, uuid4
 
 import psycopg
+from psycopg.pq import TransactionStatus
+from psycopg.rows import RowFactory, args_row, tuple_row
+from psycopg_pool import ConnectionPool
 
+from queries import TABLE_NOTES, TABLE_TASK_LISTS, Query, Queries
+from serializer import encode_string
+from user_cache import CHANNEL, TOPIC_USER, TOPIC_VERSION, TOPIC_BOOKS, TOPIC_TASK_LISTS, UserCache, notes_topic
 
+
+T = TypeVar('T')
+
+
+@dataclass(slots=True)
 class User:
 
-    def __init__(self, id: int, username: str | None, first_name: str, last_name: str | None) -> None:
-        self.id: int = id
-        self.username: str | None = username
-        self.first_name: str = first_name
-        self.last_name: str | None = last_name
+    id: int
+    username: str | None
+    first_name: str
+    last_name: str | None
 
-    def to_json(self) -> dict[str, Any]:
-        return {
-            'id': self.id,
-            'username': self.username,
-            'first_name': self.first_name,
-            'last_name': self.last_name
-        }
+    def to_json_string(self) -> str:
+        return f'{{"id":{self.id},"username":{encode_string(self.username)},"first_name":{encode_string(self.first_name)},"last_name":{encode_string(self.last_name)}}}'
+
+
+@dataclass(slots=True)
+class UserStatistics:
+
+    books: int
+    notes: int
+    task_lists: int
+    tasks: int
+    done_tasks: int
 
+    def to_json_string(self) -> str:
+        return f'{{"books":{self.books},"notes":{self.notes},"task_lists":{self.task_lists},"tasks":{self.tasks},"done_tasks":{self.done_tasks}}}'
 
+
+@dataclass(slots=True)
 class Book:
 
-    def __init__(self, id: UUID, owner_id: int, title: str) -> None:
-        self.id: UUID = id
-        self.owner_id: int = owner_id
-        self.title: str = title
+    id: UUID
+    owner_id: int
+    title: str
 
-    def to_json(self) -> dict[str, Any]:
-        return {
-            'id': str(self.id),
-            'owner_id': self.owner_id,
-            'title': self.title
-        }
+    def to_json_string(self) -> str:
+        return f'{{"id":"{self.id}","owner_id":{self.owner_id},"title":{encode_string(self.title)}}}'
 
 
+@dataclass(slots=True)
 class Note:
 
-    def __init__(self, id: UUID, book_id: UUID, title: str, text: str) -> None:
-        self.id: UUID = id
-        self.book_id: UUID = book_id
-        self.title: str = title
-        self.text: str = text
+    id: UUID
+    book_id: UUID
+    title: str
+    text: str
 
-    def to_json(self) -> dict[str, Any]:
-        return {
-            'id': str(self.id),
-            'book_id': str(self.book_id),
-            'title': self.title,
-            'text': self.text
-        }
+    def to_json_string(self) -> str:
+        return f'{{"id":"{self.id}","book_id":"{self.book_id}","title":{encode_string(self.title)},"text":{encode_string(self.text)}}}'
 
 
+@dataclass(slots=True)
 class TaskList:
 
-    def __init__(self, id: UUID, owner_id: int, title: str) -> None:
-        self.id: UUID = id
-        self.owner_id: int = owner_id
-        self.title: str = title
+    id: UUID
+    owner_id: int
+    title: str
 
-    def to_json(self) -> dict[str, Any]:
-        return {
-            'id': str(self.id),
-            'owner_id': self.owner_id,
-            'title': self.title
-        }
+    def to_json_string(self) -> str:
+        return f'{{"id":"{self.id}","owner_id":{self.owner_id},"title":{encode_string(self.title)}}}'
 
 
+@dataclass(slots=True)
 class Task:
 
-    def __init__(self, id: UUID, task_list_id: UUID, title: str, is_done: bool) -> None:
-        self.id: UUID = id
-        self.task_list_id: UUID = task_list_id
-        self.title: str = title
-        self.is_done: bool = is_done
+    id: UUID
+    task_list_id: UUID
+    title: str
+    is_done: bool
+    position: int
 
-    def to_json(self) -> dict[str, Any]:
-        return {
-            'id': str(self.id),
-            'task_list_id': str(self.task_list_id),
-            'title': self.title,
-            'is_done': self.is_done
-        }
+    def to_json_string(self) -> str:
+        return f'{{"id":"{self.id}","task_list_id":"{self.task_list_id}","title":{encode_string(self.title)},"is_done":{"true" if self.is_done else "false"},"position":{self.position}}}'
 
 
 class DBHelper:
 
-    __TABLE_USERS = 'users'
-    __TABLE_BOOKS = 'books'
-    __TABLE_NOTES = 'notes'
-    __TABLE_TASK_LISTS = 'task_lists'
-    __TABLE_TASKS = 'tasks'
+    __TABLE_MIGRATIONS = 'schema_migrations'
+
+    __STREAM_CHUNK_SIZE = 500
+    __COPY_CHUNK_SIZE = 65536
+
+    __MIGRATIONS_DIRECTORY = 'sql/migrations'
+    __MIGRATIONS_LOCK = 0x6e6f746573
+    __MIGRATION_NO_TRANSACTION = '-- migration: no-transaction'
+    __MIGRATION_LOCK_RETRY = 0.1
+    __CONCURRENT_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?"([^"]+)"', re.IGNORECASE)
 
 
     def __db_connect(self, host: str, port: int, user: str, password: str, dbname: str | None = None):
         if dbname:
-            self.__database = psycopg.connect(f'host={host} port={port} user={user} password={password} dbname={dbname}', autocommit=True)
+            self.__conninfo = f'host={host} port={port} user={user} password={password} dbname={dbname}'
         else:
-            self.__database = psycopg.connect(f'host={host} port={port} user={user} password={password}', autocommit=True)
-
-
-    def __init__(self, host: str, port: int, user: str, password: str, dbname: str) -> None:
-
-        self.__db_connect(host, port, user, password)
-        try:
-            self.__database.execute(f'CREATE DATABASE "{dbname}"') # type: ignore
-        except psycopg.errors.DuplicateDatabase:
-            pass
+            self.__conninfo = f'host={host} port={port} user={user} password={password}'
+        self.__database = psycopg.connect(self.__conninfo, autocommit=True)
+        self.__configure(self.__database)
+
+
+    def __configure(self, connection: psycopg.Connection):
+        # Keep every registered statement prepared instead of evicting the least recently used ones
+        connection.prepared_max = max(connection.prepared_max, len(Query.registry))
+
+
+    def __init__(self, host: str, port: int, user: str, password: str, dbname: str, pool_min_size: int = 0, pool_max_size: int = 0, pool_timeout: float = 30.0, statistics_ttl: float = 5.0, statistics_estimate: bool = False, cache_size: int = 0, purge_interval: float = 0.0, purge_batch_size: int = 1000, purge_delay: float = 0.1, migrate: bool = True) -> None:
+
+        self.__pool: ConnectionPool | None = None
+        self.__database: psycopg.Connection | None = None
+        self.__database_lock = RLock()
+        self.__session: ContextVar[psycopg.Connection | None] = ContextVar('session', default=None)
+
+        self.__cache: UserCache | None = None
+        self.__cache_id = uuid4().hex
+        self.__listener: Thread | None = None
+        self.__listener_stopped = Event()
+
+        self.__purge_interval = purge_interval
+        self.__purge_batch_size = purge_batch_size
+        self.__purge_delay = purge_delay
+        self.__purger: Thread | None = None
+        self.__purger_stopped = Event()
+        self.__purger_wakeup = Event()
+
+        self.__statistics_ttl = statistics_ttl
+        self.__statistics_estimate = statistics_estimate
+        self.__statistics_lock = Lock()
+        self.__statistics: dict[str, int] = {}
+        self.__statistics_expires_at = 0.0
+
+        # Forked workers skip this, the database was already created and migrated once before they started
+        if migrate:
+            self.__db_connect(host, port, user, password)
+            try:
+                self.__database.execute(f'CREATE DATABASE "{dbname}"') # type: ignore
+            except (psycopg.errors.DuplicateDatabase, psycopg.errors.UniqueViolation):
+                # Starters racing to create it fail on the catalog's unique index instead
+                pass
 
         self.__db_connect(host, port, user, password, dbname)
 
-        with self.__database.cursor() as cursor:
-            cursor.execute(open('sql/create_tables.sql').read()) # type: ignore
+        if migrate:
+            self.__migrate()
+
+        if pool_max_size > 0:
+            self.__database.close()
+            self.__pool = ConnectionPool(
+                self.__conninfo,
+                kwargs={'autocommit': True},
+                min_size=max(pool_min_size, 1),
+                max_size=max(pool_min_size, pool_max_size),
+                timeout=pool_timeout,
+                configure=self.__configure,
+                check=ConnectionPool.check_connection,
+                name='notes'
+            )
+            self.__pool.wait()
+
+        if cache_size > 0:
+            self.__cache = UserCache(cache_size)
+            self.__listener = Thread(target=self.__listen, name='notes-cache-listener', daemon=True)
+            self.__listener.start()
+
+        if purge_interval > 0:
+            self.__purger = Thread(target=self.__purge, name='notes-purger', daemon=True)
+            self.__purger.start()
+
+
+    def __migrate(self):
+        with self.__connection() as connection, connection.cursor() as cursor:
+            # Waiting in pg_advisory_lock would keep a statement open, and CREATE INDEX CONCURRENTLY in
+            # the starter holding the lock waits for every open statement, so the waiters poll instead
+            while not cursor.execute('SELECT pg_try_advisory_lock(%s)', (DBHelper.__MIGRATIONS_LOCK, )).fetchone()[0]: # type: ignore
+                sleep(DBHelper.__MIGRATION_LOCK_RETRY)
+            try:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS "{DBHelper.__TABLE_MIGRATIONS}"
+                    (
+                        "version" INT NOT NULL,
+                        "name" VARCHAR(128) NOT NULL,
+                        "applied_at" TIMESTAMPTZ NOT NULL DEFAULT now(),
+
+                        CONSTRAINT "pk_schema_migration_version"
+                            PRIMARY KEY ("version")
+                    )
+                ''')
+                cursor.execute(f'''
+                    SELECT "version"
+                    FROM "{DBHelper.__TABLE_MIGRATIONS}"
+                ''')
+                applied: set[int] = {row[0] for row in cursor.fetchall()}
+
+                for filename in sorted(os.listdir(DBHelper.__MIGRATIONS_DIRECTORY)):
+                    if not filename.endswith('.sql') or (version := int(filename.split('_', 1)[0])) in applied:
+                        continue
+
+                    script = open(os.path.join(DBHelper.__MIGRATIONS_DIRECTORY, filename)).read()
+                    if script.startswith(DBHelper.__MIGRATION_NO_TRANSACTION):
+                        # Statements such as CREATE INDEX CONCURRENTLY can't run inside a transaction block
+                        for statement in script.split(';'):
+                            if any(line.strip() and not line.strip().startswith('--') for line in statement.splitlines()):
+                                self.__execute_concurrently(cursor, statement)
+                        self.__record_migration(cursor, version, filename)
+                    else:
+                        with connection.transaction():
+                            cursor.execute(script) # type: ignore
+                            self.__record_migration(cursor, version, filename)
+            finally:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', (DBHelper.__MIGRATIONS_LOCK, ))
+
+
+    def __execute_concurrently(self, cursor: psycopg.Cursor, statement: str):
+        index = match[1] if (match := DBHelper.__CONCURRENT_INDEX.search(statement)) else None
+
+        # A failed concurrent build leaves an invalid index behind, which IF NOT EXISTS would then skip for good
+        if index is not None and self.__index_is_invalid(cursor, index):
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"') # type: ignore
+
+        cursor.execute(statement) # type: ignore
+
+        if index is not None and self.__index_is_invalid(cursor, index):
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"') # type: ignore
+            raise RuntimeError(f'index {index} was left invalid, the migration will be retried on the next start')
+
+
+    def __index_is_invalid(self, cursor: psycopg.Cursor, index: str) -> bool:
+        cursor.execute('SELECT NOT "indisvalid" FROM "pg_index" WHERE "indexrelid" = to_regclass(%s)', (f'"{index}"', ))
+        return bool((row := cursor.fetchone()) and row[0])
+
+
+    def __record_migration(self, cursor: psycopg.Cursor, version: int, name: str):
+        cursor.execute(f'''
+            INSERT INTO "{DBHelper.__TABLE_MIGRATIONS}" ("version", "name")
+            VALUES (%s, %s)
+        ''', (version, name))
+
+
+    @contextmanager
+    def session(self, snapshot: bool = False) -> Iterator[None]:
+        if self.__session.get() is not None:
+            yield
+            return
+        with self.__connection() as connection:
+            # Every call made inside the session reuses this connection instead of checking one out of the pool
+            token = self.__session.set(connection)
+            try:
+                if snapshot:
+                    with connection.transaction():
+                        connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+                        yield
+                else:
+                    yield
+            finally:
+                self.__session.reset(token)
+
+
+    @contextmanager
+    def __connection(self) -> Iterator[psycopg.Connection]:
+        if (connection := self.__session.get()) is not None:
+            yield connection
+        elif self.__pool:
+            with self.__pool.connection() as connection:
+                yield connection
+        else:
+            # Without a pool every thread shares one connection, so it's held for the whole block,
+            # otherwise other threads' statements would run inside a transaction or snapshot opened here
+            with self.__database_lock:
+                if self.__database.closed or self.__database.broken:
+                    self.__database = psycopg.connect(self.__conninfo, autocommit=True)
+                    self.__configure(self.__database)
+                yield self.__database
+
+
+    def __cached(self, key: tuple[Any, ...], load: Callable[[], T]) -> T:
+        # A snapshot may predate writes that were already invalidated, so its reads neither use nor fill the cache
+        if self.__cache is None or ((connection := self.__session.get()) is not None and connection.info.transaction_status != TransactionStatus.IDLE):
+            return load()
+        if (value := self.__cache.get(key)) is not None:
+            return value
+        started = self.__cache.begin()
+        value = load()
+        if value is not None:
+            self.__cache.put(key, value, started)
+        return value
+
+
+    @contextmanager
+    def __invalidating(self, user_id: int, *topics: str, transaction: bool = False) -> Iterator[tuple[psycopg.Cursor, str | None]]:
+        # The payload is passed to the write statement itself, which notifies the other workers when it commits
+        payload: str | None = f'{self.__cache_id} {user_id} {",".join(topics)}' if self.__cache is not None else None
+        with self.__connection() as connection, connection.transaction() if transaction else nullcontext(), connection.cursor() as cursor:
+            yield cursor, payload
+        # Entries are dropped only once the write is committed, otherwise a concurrent read could cache the old rows again
+        if self.__cache is not None:
+            self.__cache.invalidate(user_id, list(topics))
+
+
+    def __listen(self):
+        while not self.__listener_stopped.is_set():
+            try:
+                with psycopg.connect(self.__conninfo, autocommit=True) as connection:
+                    connection.execute(f'LISTEN "{CHANNEL}"')
+                    # Invalidations sent while nobody was listening are lost, so everything cached before is dropped
+                    self.__cache.clear(enabled=True) # type: ignore
+                    for notify in connection.notifies():
+                        if self.__listener_stopped.is_set():
+                            return
+                        self.__receive(notify.payload)
+            except psycopg.Error:
+                self.__cache.clear(enabled=False) # type: ignore
+                self.__listener_stopped.wait(1.0)
+
+
+    def __receive(self, payload: str):
+        sender, user_id, topics = payload.split(' ', 2) if payload.count(' ') >= 2 else ('', '', '')
+        if sender and sender != self.__cache_id:
+            self.__cache.invalidate(int(user_id), topics.split(',')) # type: ignore
+
+
+    def __purge(self):
+        while not self.__purger_stopped.is_set():
+            try:
+                # A connection of its own, so purging never waits for or holds up a pooled one
+                with psycopg.connect(self.__conninfo, autocommit=True) as connection, connection.cursor() as cursor:
+                    self.__configure(connection)
+                    while not self.__purger_stopped.is_set():
+                        if self.__purge_batch(cursor):
+                            # Every batch commits on its own and the pause lets the requests waiting on its locks through
+                            self.__purger_stopped.wait(self.__purge_delay)
+                        else:
+                            self.__purger_wakeup.wait(self.__purge_interval)
+                            self.__purger_wakeup.clear()
+            except psycopg.Error:
+                self.__purger_stopped.wait(1.0)
+
+
+    def __purge_batch(self, cursor: psycopg.Cursor) -> int:
+        purged = 0
+        for query in (Queries.PurgeNotes, Queries.PurgeBooks, Queries.PurgeTasks, Queries.PurgeTaskLists):
+            self.__execute(cursor, query, (self.__purge_batch_size, ))
+            purged += cursor.rowcount
+        return purged
+
+
+    def cache_stats(self) -> dict[str, float]:
+        return self.__cache.stats() if self.__cache else {}
+
+
+    def pool_stats(self) -> dict[str, int]:
+        if not self.__pool:
+            return {}
+        stats = self.__pool.get_stats()
+        return {
+            'pool_min': stats.get('pool_min', 0),
+            'pool_max': stats.get('pool_max', 0),
+            'pool_size': stats.get('pool_size', 0),
+            'pool_available': stats.get('pool_available', 0),
+            'in_use': stats.get('pool_size', 0) - stats.get('pool_available', 0),
+            'requests_waiting': stats.get('requests_waiting', 0),
+            'requests_num': stats.get('requests_num', 0),
+            'requests_queued': stats.get('requests_queued', 0),
+            'requests_wait_ms': stats.get('requests_wait_ms', 0),
+            'requests_timeouts': stats.get('requests_errors', 0),
+            'connections_lost': stats.get('connections_lost', 0),
+            'connections_errors': stats.get('connections_errors', 0)
+        }
 
 
 
-    def total_notes_amount(self) -> int:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT COUNT(1)
-                FROM "{DBHelper.__TABLE_NOTES}"
-            ''')
-            return result[0] if (result := cursor.fetchone()) else 0
+    def get_statistics(self) -> dict[str, int]:
+        with self.__statistics_lock:
+            if monotonic() < self.__statistics_expires_at:
+                return dict(self.__statistics)
 
+            with self.__connection() as connection, connection.cursor() as cursor:
+                self.__execute(cursor, Queries.EstimateStatistics if self.__statistics_estimate else Queries.GetStatistics)
+                statistics: dict[str, int] = {TABLE_NOTES: 0, TABLE_TASK_LISTS: 0} | dict(cursor.fetchall())
 
-    def total_task_lists_amount(self) -> int:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT COUNT(1)
-                FROM "{DBHelper.__TABLE_TASK_LISTS}"
-            ''')
-            return result[0] if (result := cursor.fetchone()) else 0
+            self.__statistics = statistics
+            self.__statistics_expires_at = monotonic() + self.__statistics_ttl
+            return dict(statistics)
 
 
+    def get_user_statistics(self, user_id: int) -> UserStatistics | None:
+        with self.__connection() as connection, connection.cursor() as cursor:
+            self.__execute(cursor, Queries.GetUserStatistics, (user_id, ), args_row(UserStatistics))
+            return cursor.fetchone()
 
-    def user_books_amount(self, user_id: int) -> int:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT COUNT(1)
-                FROM "{DBHelper.__TABLE_BOOKS}"
-                WHERE "owner_id" = %s
-            ''', (user_id, ))
-            return result[0] if (result := cursor.fetchone()) else 0
 
 
-    def user_notes_amount(self, user_id: int) -> int:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT COUNT(1)
-                FROM "{DBHelper.__TABLE_NOTES}"
-                WHERE "owner_id" = %s
-            ''', (user_id, ))
-            return result[0] if (result := cursor.fetchone()) else 0
+    def get_user_version(self, user_id: int) -> int | None:
+        def load() -> int | None:
+            with self.__connection() as connection, connection.cursor() as cursor:
+                self.__execute(cursor, Queries.GetUserVersion, (user_id, ))
+                return result[0] if (result := cursor.fetchone()) else None
+        return self.__cached((user_id, TOPIC_VERSION), load)
 
 
-    def user_task_lists_amount(self, user_id: int) -> int:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT COUNT(1)
-                FROM "{DBHelper.__TABLE_TASK_LISTS}"
-                WHERE "owner_id" = %s
-            ''', (user_id, ))
-            return result[0] if (result := cursor.fetchone()) else 0
+    def get_book_version(self, owner_id: int, book_id: UUID) -> int | None:
+        def load() -> int | None:
+            with self.__connection() as connection, connection.cursor() as cursor:
+                self.__execute(cursor, Queries.GetBookVersion, (owner_id, book_id))
+                return result[0] if (result := cursor.fetchone()) else None
+        return self.__cached((owner_id, notes_topic(book_id), TOPIC_VERSION), load)
 
 
 
     def get_user(self, id: int) -> User | None:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT *
-                FROM "{DBHelper.__TABLE_USERS}"
-                WHERE "id" = %s
-            ''', (id, ))
-            return User(*result) if (result := cursor.fetchone()) else None
+        def load() -> User | None:
+            with self.__connection() as connection, connection.cursor() as cursor:
+                self.__execute(cursor, Queries.GetUser, (id, ), args_row(User))
+                return cursor.fetchone()
+        return self.__cached((id, TOPIC_USER), load)
+
+
+    def upsert_user(self, id: int, username: str | None, first_name: str, last_name: str | None):
+        with self.__invalidating(id, TOPIC_USER, TOPIC_VERSION) as (cursor, notify):
+            self.__execute(cursor, Queries.UpsertUser, (id, username, first_name, last_name, notify))
 
 
-    def create_user(self, id: int, username: str | None, first_name: str, last_name: str | None):
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                INSERT INTO "{DBHelper.__TABLE_USERS}"
-                VALUES (%s, %s, %s, %s)
-            ''', (id, username, first_name, last_name))
 
+    def get_books(self, user_id: int, after: tuple[str, UUID] | None = None, limit: int | None = None) -> list[tuple[Book, int]]:
+        def load() -> list[tuple[Book, int]]:
+            with self.__connection() as connection, connection.cursor() as cursor:
+                if after:
+                    self.__execute(cursor, Queries.GetBooksAfter, (user_id, *after, limit))
+                else:
+                    self.__execute(cursor, Queries.GetBooks, (user_id, limit))
+                return [(Book(*row[:-1]), row[-1]) for row in cursor.fetchall()]
+        return self.__cached((user_id, TOPIC_BOOKS, after, limit), load)
 
 
-    def get_books(self, user_id: int) -> list[tuple[Book, int]]:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT "{DBHelper.__TABLE_BOOKS}".*, COUNT("{DBHelper.__TABLE_NOTES}"."id") AS "notes_amount"
-                FROM "{DBHelper.__TABLE_BOOKS}" LEFT JOIN "{DBHelper.__TABLE_NOTES}" ON "{DBHelper.__TABLE_BOOKS}"."id" = "{DBHelper.__TABLE_NOTES}"."book_id"
-                WHERE "{DBHelper.__TABLE_BOOKS}"."owner_id" = %s
-                GROUP BY "{DBHelper.__TABLE_BOOKS}"."id"
-                ORDER BY "{DBHelper.__TABLE_BOOKS}"."title"
-            ''', (user_id, ))
-            return [(Book(*row[:-1]), row[-1]) for row in cursor.fetchall()]
+    def stream_books(self, user_id: int) -> Iterator[tuple[Book, int]]:
+        return ((Book(*row[:-1]), row[-1]) for row in self.__stream(Queries.StreamBooks, (user_id, None)))
 
 
     def create_book(self, owner_id: int, title: str) -> Book:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                INSERT INTO "{self.__TABLE_BOOKS}" ("owner_id", "title")
-                VALUES (%s, %s)
-                RETURNING *
-            ''', (owner_id, title))
-            return Book(*cursor.fetchone()) # type: ignore
+        with self.__invalidating(owner_id, TOPIC_BOOKS, TOPIC_VERSION) as (cursor, notify):
+            self.__execute(cursor, Queries.CreateBook, (owner_id, title, owner_id, notify), args_row(Book))
+            return cursor.fetchone() # type: ignore
 
 
     def delete_book(self, owner_id: int, book_id: UUID) -> Book | None:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                DELETE FROM "{DBHelper.__TABLE_BOOKS}"
-                WHERE "owner_id" = %s AND "id" = %s
-                RETURNING *
-            ''', (owner_id, book_id))
-            return Book(*result) if (result := cursor.fetchone()) else None
+        # A note inserted concurrently updates the book's row too, so the update waits for it and subtracts the amount it left
+        with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION) as (cursor, notify):
+            self.__execute(cursor, Queries.DeleteBook, (owner_id, book_id, owner_id, notify), args_row(Book))
+            book: Book | None = cursor.fetchone()
+        self.__purger_wakeup.set()
+        return book
 
 
 
-    def get_notes(self, owner_id: int, book_id: UUID) -> list[Note]:
-        self.__check_user_book_exists(owner_id, book_id)
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT *
-                FROM "{DBHelper.__TABLE_NOTES}"
-                WHERE "book_id" = %s
-            ''', (book_id, ))
-            return [Note(*result) for result in cursor.fetchall()]
+    def get_notes(self, owner_id: int, book_id: UUID, after: UUID | None = None, limit: int | None = None) -> list[Note]:
+        def load() -> list[Note]:
+            with self.__connection() as connection, connection.cursor() as cursor:
+                if after:
+                    self.__execute(cursor, Queries.GetNotesAfter, (after, limit, owner_id, book_id), args_row(Note))
+                else:
+                    self.__execute(cursor, Queries.GetNotes, (limit, owner_id, book_id), args_row(Note))
+                if not (notes := cursor.fetchall()):
+                    raise NotExistsException
+                return [note for note in notes if note.id is not None]
+        return self.__cached((owner_id, notes_topic(book_id), after, limit), load)
+
+
+    def stream_notes(self, owner_id: int, book_id: UUID) -> Iterator[Note]:
+        with self.__connection() as connection, connection.cursor() as cursor:
+            self.__check_user_book_exists(cursor, owner_id, book_id)
+        return self.__stream(Queries.StreamNotes, (book_id, ), args_row(Note))
+
+
+    def search_notes(self, owner_id: int, query: str, after: tuple[float, UUID] | None = None, limit: int | None = None) -> list[tuple[Note, float]]:
+        with self.__connection() as connection, connection.cursor() as cursor:
+            if after:
+                self.__execute(cursor, Queries.SearchNotesAfter, (query, owner_id, after[0], after[0], after[1], limit))
+            else:
+                self.__execute(cursor, Queries.SearchNotes, (query, owner_id, limit))
+            return [(Note(*row[:-1]), row[-1]) for row in cursor.fetchall()]
 
 
     def create_note(self, owner_id: int, book_id: UUID, title: str, text: str) -> Note:
-        self.__check_user_book_exists(owner_id, book_id)
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                INSERT INTO "{DBHelper.__TABLE_NOTES}" ("book_id", "title", "text")
-                VALUES (%s, %s, %s)
-                RETURNING *
-            ''', (book_id, title, text))
-            return Note(*cursor.fetchone()) # type: ignore
+        with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION) as (cursor, notify):
+            self.__execute(cursor, Queries.CreateNote, (title, text, owner_id, book_id, owner_id, notify), args_row(Note))
+            if not (note := cursor.fetchone()):
+                raise NotExistsException
+            return note
+
+
+    def create_notes(self, owner_id: int, book_id: UUID, notes: list[tuple[str, str]]) -> list[Note]:
+        with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION, transaction=True) as (cursor, notify):
+            self.__lock_user_book(cursor, owner_id, book_id)
+            if not notes:
+                return []
+            titles, texts = zip(*notes)
+            self.__execute(cursor, Queries.CreateNotes, (book_id, list(titles), list(texts), len(notes), owner_id, notify), args_row(Note))
+            return cursor.fetchall()
 
 
     def delete_note(self, owner_id: int, book_id: UUID, note_id: UUID) -> Note | None:
-        self.__check_user_book_exists(owner_id, book_id)
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                DELETE FROM "{DBHelper.__TABLE_NOTES}"
-                WHERE "book_id" = %s AND "id" = %s
-                RETURNING *
-            ''', (book_id, note_id))
-            return Note(*result) if (result := cursor.fetchone()) else None
+        with self.__invalidating(owner_id, TOPIC_BOOKS, notes_topic(book_id), TOPIC_VERSION) as (cursor, notify):
+            self.__execute(cursor, Queries.DeleteNote, (owner_id, book_id, note_id, owner_id, notify))
+            book_exists, *result = cursor.fetchone() # type: ignore
+            if not book_exists:
+                raise NotExistsException
+            return Note(*result) if result[0] is not None else None
 
 
 
     def get_task_lists(self, owner_id: int) -> list[tuple[TaskList, list[Task]]]:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT *
-                FROM "{DBHelper.__TABLE_TASK_LISTS}"
-                WHERE "owner_id" = %s
-            ''', (owner_id, ))
-            task_lists: list[TaskList] = [TaskList(*task_lists) for task_lists in cursor.fetchall()]
-
-        result: list[tuple[TaskList, list[Task]]] = []
-        for task_list in task_lists:
-            with self.__database.cursor() as cursor:
-                cursor.execute(f'''
-                    SELECT *
-                    FROM "{DBHelper.__TABLE_TASKS}"
-                    WHERE "task_list_id" = %s
-                ''', (task_list.id, ))
-                tasks: list[Task] = [Task(*task) for task in cursor.fetchall()]
-            result.append((task_list, tasks))
+        def load() -> list[tuple[TaskList, list[Task]]]:
+            with self.__connection() as connection, connection.cursor() as cursor:
+                self.__execute(cursor, Queries.GetTaskLists, (owner_id, ))
+                rows = cursor.fetchall()
+
+            result: dict[UUID, tuple[TaskList, list[Task]]] = {}
+            for row in rows:
+                if row[0] not in result:
+                    result[row[0]] = (TaskList(*row[:3]), [])
+                if row[3] is not None:
+                    result[row[0]][1].append(Task(*row[3:]))
 
-        return result
+            return list(result.values())
+        return self.__cached((owner_id, TOPIC_TASK_LISTS), load)
 
 
     def create_task_list(self, owner_id: int, title: str, tasks: list[str]) -> tuple[TaskList, list[Task]]:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                INSERT INTO "{DBHelper.__TABLE_TASK_LISTS}" ("owner_id", "title")
-                VALUES (%s, %s)
-                RETURNING *
-            ''', (owner_id, title))
-            _tasklist: TaskList = TaskList(*cursor.fetchone()) # type: ignore
-
-        with self.__database.cursor() as cursor:
-            _tasks: list[Task] = []
-            for task_list_id, text, is_done in ((_tasklist.id, task, False) for task in tasks):
-                cursor.execute(f'''
-                    INSERT INTO "{DBHelper.__TABLE_TASKS}" ("task_list_id", "text", "is_done")
-                    VALUES (%s, %s, %s)
-                    RETURNING *
-                ''', (task_list_id, text, is_done))
-                _tasks.append(Task(*cursor.fetchone())) # type: ignore
+        with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            self.__execute(cursor, Queries.CreateTaskList, (owner_id, title, owner_id, notify), args_row(TaskList))
+            _tasklist: TaskList = cursor.fetchone() # type: ignore
+            return _tasklist, self.__insert_tasks(cursor, owner_id, _tasklist.id, tasks, notify)
+
 
-        return _tasklist, _tasks
+    def create_tasks(self, owner_id: int, task_list_id: UUID, tasks: list[str]) -> list[Task]:
+        with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            self.__lock_user_task_list(cursor, owner_id, task_list_id)
+            return self.__insert_tasks(cursor, owner_id, task_list_id, tasks, notify)
 
 
     def delete_task_list(self, owner_id: int, task_list_id: UUID) -> TaskList | None:
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                DELETE FROM "{DBHelper.__TABLE_TASK_LISTS}"
-                WHERE "owner_id" = %s AND "id" = %s
-                RETURNING *
-            ''', (owner_id, task_list_id))
-            return TaskList(*result) if (result := cursor.fetchone()) else None
-
-
-
-    def __check_user_book_exists(self, owner_id: int, book_id: UUID):
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT EXISTS (
-                    SELECT 1
-                    FROM "{DBHelper.__TABLE_BOOKS}"
-                    WHERE "owner_id" = %s AND "id" = %s
-                    LIMIT 1
-                )
-            ''', (owner_id, book_id))
-            if not (result[0] if (result := cursor.fetchone()) else False):
+        with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION) as (cursor, notify):
+            self.__execute(cursor, Queries.DeleteTaskList, (owner_id, task_list_id, owner_id, notify), args_row(TaskList))
+            task_list: TaskList | None = cursor.fetchone()
+        self.__purger_wakeup.set()
+        return task_list
+
+
+    def update_tasks(self, owner_id: int, changes: list[tuple[UUID, str | None, bool | None, int | None]]) -> list[Task]:
+        ids, texts, dones, positions = (list(column) for column in zip(*changes))
+        with self.__invalidating(owner_id, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            self.__execute(cursor, Queries.UpdateTasks, (ids, texts, dones, positions, owner_id, owner_id, notify), args_row(Task))
+            tasks: list[Task] = cursor.fetchall()
+            # Any missing task was either not found or owned by someone else, the whole update is rolled back then
+            if len(tasks) != len(changes):
                 raise NotExistsException
+            return tasks
+
+
+
+    def export_data(self, owner_id: int) -> Iterator[Book | Note | TaskList | Task]:
+        with self.__connection() as connection, connection.transaction():
+            # All four reads share one snapshot, so no note or task refers to a parent the export doesn't contain
+            connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            for query, row_factory in ((Queries.ExportBooks, args_row(Book)), (Queries.ExportNotes, args_row(Note)), (Queries.ExportTaskLists, args_row(TaskList)), (Queries.ExportTasks, args_row(Task))):
+                with connection.cursor(name=f'export_{uuid4().hex}', row_factory=row_factory) as cursor:
+                    cursor.itersize = DBHelper.__STREAM_CHUNK_SIZE
+                    started = perf_counter()
+                    try:
+                        cursor.execute(query.sql, (owner_id, )) # type: ignore
+                    finally:
+                        query.record(perf_counter() - started, 0, (owner_id, ))
+                    yield from cursor
+
+
+    def import_data(self, owner_id: int, rows: dict[type, IO[bytes]], statistics: UserStatistics):
+        # The upload has already been read and validated into COPY rows, so the transaction is only as long as the COPYs themselves
+        amounts: dict[type, int] = {Book: statistics.books, Note: statistics.notes, TaskList: statistics.task_lists, Task: statistics.tasks}
+        with self.__invalidating(owner_id, TOPIC_BOOKS, TOPIC_TASK_LISTS, TOPIC_VERSION, transaction=True) as (cursor, notify):
+            self.__execute(cursor, Queries.LockUser, (owner_id, ))
+            if not cursor.fetchone():
+                raise NotExistsException
+            for kind, query in ((Book, Queries.CopyBooks), (Note, Queries.CopyNotes), (TaskList, Queries.CopyTaskLists), (Task, Queries.CopyTasks)):
+                started = perf_counter()
+                with cursor.copy(query.sql) as copy: # type: ignore
+                    while data := rows[kind].read(DBHelper.__COPY_CHUNK_SIZE):
+                        copy.write(data)
+                query.record(perf_counter() - started, amounts[kind])
+            self.__execute(cursor, Queries.AddUserStatistics, (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks, owner_id, notify))
+
+
+
+    def query_stats(self) -> dict[str, dict[str, float]]:
+        return {name: query.stats() for name, query in Query.registry.items()}
+
+
+    def __execute(self, cursor: psycopg.Cursor, query: Query, params: tuple[Any, ...] | None = None, row_factory: RowFactory | None = None):
+        if row_factory:
+            cursor.row_factory = row_factory
+        started = perf_counter()
+        try:
+            cursor.execute(query.sql, params, prepare=query.prepare) # type: ignore
+        finally:
+            query.record(perf_counter() - started, cursor.rowcount, params)
+
+
+    def __stream(self, query: Query, params: tuple[Any, ...], row_factory: RowFactory = tuple_row) -> Iterator[Any]:
+        with self.__connection() as connection, connection.transaction(), connection.cursor(name=f'stream_{uuid4().hex}', row_factory=row_factory) as cursor:
+            cursor.itersize = DBHelper.__STREAM_CHUNK_SIZE
+            started = perf_counter()
+            try:
+                cursor.execute(query.sql, params) # type: ignore
+            finally:
+                query.record(perf_counter() - started, 0, params)
+            yield from cursor
+
+
+    def __insert_tasks(self, cursor: psycopg.Cursor, owner_id: int, task_list_id: UUID, tasks: list[str], notify: str | None) -> list[Task]:
+        if not tasks:
+            return []
+        self.__execute(cursor, Queries.InsertTasks, (task_list_id, tasks, task_list_id, len(tasks), owner_id, notify), args_row(Task))
+        return cursor.fetchall()
+
+
+    def __check_user_book_exists(self, cursor: psycopg.Cursor, owner_id: int, book_id: UUID):
+        self.__execute(cursor, Queries.CheckUserBookExists, (owner_id, book_id))
+        if not (result[0] if (result := cursor.fetchone()) else False):
+            raise NotExistsException
+
+
+    def __lock_user_book(self, cursor: psycopg.Cursor, owner_id: int, book_id: UUID):
+        self.__execute(cursor, Queries.LockUserBook, (owner_id, book_id))
+        if not cursor.fetchone():
+            raise NotExistsException
+
+
+    def __lock_user_task_list(self, cursor: psycopg.Cursor, owner_id: int, task_list_id: UUID):
+        self.__execute(cursor, Queries.LockUserTaskList, (owner_id, task_list_id))
+        if not cursor.fetchone():
+            raise NotExistsException
 
 
-    def __check_user_task_list_exists(self, owner_id: int, task_list_id: UUID):
-        with self.__database.cursor() as cursor:
-            cursor.execute(f'''
-                SELECT EXISTS (
-                    SELECT 1
-                    FROM "{DBHelper.__TABLE_TASK_LISTS}"
-                    WHERE "owner_id" = %s AND "id" = %s
-                    LIMIT 1
-                )
-            ''', (owner_id, task_list_id))
-            if not (result[0] if (result := cursor.fetchone()) else False):
-                raise NotExistsException
 
+    def close(self):
+        if self.__listener is not None and not self.__listener_stopped.is_set():
+            self.__listener_stopped.set()
+            # Wakes the listener up from waiting on notifications so it sees the stop flag
+            try:
+                with self.__connection() as connection:
+                    connection.execute('SELECT pg_notify(%s, %s)', (CHANNEL, ''))
+            except psycopg.Error:
+                pass
+            self.__listener.join(5.0)
+        if self.__purger is not None and not self.__purger_stopped.is_set():
+            self.__purger_stopped.set()
+            self.__purger_wakeup.set()
+            self.__purger.join(5.0)
+        if self.__pool:
+            self.__pool.close()
+        elif self.__database is not None:
+            self.__database.close()
 
 
     def __del__(self):
-        self.__database.close()
+        # Nothing was set up when __init__ rejected its arguments
+        if hasattr(self, '_DBHelper__purger_wakeup'):
+            self.close()
 
 
 class NotExistsException(Exception):
@@ -3,6 +3,7 @@ from enum import Enum
 
 class HTTP(Enum):
     OK = 200
+    NotModified = 304
 
     BadRequest = 400
     Unauthorized = 401
@@ -24,18 +25,26 @@ class Method(Enum):
     GetUserStatistics = 'get_user_statistics'
     Login = 'login'
     GetMe = 'get_me'
+    Batch = 'batch'
 
     GetBooks ='get_books'
     CreateBook = 'create_book'
     DeleteBook = 'delete_book'
 
     GetNotes ='get_notes'
+    SearchNotes = 'search_notes'
     CreateNote = 'create_note'
+    CreateNotes = 'create_notes'
     DeleteNote = 'delete_note'
 
     GetTaskLists ='get_task_lists'
     CreateTaskList = 'create_task_list'
+    CreateTasks = 'create_tasks'
     DeleteTaskList = 'delete_task_list'
+    UpdateTasks = 'update_tasks'
+
+    ExportData = 'export_data'
+    ImportData = 'import_data'
 
 
 class ErrorTexts(Enum):
@@ -49,6 +58,7 @@ class ErrorTexts(Enum):
 
     DataIsNotFromTelegram = 'data is not from Telegram'
     DataIsOutdated = 'data is outdated'
+    DataIsAlreadyUsed = 'data has already been used'
 
     InternalServerError = 'internal server error'
 
@@ -60,3 +70,5 @@ class ErrorTexts(Enum):
     UserNotFound = 'user not found'
     BookNotFound = 'book not found'
     NoteNotFound = 'note not found'
+    TaskNotFound = 'task not found'
+    TaskListNotFound = 'task_list not found'
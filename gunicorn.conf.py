@@ -0,0 +1,68 @@
+import os
+from multiprocessing import cpu_count
+
+import dotenv
+
+
+dotenv.load_dotenv()
+
+bind = f"{os.environ['LISTEN_ADDR']}:{os.environ['LISTEN_PORT']}"
+certfile = os.environ['TLS_CERT']
+keyfile = os.environ['TLS_KEY']
+
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+
+preload_app = True
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+# Every worker thread can hold a connection, so size each worker's pool to its thread count
+os.environ.setdefault('POSTGRES_POOL_MIN_SIZE', '1')
+os.environ.setdefault('POSTGRES_POOL_MAX_SIZE', str(threads))
+
+# Besides its pool every worker keeps a connection for the cache listener and one for the purger.
+# All workers together stay within the budget, which by default leaves 20 of Postgres' default
+# max_connections=100 to superusers, migrations and other clients
+connection_budget = int(os.environ.get('POSTGRES_CONNECTION_BUDGET', 80))
+connections_per_worker = (
+    max(int(os.environ['POSTGRES_POOL_MAX_SIZE']), 1)
+    + (int(os.environ.get('USER_CACHE_SIZE', 1000)) > 0)
+    + (float(os.environ.get('PURGE_INTERVAL', 30.0)) > 0)
+)
+workers = int(os.environ.get('WEB_WORKERS', max(1, min(cpu_count() * 2 + 1, connection_budget // connections_per_worker))))
+
+
+def on_starting(server):
+    import psycopg
+
+    connections = workers * connections_per_worker
+    if connections > connection_budget:
+        server.log.warning(f'{workers} workers use up to {connections} connections, over the budget of {connection_budget}')
+    try:
+        with psycopg.connect(
+            host=os.environ['POSTGRES_HOST'],
+            port=int(os.environ['POSTGRES_PORT']),
+            user=os.environ['POSTGRES_USER'],
+            password=os.environ['POSTGRES_PASSWD'],
+            dbname=os.environ['POSTGRES_DBNAME'],
+            connect_timeout=10
+        ) as connection:
+            available = int(connection.execute('SHOW max_connections').fetchone()[0]) # type: ignore
+            available -= int(connection.execute('SHOW superuser_reserved_connections').fetchone()[0]) # type: ignore
+    except psycopg.Error as e:
+        server.log.warning(f'Could not check the connection budget against max_connections: {e}')
+        return
+    # Workers would fail to connect under load, so refuse to start instead
+    if connections > available:
+        raise RuntimeError(f'{workers} workers use up to {connections} connections, but Postgres allows only {available}')
+
+
+def worker_exit(server, worker):
+    # Gunicorn has already stopped accepting and waited for in-flight requests, so the pool can be drained
+    from app import close_database
+    close_database()
@@ -0,0 +1,898 @@
+import json
+import logging
+import sys
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from dataclasses import dataclass
+from hashlib import blake2b
+from tempfile import SpooledTemporaryFile
+from inspect import isawaitable
+from time import perf_counter, time
+
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Container, Generator, Iterable, Iterator
+from typing import IO, Any, TypeVar
+from uuid import UUID, uuid4
+
+import jwt
+import psycopg
+
+from database import User, UserStatistics, Book, Note, TaskList, Task, NotExistsException
+from enums import HTTP, Method, ErrorTexts
+from metrics import Metrics
+from queries import Query
+from serializer import Serializer
+from telegram_auth import TelegramAuth
+from tokens import TokenCache
+
+
+MAX_PAGE_SIZE = 1000
+SEARCH_PAGE_SIZE = 50
+MAX_BATCH_SIZE = 32
+MAX_TASK_CHANGES = 256
+MAX_BULK_SIZE = 1000
+IMPORT_CHUNK_SIZE = 65536
+MAX_IMPORT_SIZE = 1 << 30
+
+READ_ONLY_METHODS = frozenset((Method.GetStatistics, Method.GetUserStatistics, Method.GetMe, Method.GetBooks, Method.GetNotes, Method.SearchNotes, Method.GetTaskLists))
+
+# Streamed methods read or write the whole body themselves, so they can't be part of a batch
+UNBATCHABLE_METHODS = frozenset((Method.Login, Method.Batch, Method.ExportData, Method.ImportData))
+
+EXPORT_KINDS: dict[type, str] = {Book: 'book', Note: 'note', TaskList: 'task_list', Task: 'task'}
+
+T = TypeVar('T')
+
+# Handlers are generators that yield database calls, the framework drivers below either pass the result straight back or await it first
+Steps = Generator[Any, Any, T]
+
+logger = logging.getLogger('notes.api')
+
+
+
+@dataclass(slots=True)
+class Reply:
+    status: int
+    payload: Any = None
+    body: bytes | Iterable[bytes] | AsyncIterable[bytes] | None = None
+    content_type: str | None = 'application/json'
+    content_encoding: str | None = None
+    etag: str | None = None
+
+    def render(self, serializer: Serializer) -> bytes | Iterable[bytes] | AsyncIterable[bytes]:
+        return serializer.dumps(self.payload) if self.body is None else self.body
+
+
+@dataclass(slots=True)
+class Upload:
+    chunks: Iterable[bytes] | AsyncIterable[bytes]
+    compressed: bool
+
+
+@dataclass(frozen=True, slots=True)
+class Endpoint:
+    handler: Callable[..., Steps[Reply]]
+    check_token: bool
+    version: Callable[..., Steps[int | None]] | None
+    upload: bool
+
+
+ENDPOINTS: dict[Method, Endpoint] = {}
+
+
+def APIRequest(method: Method, check_token: bool, version: Callable[..., Steps[int | None]] | None = None, upload: bool = False) -> Callable[[Callable[..., Steps[Reply]]], Callable[..., Steps[Reply]]]:
+
+    def wrapper(f: Callable[..., Steps[Reply]]) -> Callable[..., Steps[Reply]]:
+        ENDPOINTS[method] = Endpoint(f, check_token, version, upload)
+        return f
+
+    return wrapper
+
+
+def APIResult(result: dict[str, Any]) -> Reply:
+    return Reply(HTTP.OK.value, {'ok': True, 'result': result})
+
+
+def APIError(http_code: int, description: str) -> Reply:
+    # Handlers turn any failure into a 500, this is the one place where the cause still gets logged
+    if http_code == HTTP.InternalServerError.value and sys.exc_info()[0] is not None:
+        logger.exception(description)
+    return Reply(http_code, {'ok': False, 'description': description})
+
+
+def APINotModified(etag: str) -> Reply:
+    return Reply(HTTP.NotModified.value, body=b'', content_type=None, etag=etag)
+
+
+def APIStream(serializer: Serializer, key: str, entries: Iterable[Any] | AsyncIterable[Any]) -> Reply:
+    head = b'{"ok":true,"result":{' + serializer.dumps(key) + b':['
+
+    def generate() -> Iterator[bytes]:
+        yield head
+        for i, entry in enumerate(entries): # type: ignore
+            yield (b',' if i else b'') + serializer.dumps(entry)
+        yield b']}}'
+
+    async def generate_async() -> AsyncIterator[bytes]:
+        yield head
+        i = 0
+        async for entry in entries: # type: ignore
+            yield (b',' if i else b'') + serializer.dumps(entry)
+            i += 1
+        yield b']}}'
+
+    return Reply(HTTP.OK.value, body=generate_async() if isinstance(entries, AsyncIterable) else generate())
+
+
+def APIExport(serializer: Serializer, entries: Iterable[Book | Note | TaskList | Task] | AsyncIterable[Book | Note | TaskList | Task], compress: bool) -> Reply:
+    kinds = {kind: f'{{"{name}":'.encode() for kind, name in EXPORT_KINDS.items()}
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(entry: Book | Note | TaskList | Task) -> bytes:
+        line = kinds[type(entry)] + serializer.dumps(entry) + b'}\n'
+        return line if compressor is None else compressor.compress(line)
+
+    def generate() -> Iterator[bytes]:
+        for entry in entries: # type: ignore
+            if chunk := encode(entry):
+                yield chunk
+        if compressor is not None:
+            yield compressor.flush()
+
+    async def generate_async() -> AsyncIterator[bytes]:
+        async for entry in entries: # type: ignore
+            if chunk := encode(entry):
+                yield chunk
+        if compressor is not None:
+            yield compressor.flush()
+
+    return Reply(HTTP.OK.value, body=generate_async() if isinstance(entries, AsyncIterable) else generate(), content_type='application/x-ndjson', content_encoding='gzip' if compress else None)
+
+
+
+def run(steps: Steps[T]) -> T:
+    try:
+        value = next(steps)
+        while True:
+            value = steps.send(value)
+    except StopIteration as e:
+        return e.value
+
+
+async def run_async(steps: Steps[T]) -> T:
+    try:
+        step = next(steps)
+        while True:
+            try:
+                value = await step if isawaitable(step) else step
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(value)
+    except StopIteration as e:
+        return e.value
+
+
+def enter(context: Any) -> Any:
+    return context.__aenter__() if hasattr(context, '__aenter__') else context.__enter__()
+
+
+def leave(context: Any, error: BaseException | None) -> Any:
+    args = (type(error), error, error.__traceback__) if error is not None else (None, None, None)
+    return context.__aexit__(*args) if hasattr(context, '__aexit__') else context.__exit__(*args)
+
+
+def collect(body: bytes | Iterable[bytes] | AsyncIterable[bytes]) -> Any:
+    if isinstance(body, bytes):
+        return body
+    if isinstance(body, AsyncIterable):
+
+        async def join() -> bytes:
+            return b''.join([chunk async for chunk in body]) # type: ignore
+
+        return join()
+    return b''.join(body)
+
+
+
+def make_etag(method: str, user_id: int, version: int, params: bytes) -> str:
+    return blake2b(f'{method}:{user_id}:{version}:'.encode() + params, digest_size=16).hexdigest()
+
+
+def encode_cursor(values: list[Any]) -> str:
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: Any, length: int) -> list[Any]:
+    values = json.loads(urlsafe_b64decode(str(cursor).encode()))
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError
+    return values
+
+
+def page_limit(params: dict[str, Any]) -> int | None:
+    if 'limit' not in params:
+        return None
+    # int() would also take floats and booleans, and raise TypeError for anything else that isn't a string
+    if isinstance(params['limit'], bool) or not isinstance(params['limit'], (int, str)):
+        raise ValueError
+    limit = int(params['limit'])
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError
+    return limit
+
+
+def stream_requested(params: dict[str, Any]) -> bool:
+    stream = bool(params.get('stream', False))
+    # A stream has no next cursor, so a limited one would silently drop the rest of the rows
+    if stream and ('limit' in params or params.get('after')):
+        raise ValueError
+    return stream
+
+
+def parse_batch(params: dict[str, Any]) -> list[tuple[Method, dict[str, Any], str | None]]:
+    if not isinstance(params['calls'], list):
+        raise ValueError
+    calls: list[tuple[Method, dict[str, Any], str | None]] = []
+    for call in params['calls']:
+        if not isinstance(call, dict) or not isinstance(call.get('params', {}), dict):
+            raise ValueError
+        method = Method(call['method'])
+        if method in UNBATCHABLE_METHODS:
+            raise ValueError
+        calls.append((method, call.get('params', {}), str(call['etag']) if call.get('etag') else None))
+    if not 1 <= len(calls) <= MAX_BATCH_SIZE:
+        raise ValueError
+    return calls
+
+
+def parse_task_changes(params: dict[str, Any]) -> list[tuple[UUID, str | None, bool | None, int | None]]:
+    if not isinstance(params['tasks'], list) or not 1 <= len(params['tasks']) <= MAX_TASK_CHANGES:
+        raise ValueError
+    changes: list[tuple[UUID, str | None, bool | None, int | None]] = []
+    for change in params['tasks']:
+        if not isinstance(change, dict) or not isinstance(change['id'], str):
+            raise ValueError
+        title, is_done, position = change.get('title'), change.get('is_done'), change.get('position')
+        if title is not None and (not isinstance(title, str) or not 1 <= len(title) <= 64):
+            raise ValueError
+        if is_done is not None and not isinstance(is_done, bool):
+            raise ValueError
+        if position is not None and (type(position) is not int or not 0 <= position < 2 ** 31):
+            raise ValueError
+        changes.append((UUID(change['id']), title, is_done, position))
+    if len({change[0] for change in changes}) != len(changes):
+        raise ValueError
+    return changes
+
+
+def bulk_list(value: Any) -> list[Any]:
+    if not isinstance(value, list) or not 1 <= len(value) <= MAX_BULK_SIZE:
+        raise ValueError
+    return value
+
+
+def bounded_text(value: Any, max_length: int) -> str:
+    if not isinstance(value, str) or not 1 <= len(value) <= max_length:
+        raise ValueError
+    return value
+
+
+def parse_import_entry(entry: Any) -> Book | Note | TaskList | Task:
+    if not isinstance(entry, dict) or len(entry) != 1:
+        raise ValueError
+    (kind, fields), = entry.items()
+    if not isinstance(fields, dict):
+        raise ValueError
+
+    # Owners are not taken from the file, everything is imported into the caller's account
+    if kind == EXPORT_KINDS[Book]:
+        return Book(UUID(fields['id']), 0, bounded_text(fields['title'], 64))
+    if kind == EXPORT_KINDS[Note]:
+        return Note(UUID(fields['id']), UUID(fields['book_id']), bounded_text(fields['title'], 64), bounded_text(fields['text'], 4096))
+    if kind == EXPORT_KINDS[TaskList]:
+        return TaskList(UUID(fields['id']), 0, bounded_text(fields['title'], 64))
+    if kind == EXPORT_KINDS[Task]:
+        if not isinstance(fields['is_done'], bool) or type(fields['position']) is not int or not 0 <= fields['position'] < 2 ** 31:
+            raise ValueError
+        return Task(UUID(fields['id']), UUID(fields['task_list_id']), bounded_text(fields['title'], 64), fields['is_done'], fields['position'])
+    raise ValueError
+
+
+class ImportSpool:
+
+    # Up to this much of every kind stays in memory, the rest of the upload goes to temporary files
+    __MEMORY_SIZE = 1 << 20
+    # The longest valid entry is a note with every character of its text escaped as a surrogate pair
+    __MAX_LINE_SIZE = 1 << 16
+    __COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+    def __init__(self, serializer: Serializer, owner_id: int, compressed: bool) -> None:
+        # The whole upload is read, validated and written out as COPY rows before the import transaction starts
+        self.rows: dict[type, IO[bytes]] = {kind: SpooledTemporaryFile(ImportSpool.__MEMORY_SIZE) for kind in EXPORT_KINDS}
+        self.__serializer = serializer
+        self.__owner_id = owner_id
+        self.__decompressor = zlib.decompressobj(wbits=31) if compressed else None
+        self.__pending = b''
+        self.__size = 0
+        self.__amounts: dict[type, int] = {kind: 0 for kind in EXPORT_KINDS}
+        self.__done_tasks = 0
+
+        # Imported books and task lists get new ids, so importing never collides with existing rows
+        self.__ids: dict[type, dict[UUID, UUID]] = {Book: {}, TaskList: {}}
+        self.__defined: dict[type, set[UUID]] = {Book: set(), TaskList: set()}
+        # Parent rows carry the amounts of their children, so they are written once the whole upload is read
+        self.__titles: dict[type, dict[UUID, str]] = {Book: {}, TaskList: {}}
+        self.__children: dict[UUID, int] = {}
+        self.__done_children: dict[UUID, int] = {}
+
+
+    def read(self, chunks: Iterable[bytes] | AsyncIterable[bytes]) -> Any:
+        if isinstance(chunks, AsyncIterable):
+
+            async def read_async() -> UserStatistics:
+                async for chunk in chunks: # type: ignore
+                    self.feed(chunk)
+                return self.finish()
+
+            return read_async()
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.finish()
+
+
+    def feed(self, chunk: bytes):
+        if self.__decompressor is None:
+            self.__split(chunk)
+            return
+        # Inflating in bounded steps keeps a small, highly compressed chunk from expanding all at once
+        while chunk:
+            self.__split(self.__decompressor.decompress(chunk, ImportSpool.__MAX_LINE_SIZE))
+            chunk = self.__decompressor.unconsumed_tail
+
+
+    def __split(self, data: bytes):
+        self.__size += len(data)
+        if self.__size > MAX_IMPORT_SIZE:
+            raise ValueError
+        *lines, self.__pending = (self.__pending + data).split(b'\n')
+        if len(self.__pending) > ImportSpool.__MAX_LINE_SIZE:
+            raise ValueError
+        for line in lines:
+            if line.strip():
+                self.__add(parse_import_entry(self.__serializer.loads(line)))
+
+
+    def finish(self) -> UserStatistics:
+        if self.__decompressor is not None and not self.__decompressor.eof:
+            raise ValueError
+        if self.__pending.strip():
+            self.__add(parse_import_entry(self.__serializer.loads(self.__pending)))
+        self.__pending = b''
+
+        # Parents may come after their children in the file, but every referenced one has to be there
+        if any(self.__ids[kind].keys() - self.__defined[kind] for kind in self.__ids):
+            raise ValueError
+        for kind, titles in self.__titles.items():
+            for id, title in titles.items():
+                row = (id, self.__owner_id, title, self.__children.get(id, 0))
+                if kind is TaskList:
+                    row += (self.__done_children.get(id, 0), )
+                self.rows[kind].write('\t'.join(map(str, row)).encode() + b'\n')
+        for rows in self.rows.values():
+            rows.seek(0)
+        return UserStatistics(self.__amounts[Book], self.__amounts[Note], self.__amounts[TaskList], self.__amounts[Task], self.__done_tasks)
+
+
+    def close(self):
+        for rows in self.rows.values():
+            rows.close()
+
+
+    def __add(self, entry: Book | Note | TaskList | Task):
+        if isinstance(entry, (Book, TaskList)):
+            if entry.id in self.__defined[type(entry)]:
+                raise ValueError
+            self.__defined[type(entry)].add(entry.id)
+            self.__titles[type(entry)][self.__new_id(type(entry), entry.id)] = self.__text(entry.title)
+            self.__amounts[type(entry)] += 1
+            return
+        if isinstance(entry, Note):
+            parent_id = self.__new_id(Book, entry.book_id)
+            row = (parent_id, self.__text(entry.title), self.__text(entry.text))
+        else:
+            parent_id = self.__new_id(TaskList, entry.task_list_id)
+            row = (parent_id, self.__text(entry.title), 't' if entry.is_done else 'f', entry.position)
+            self.__done_tasks += entry.is_done
+            self.__done_children[parent_id] = self.__done_children.get(parent_id, 0) + entry.is_done
+        self.__children[parent_id] = self.__children.get(parent_id, 0) + 1
+        self.rows[type(entry)].write('\t'.join(map(str, row)).encode() + b'\n')
+        self.__amounts[type(entry)] += 1
+
+
+    def __new_id(self, kind: type, id: UUID) -> UUID:
+        if (new_id := self.__ids[kind].get(id)) is None:
+            new_id = self.__ids[kind][id] = uuid4()
+        return new_id
+
+
+    def __text(self, value: str) -> str:
+        # Postgres text can't hold NUL characters
+        if '\x00' in value:
+            raise ValueError
+        return value.translate(ImportSpool.__COPY_ESCAPES)
+
+
+
+class API:
+
+    def __init__(self, database: Any, serializer: Serializer, token_cache: TokenCache, telegram_auth: TelegramAuth, metrics: Metrics) -> None:
+        # Either a DBHelper or an AsyncDBHelper, the handlers only ever yield its calls
+        self.database = database
+        self.serializer = serializer
+        self.token_cache = token_cache
+        self.telegram_auth = telegram_auth
+        self.metrics = metrics
+
+
+    def handle(self, method: Method, data: bytes | None, raw_token: str | None, if_none_match: Container[str], upload: Upload | None = None) -> Steps[Reply]:
+        started = perf_counter()
+        reply: Reply = yield from self.__handle(method, ENDPOINTS[method], data, raw_token, if_none_match, upload)
+        if self.metrics.enabled:
+            self.metrics.observe_request(method.value, reply.status, perf_counter() - started)
+        return reply
+
+
+    def __handle(self, method: Method, endpoint: Endpoint, data: bytes | None, raw_token: str | None, if_none_match: Container[str], upload: Upload | None) -> Steps[Reply]:
+        try:
+            params: dict[str, Any] = {} if endpoint.upload else self.serializer.loads(data) # type: ignore
+            if not isinstance(params, dict):
+                raise ValueError
+        except:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidRequestFormat.value)
+
+        if not endpoint.check_token:
+            return (yield from endpoint.handler(self, params))
+
+        if raw_token is None:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.AuthenticationHeaderNotFound.value)
+
+        try:
+            token: dict[str, Any] = self.token_cache.decode(raw_token)
+        except jwt.InvalidSignatureError:
+            return APIError(HTTP.Unauthorized.value, ErrorTexts.InvalidTokenSignature.value)
+        except jwt.ExpiredSignatureError:
+            return APIError(HTTP.Unauthorized.value, ErrorTexts.TokenHasExpired.value)
+        except jwt.InvalidTokenError:
+            return APIError(HTTP.Unauthorized.value, ErrorTexts.InvalidToken.value)
+
+        # The version stamp is a single indexed lookup, an unchanged resource skips the main query entirely
+        etag: str | None = (yield from self.request_etag(endpoint.version, method.value, token, params)) if endpoint.version else None
+        if etag is not None and etag in if_none_match:
+            return APINotModified(etag)
+
+        reply: Reply = yield from endpoint.handler(self, token, upload if endpoint.upload else params)
+        if etag is not None and reply.status == HTTP.OK.value:
+            reply.etag = etag
+        return reply
+
+
+    def request_etag(self, version: Callable[..., Steps[int | None]], method: str, token: dict[str, Any], params: dict[str, Any]) -> Steps[str | None]:
+        try:
+            stamp: int | None = yield from version(self, token, params)
+        except Exception:
+            # Invalid arguments or a failed lookup are reported by the handler itself
+            return None
+        return make_etag(method, token['sub'], stamp, self.serializer.dumps(params)) if stamp is not None else None
+
+
+    def batch_call(self, method: Method, token: dict[str, Any], params: dict[str, Any], etag: str | None) -> Steps[bytes]:
+        endpoint = ENDPOINTS[method]
+        current: str | None = (yield from self.request_etag(endpoint.version, method.value, token, params)) if endpoint.version else None
+        if current is not None and current == etag:
+            return b'{"ok":true,"not_modified":true}'
+
+        started = perf_counter()
+        reply: Reply = yield from (endpoint.handler(self, token, params) if endpoint.check_token else endpoint.handler(self, params))
+        data: bytes = yield collect(reply.render(self.serializer))
+        if self.metrics.enabled:
+            self.metrics.observe_request(method.value, reply.status, perf_counter() - started)
+        if current is None or reply.status != HTTP.OK.value:
+            return data
+        # A batch response has a single set of headers, so every entry carries its own ETag in the body
+        return b'{"etag":' + self.serializer.dumps(current) + b',' + data[1:]
+
+
+    def render_metrics(self) -> str:
+        statements = {name: (query.histogram, query.stats()) for name, query in Query.registry.items()}
+        gauges = {'db_pool': self.database.pool_stats(), 'user_cache': self.database.cache_stats(), 'token_cache': self.token_cache.stats()}
+        return self.metrics.render(statements, gauges)
+
+
+
+    def user_version(self, token: dict[str, Any], _: dict[str, Any]) -> Steps[int | None]:
+        return (yield self.database.get_user_version(token['sub']))
+
+
+    def book_version(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[int | None]:
+        return (yield self.database.get_book_version(token['sub'], UUID(params['book_id'])))
+
+
+
+    @APIRequest(Method.GetStatistics, False)
+    def get_statistics(self, _: dict[str, Any]) -> Steps[Reply]:
+        try:
+            return APIResult({'statistics': (yield self.database.get_statistics())})
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.FailedToGetStatistics.value)
+
+
+    @APIRequest(Method.GetUserStatistics, True)
+    def get_user_statistics(self, token: dict[str, Any], _: dict[str, Any]) -> Steps[Reply]:
+        try:
+            statistics: UserStatistics | None = yield self.database.get_user_statistics(token['sub'])
+            if statistics:
+                return APIResult({'statistics': statistics})
+            else:
+                return APIError(HTTP.NotFound.value, ErrorTexts.UserNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.FailedToGetStatistics.value)
+
+
+    @APIRequest(Method.Login, False)
+    def login(self, params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            hash: str = params['hash']
+            id: int = int(params['id'])
+            first_name: str = params['first_name']
+            auth_date: int = int(params['auth_date'])
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        if not self.telegram_auth.check_hash(params):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.DataIsNotFromTelegram.value)
+
+        timestamp = int(time())
+        if self.telegram_auth.is_outdated(auth_date, timestamp):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.DataIsOutdated.value)
+
+        if not self.telegram_auth.claim(hash, auth_date):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.DataIsAlreadyUsed.value)
+
+        try:
+            yield self.database.upsert_user(id, params.get('username', None), first_name, params.get('last_name', None))
+        except psycopg.errors.UniqueViolation:
+            pass
+        except:
+            # Nobody was logged in with this data, so the same login can be retried
+            self.telegram_auth.release(hash)
+            raise
+
+        auth_token = self.token_cache.encode({'sub': id, 'iat': timestamp, 'exp': timestamp+86400})
+        return APIResult({'auth_token': auth_token})
+
+
+    @APIRequest(Method.GetMe, True, user_version)
+    def get_me(self, token: dict[str, Any], _: dict[str, Any]) -> Steps[Reply]:
+        try:
+            user: User | None = yield self.database.get_user(token['sub'])
+            if user:
+                return APIResult({'user': user})
+            else:
+                return APIError(HTTP.NotFound.value, ErrorTexts.UserNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.Batch, True)
+    def batch(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            calls: list[tuple[Method, dict[str, Any], str | None]] = parse_batch(params)
+            snapshot: bool = bool(params.get('snapshot', False))
+            if snapshot and not all(method in READ_ONLY_METHODS for method, _, _ in calls):
+                raise ValueError
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            # The token was verified once above, the handlers are called without parsing or verifying again
+            results: list[bytes] = []
+            session = self.database.session(snapshot)
+            yield enter(session)
+            try:
+                for method, call_params, etag in calls:
+                    results.append((yield from self.batch_call(method, token, call_params, etag)))
+            except Exception as e:
+                yield leave(session, e)
+                raise
+            yield leave(session, None)
+            return Reply(HTTP.OK.value, body=b'{"ok":true,"result":[' + b','.join(results) + b']}')
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    # Params: limit (1..MAX_PAGE_SIZE) and after (the previous page's next cursor) page through the books,
+    # stream returns every book in one response without a next cursor and can't be combined with limit or after
+    @APIRequest(Method.GetBooks, True, user_version)
+    def get_books(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            limit: int | None = page_limit(params)
+            cursor: list[Any] | None = decode_cursor(params['after'], 2) if params.get('after') else None
+            after: tuple[str, UUID] | None = (str(cursor[0]), UUID(str(cursor[1]))) if cursor else None
+            stream: bool = stream_requested(params)
+        except (TypeError, ValueError):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+
+        try:
+            if stream:
+                return APIStream(self.serializer, 'entries', (yield self.database.stream_books(token['sub'])))
+            books: list[tuple[Book, int]] = yield self.database.get_books(token['sub'], after, limit)
+            next_cursor: str | None = encode_cursor([books[-1][0].title, str(books[-1][0].id)]) if limit and len(books) == limit else None
+            return APIResult({'entries': books, 'next': next_cursor})
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+
+    @APIRequest(Method.CreateBook, True)
+    def create_book(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            title: str = str(params['title'])
+            if not 1 <= len(title) <= 64:
+                raise ValueError
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, 'invalid argument value')
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, 'not enough arguments')
+
+        try:
+            book: Book = yield self.database.create_book(int(token['sub']), title)
+            return APIResult({'book': book})
+        except:
+            return APIError(HTTP.InternalServerError.value, 'internal server error')
+
+
+    @APIRequest(Method.DeleteBook, True)
+    def delete_book(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            id: UUID = UUID(params['id'])
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, 'invalid argument value')
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, 'not enough arguments')
+
+        try:
+            book: Book | None = yield self.database.delete_book(token['sub'], id)
+            if book:
+                return APIResult({'book': book})
+            else:
+                return APIError(HTTP.NotFound.value, 'book not found')
+        except:
+            return APIError(HTTP.InternalServerError.value, 'internal server error')
+
+
+
+    # Params: book_id, then limit, after and stream with the same meaning as in get_books
+    @APIRequest(Method.GetNotes, True, book_version)
+    def get_notes(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            book_id: UUID = UUID(str(params['book_id']))
+            limit: int | None = page_limit(params)
+            after: UUID | None = UUID(str(decode_cursor(params['after'], 1)[0])) if params.get('after') else None
+            stream: bool = stream_requested(params)
+        except (TypeError, ValueError):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            if stream:
+                return APIStream(self.serializer, 'notes', (yield self.database.stream_notes(token['sub'], book_id)))
+            notes: list[Note] = yield self.database.get_notes(token['sub'], book_id, after, limit)
+            next_cursor: str | None = encode_cursor([str(notes[-1].id)]) if limit and len(notes) == limit else None
+            return APIResult({'notes': notes, 'next': next_cursor})
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.BookNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.SearchNotes, True)
+    def search_notes(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            query: str = str(params['query'])
+            limit: int = page_limit(params) or SEARCH_PAGE_SIZE
+            cursor: list[Any] | None = decode_cursor(params['after'], 2) if params.get('after') else None
+            after: tuple[float, UUID] | None = (float(cursor[0]), UUID(str(cursor[1]))) if cursor else None
+            if not 1 <= len(query) <= 256:
+                raise ValueError
+        except (TypeError, ValueError):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            notes: list[tuple[Note, float]] = yield self.database.search_notes(token['sub'], query, after, limit)
+            next_cursor: str | None = encode_cursor([notes[-1][1], str(notes[-1][0].id)]) if len(notes) == limit else None
+            return APIResult({'entries': notes, 'next': next_cursor})
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.CreateNote, True)
+    def create_note(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            book_id: UUID = UUID(params['book_id'])
+            title: str = str(params['title'])
+            text: str = str(params['text'])
+            if not all((1 <= len(title) <= 64, 1 <= len(text) <= 4096)):
+                raise ValueError
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            note: Note = yield self.database.create_note(token['sub'], book_id, title, text)
+            return APIResult({'note': note})
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.BookNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.CreateNotes, True)
+    def create_notes(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            book_id: UUID = UUID(params['book_id'])
+            notes: list[tuple[str, str]] = [(bounded_text(note['title'], 64), bounded_text(note['text'], 4096)) for note in bulk_list(params['notes'])]
+        except (ValueError, TypeError):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            created: list[Note] = yield self.database.create_notes(token['sub'], book_id, notes)
+            return APIResult({'notes': created})
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.BookNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.DeleteNote, True)
+    def delete_note(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            book_id: UUID = UUID(params['book_id'])
+            id: UUID = UUID(params['id'])
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            note: Note | None = yield self.database.delete_note(token['sub'], book_id, id)
+            if note:
+                return APIResult({'note': note})
+            else:
+                return APIError(HTTP.NotFound.value, ErrorTexts.NoteNotFound.value)
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.BookNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.GetTaskLists, True, user_version)
+    def get_task_lists(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            task_lists: list[tuple[TaskList, list[Task]]] = yield self.database.get_task_lists(token['sub'])
+            return APIResult({'entries': [{'task_list': task_list, 'tasks': tasks} for task_list, tasks in task_lists]})
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.CreateTaskList, True)
+    def create_task_list(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            title: str = str(params['title'])
+            tasks: list[str] = params['tasks']
+            if not 1 <= len(title) <= 64 or not all((1 <= len(i) <= 64) for i in tasks):
+                raise ValueError
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            task_list: tuple[TaskList, list[Task]] = yield self.database.create_task_list(token['sub'], title, tasks)
+            return APIResult({'task_list': task_list[0], 'tasks': task_list[1]})
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.CreateTasks, True)
+    def create_tasks(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            task_list_id: UUID = UUID(params['task_list_id'])
+            titles: list[str] = [bounded_text(title, 64) for title in bulk_list(params['tasks'])]
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            tasks: list[Task] = yield self.database.create_tasks(token['sub'], task_list_id, titles)
+            return APIResult({'tasks': tasks})
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.TaskListNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.DeleteTaskList, True)
+    def delete_task_list(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            id: UUID = UUID(params['id'])
+        except ValueError:
+            return APIError(HTTP.BadRequest.value, 'invalid argument value')
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, 'not enough arguments')
+
+        try:
+            task_list: TaskList | None = yield self.database.delete_task_list(token['sub'], id)
+            if task_list:
+                return APIResult({'task_list': task_list})
+            else:
+                return APIError(HTTP.NotFound.value, 'task_list not found')
+        except:
+            return APIError(HTTP.InternalServerError.value, 'internal server error')
+
+
+    @APIRequest(Method.UpdateTasks, True)
+    def update_tasks(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            changes: list[tuple[UUID, str | None, bool | None, int | None]] = parse_task_changes(params)
+        except (TypeError, ValueError):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+
+        try:
+            tasks: list[Task] = yield self.database.update_tasks(token['sub'], changes)
+            return APIResult({'tasks': tasks})
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.TaskNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+
+    @APIRequest(Method.ExportData, True)
+    def export_data(self, token: dict[str, Any], params: dict[str, Any]) -> Steps[Reply]:
+        try:
+            return APIExport(self.serializer, (yield self.database.export_data(token['sub'])), bool(params.get('gzip', False)))
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+
+
+    @APIRequest(Method.ImportData, True, upload=True)
+    def import_data(self, token: dict[str, Any], upload: Upload) -> Steps[Reply]:
+        spool = ImportSpool(self.serializer, token['sub'], upload.compressed)
+        try:
+            statistics: UserStatistics = yield spool.read(upload.chunks)
+            yield self.database.import_data(token['sub'], spool.rows, statistics)
+            return APIResult({'imported': statistics})
+        except (ValueError, zlib.error):
+            return APIError(HTTP.BadRequest.value, ErrorTexts.InvalidArgumentValue.value)
+        except KeyError:
+            return APIError(HTTP.BadRequest.value, ErrorTexts.NotEnoughArguments.value)
+        except NotExistsException:
+            return APIError(HTTP.NotFound.value, ErrorTexts.UserNotFound.value)
+        except:
+            return APIError(HTTP.InternalServerError.value, ErrorTexts.InternalServerError.value)
+        finally:
+            spool.close()
@@ -0,0 +1,115 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Any
+
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def redact(params: Any) -> Any:
+    # Parameters carry note texts, titles and names, so only their shape ever reaches the log
+    if params is None:
+        return None
+    if isinstance(params, (list, tuple)):
+        return [f'<{type(value).__name__}[{len(value)}]>' if isinstance(value, (list, tuple, str, bytes)) else f'<{type(value).__name__}>' for value in params]
+    if isinstance(params, dict):
+        return {key: redact([value])[0] for key, value in params.items()}
+    return f'<{type(params).__name__}>'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def labels(**values: Any) -> str:
+    return '{' + ','.join(f'{key}="{escape(str(value))}"' for key, value in values.items()) + '}' if values else ''
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self.__buckets = buckets
+        self.__lock = Lock()
+        self.__counts = [0] * (len(buckets) + 1)
+        self.__sum = 0.0
+
+
+    def observe(self, value: float):
+        i = bisect_left(self.__buckets, value)
+        with self.__lock:
+            self.__counts[i] += 1
+            self.__sum += value
+
+
+    def render(self, name: str, **label_values: Any) -> list[str]:
+        with self.__lock:
+            counts, total = list(self.__counts), self.__sum
+
+        lines: list[str] = []
+        cumulative = 0
+        for bound, count in zip(self.__buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{labels(**label_values, le=bound)} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{labels(**label_values, le="+Inf")} {cumulative}')
+        lines.append(f'{name}_sum{labels(**label_values)} {total}')
+        lines.append(f'{name}_count{labels(**label_values)} {cumulative}')
+        return lines
+
+
+class Metrics:
+
+    PREFIX = 'notes'
+
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+
+        self.__lock = Lock()
+        self.__requests: dict[str, Histogram] = {}
+        self.__responses: dict[tuple[str, int], int] = {}
+
+
+    def observe_request(self, method: str, status: int, elapsed: float):
+        with self.__lock:
+            if (histogram := self.__requests.get(method)) is None:
+                histogram = self.__requests[method] = Histogram()
+            self.__responses[(method, status)] = self.__responses.get((method, status), 0) + 1
+        histogram.observe(elapsed)
+
+
+    def render(self, statements: dict[str, tuple[Histogram, dict[str, float]]], gauges: dict[str, dict[str, float]]) -> str:
+        with self.__lock:
+            requests, responses = dict(self.__requests), dict(self.__responses)
+
+        lines: list[str] = []
+
+        name = f'{Metrics.PREFIX}_api_request_duration_seconds'
+        lines += [f'# HELP {name} Time spent handling an API method call.', f'# TYPE {name} histogram']
+        for method, histogram in sorted(requests.items()):
+            lines += histogram.render(name, method=method)
+
+        name = f'{Metrics.PREFIX}_api_responses_total'
+        lines += [f'# HELP {name} API method calls by response status, errors are the 4xx and 5xx ones.', f'# TYPE {name} counter']
+        lines += [f'{name}{labels(method=method, status=status)} {amount}' for (method, status), amount in sorted(responses.items())]
+
+        name = f'{Metrics.PREFIX}_db_statement_duration_seconds'
+        lines += [f'# HELP {name} Time spent executing a prepared statement.', f'# TYPE {name} histogram']
+        for statement, (histogram, _) in sorted(statements.items()):
+            lines += histogram.render(name, statement=statement)
+
+        for key, name, kind, scale, description in (
+            ('calls', 'calls_total', 'counter', 1, 'Executions of a statement.'),
+            ('rows', 'rows_total', 'counter', 1, 'Rows returned or affected by a statement.'),
+            ('max_ms', 'max_duration_seconds', 'gauge', 1000, 'Slowest execution of a statement.')
+        ):
+            name = f'{Metrics.PREFIX}_db_statement_{name}'
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{labels(statement=statement)} {stats[key] / scale}' for statement, (_, stats) in sorted(statements.items())]
+
+        for group, stats in gauges.items():
+            for key, value in stats.items():
+                name = f'{Metrics.PREFIX}_{group}_{key}'
+                lines += [f'# TYPE {name} gauge', f'{name} {float(value)}']
+
+        return '\n'.join(lines) + '\n'
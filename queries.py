@@ -0,0 +1,522 @@
+import logging
+from threading import Lock
+
+from metrics import Histogram, redact
+from user_cache import CHANNEL
+
+
+TABLE_USERS = 'users'
+TABLE_BOOKS = 'books'
+TABLE_NOTES = 'notes'
+TABLE_TASK_LISTS = 'task_lists'
+TABLE_TASKS = 'tasks'
+TABLE_STATISTICS = 'statistics'
+TABLE_USER_STATISTICS = 'user_statistics'
+
+
+class Query:
+
+    registry: dict[str, 'Query'] = {}
+
+    # Both are off by default, so a statement only pays for the counters below
+    instrumented: bool = False
+    slow_threshold: float | None = None
+    logger = logging.getLogger('notes.queries')
+
+    def __init__(self, name: str, sql: str, prepare: bool = True) -> None:
+        self.name: str = name
+        self.sql: str = sql
+        self.prepare: bool = prepare
+
+        self.__lock = Lock()
+        self.calls: int = 0
+        self.rows: int = 0
+        self.total_time: float = 0.0
+        self.max_time: float = 0.0
+        self.histogram = Histogram()
+
+        Query.registry[name] = self
+
+    def record(self, elapsed: float, rows: int = 0, params: tuple | None = None):
+        with self.__lock:
+            self.calls += 1
+            self.rows += max(rows, 0)
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+        if Query.instrumented:
+            self.histogram.observe(elapsed)
+        if Query.slow_threshold is not None and elapsed >= Query.slow_threshold:
+            Query.logger.warning('slow query %s took %.1f ms: %s params=%s', self.name, elapsed * 1000, ' '.join(self.sql.split()), redact(params))
+
+    def stats(self) -> dict[str, float]:
+        with self.__lock:
+            return {
+                'calls': self.calls,
+                'rows': self.rows,
+                'total_ms': self.total_time * 1000,
+                'mean_ms': self.total_time * 1000 / self.calls if self.calls else 0.0,
+                'max_ms': self.max_time * 1000
+            }
+
+
+class Queries:
+
+    # Every write bumps the user's version and notifies the other workers in that same statement, so the
+    # notification is delivered exactly when the write commits, the payload is NULL while the cache is off
+    __NOTIFY = f'''(SELECT pg_notify('{CHANNEL}', "payload") FROM (VALUES (%s::text)) AS "notify"("payload") WHERE "payload" IS NOT NULL)'''
+
+    GetStatistics = Query('get_statistics', f'''
+        SELECT "name", SUM("value")::BIGINT
+        FROM "{TABLE_STATISTICS}"
+        WHERE "name" IN ('{TABLE_NOTES}', '{TABLE_TASK_LISTS}')
+        GROUP BY "name"
+    ''')
+
+    EstimateStatistics = Query('estimate_statistics', f'''
+        SELECT "relname", GREATEST("reltuples", 0)::BIGINT
+        FROM "pg_class"
+        WHERE "oid" IN ('"{TABLE_NOTES}"'::regclass, '"{TABLE_TASK_LISTS}"'::regclass)
+    ''')
+
+    GetUserStatistics = Query('get_user_statistics', f'''
+        SELECT "books", "notes", "task_lists", "tasks", "done_tasks"
+        FROM "{TABLE_USER_STATISTICS}"
+        WHERE "user_id" = %s
+    ''')
+
+
+    GetUser = Query('get_user', f'''
+        SELECT *
+        FROM "{TABLE_USERS}"
+        WHERE "id" = %s
+    ''')
+
+    UpsertUser = Query('upsert_user', f'''
+        WITH "user" AS (
+            INSERT INTO "{TABLE_USERS}" AS "current"
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT ("id") DO UPDATE
+            SET "username" = "excluded"."username", "first_name" = "excluded"."first_name", "last_name" = "excluded"."last_name"
+            WHERE ("current"."username", "current"."first_name", "current"."last_name") IS DISTINCT FROM ("excluded"."username", "excluded"."first_name", "excluded"."last_name")
+            RETURNING "id"
+        )
+        INSERT INTO "{TABLE_USER_STATISTICS}" ("user_id")
+        SELECT "id" FROM "user"
+        ON CONFLICT ("user_id") DO UPDATE
+        SET "version" = "{TABLE_USER_STATISTICS}"."version" + 1
+        RETURNING {__NOTIFY}
+    ''')
+
+    GetUserVersion = Query('get_user_version', f'''
+        SELECT "version"
+        FROM "{TABLE_USER_STATISTICS}"
+        WHERE "user_id" = %s
+    ''')
+
+
+    __BOOK_COLUMNS = '"id", "owner_id", "title"'
+
+    __GET_BOOKS = f'''
+        SELECT "{TABLE_BOOKS}"."id", "{TABLE_BOOKS}"."owner_id", "{TABLE_BOOKS}"."title", "{TABLE_BOOKS}"."notes_amount"
+        FROM "{TABLE_BOOKS}"
+        WHERE "{TABLE_BOOKS}"."owner_id" = %s AND "{TABLE_BOOKS}"."deleted_at" IS NULL {{}}
+        ORDER BY "{TABLE_BOOKS}"."title", "{TABLE_BOOKS}"."id"
+        LIMIT %s
+    '''
+
+    GetBooks = Query('get_books', __GET_BOOKS.format(''))
+
+    GetBooksAfter = Query('get_books_after', __GET_BOOKS.format('AND ("title", "id") > (%s, %s)'))
+
+    StreamBooks = Query('stream_books', __GET_BOOKS.format(''), prepare=False)
+
+    CreateBook = Query('create_book', f'''
+        WITH "book" AS (
+            INSERT INTO "{TABLE_BOOKS}" ("owner_id", "title")
+            VALUES (%s, %s)
+            RETURNING {__BOOK_COLUMNS}
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "books" = "books" + 1, "version" = "version" + 1
+            WHERE "user_id" = %s
+            RETURNING {__NOTIFY}
+        )
+        SELECT * FROM "book"
+    ''')
+
+    # Only marks the book, its notes are removed in batches by the purger and its stored amount leaves the user's counters right away
+    DeleteBook = Query('delete_book', f'''
+        WITH "book" AS (
+            UPDATE "{TABLE_BOOKS}"
+            SET "deleted_at" = now()
+            WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+            RETURNING {__BOOK_COLUMNS}, "notes_amount"
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "books" = "books" - 1, "notes" = "notes" - "book"."notes_amount", "version" = "version" + 1
+            FROM "book"
+            WHERE "user_id" = %s
+            RETURNING {__NOTIFY}
+        )
+        SELECT {__BOOK_COLUMNS} FROM "book"
+    ''')
+
+    LockUserBook = Query('lock_user_book', f'''
+        SELECT 1
+        FROM "{TABLE_BOOKS}"
+        WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+        FOR UPDATE
+    ''')
+
+    GetBookVersion = Query('get_book_version', f'''
+        SELECT "version"
+        FROM "{TABLE_BOOKS}"
+        WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+    ''')
+
+    CheckUserBookExists = Query('check_user_book_exists', f'''
+        SELECT EXISTS (
+            SELECT 1
+            FROM "{TABLE_BOOKS}"
+            WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+            LIMIT 1
+        )
+    ''')
+
+
+    __NOTE_COLUMNS = '"id", "book_id", "title", "text"'
+
+    __GET_NOTES = f'''
+        SELECT "note".*
+        FROM "{TABLE_BOOKS}" LEFT JOIN LATERAL (
+            SELECT {__NOTE_COLUMNS}
+            FROM "{TABLE_NOTES}"
+            WHERE "{TABLE_NOTES}"."book_id" = "{TABLE_BOOKS}"."id" {{}}
+            ORDER BY "{TABLE_NOTES}"."id"
+            LIMIT %s
+        ) AS "note" ON TRUE
+        WHERE "{TABLE_BOOKS}"."owner_id" = %s AND "{TABLE_BOOKS}"."id" = %s AND "{TABLE_BOOKS}"."deleted_at" IS NULL
+    '''
+
+    GetNotes = Query('get_notes', __GET_NOTES.format(''))
+
+    GetNotesAfter = Query('get_notes_after', __GET_NOTES.format('AND "id" > %s'))
+
+    StreamNotes = Query('stream_notes', f'''
+        SELECT {__NOTE_COLUMNS}
+        FROM "{TABLE_NOTES}"
+        WHERE "book_id" = %s
+        ORDER BY "id"
+    ''', prepare=False)
+
+    CreateNote = Query('create_note', f'''
+        WITH "note" AS (
+            INSERT INTO "{TABLE_NOTES}" ("book_id", "title", "text")
+            SELECT "id", %s, %s
+            FROM "{TABLE_BOOKS}"
+            WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+            FOR NO KEY UPDATE
+            RETURNING {__NOTE_COLUMNS}
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "notes" = "notes" + 1, "version" = "version" + 1
+            WHERE "user_id" = %s AND EXISTS (SELECT 1 FROM "note")
+            RETURNING {__NOTIFY}
+        ), "book_version" AS (
+            UPDATE "{TABLE_BOOKS}"
+            SET "version" = "version" + 1, "notes_amount" = "notes_amount" + 1
+            WHERE "id" IN (SELECT "book_id" FROM "note")
+        )
+        SELECT * FROM "note"
+    ''')
+
+    CreateNotes = Query('create_notes', f'''
+        WITH "note" AS (
+            INSERT INTO "{TABLE_NOTES}" ("book_id", "title", "text")
+            SELECT %s, "note"."title", "note"."text"
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS "note"("title", "text", "position")
+            ORDER BY "note"."position"
+            RETURNING {__NOTE_COLUMNS}
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "notes" = "notes" + %s, "version" = "version" + 1
+            WHERE "user_id" = %s
+            RETURNING {__NOTIFY}
+        ), "book_version" AS (
+            UPDATE "{TABLE_BOOKS}"
+            SET "version" = "version" + 1, "notes_amount" = "notes_amount" + (SELECT COUNT(1) FROM "note")
+            WHERE "id" IN (SELECT "book_id" FROM "note")
+        )
+        SELECT * FROM "note"
+    ''')
+
+    __SEARCH_NOTES = f'''
+        SELECT "note".*
+        FROM (
+            SELECT "{TABLE_NOTES}"."id", "{TABLE_NOTES}"."book_id", "{TABLE_NOTES}"."title", "{TABLE_NOTES}"."text", ts_rank("{TABLE_NOTES}"."search", "query") AS "rank"
+            FROM "{TABLE_BOOKS}"
+                JOIN "{TABLE_NOTES}" ON "{TABLE_NOTES}"."book_id" = "{TABLE_BOOKS}"."id"
+                CROSS JOIN websearch_to_tsquery('notes_search', %s) AS "query"
+            WHERE "{TABLE_BOOKS}"."owner_id" = %s AND "{TABLE_BOOKS}"."deleted_at" IS NULL AND "{TABLE_NOTES}"."search" @@ "query"
+        ) AS "note" {{}}
+        ORDER BY "note"."rank" DESC, "note"."id"
+        LIMIT %s
+    '''
+
+    SearchNotes = Query('search_notes', __SEARCH_NOTES.format(''))
+
+    SearchNotesAfter = Query('search_notes_after', __SEARCH_NOTES.format('WHERE "note"."rank" < %s::REAL OR ("note"."rank" = %s::REAL AND "note"."id" > %s)'))
+
+    DeleteNote = Query('delete_note', f'''
+        WITH "book" AS (
+            SELECT "id"
+            FROM "{TABLE_BOOKS}"
+            WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+            FOR NO KEY UPDATE
+        ), "note" AS (
+            DELETE FROM "{TABLE_NOTES}"
+            WHERE "book_id" IN (SELECT "id" FROM "book") AND "id" = %s
+            RETURNING {__NOTE_COLUMNS}
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "notes" = "notes" - 1, "version" = "version" + 1
+            WHERE "user_id" = %s AND EXISTS (SELECT 1 FROM "note")
+            RETURNING {__NOTIFY}
+        ), "book_version" AS (
+            UPDATE "{TABLE_BOOKS}"
+            SET "version" = "version" + 1, "notes_amount" = "notes_amount" - 1
+            WHERE "id" IN (SELECT "book_id" FROM "note")
+        )
+        SELECT EXISTS (SELECT 1 FROM "book"), "note".*
+        FROM (VALUES (1)) AS "result" LEFT JOIN "note" ON TRUE
+    ''')
+
+
+    __TASK_LIST_COLUMNS = '"id", "owner_id", "title"'
+
+    __TASK_COLUMNS = '"id", "task_list_id", "text", "is_done", "position"'
+
+    GetTaskLists = Query('get_task_lists', f'''
+        SELECT
+            "{TABLE_TASK_LISTS}"."id", "{TABLE_TASK_LISTS}"."owner_id", "{TABLE_TASK_LISTS}"."title",
+            "{TABLE_TASKS}"."id", "{TABLE_TASKS}"."task_list_id", "{TABLE_TASKS}"."text", "{TABLE_TASKS}"."is_done", "{TABLE_TASKS}"."position"
+        FROM "{TABLE_TASK_LISTS}" LEFT JOIN "{TABLE_TASKS}" ON "{TABLE_TASK_LISTS}"."id" = "{TABLE_TASKS}"."task_list_id"
+        WHERE "{TABLE_TASK_LISTS}"."owner_id" = %s AND "{TABLE_TASK_LISTS}"."deleted_at" IS NULL
+        ORDER BY "{TABLE_TASK_LISTS}"."id", "{TABLE_TASKS}"."position"
+    ''')
+
+    CreateTaskList = Query('create_task_list', f'''
+        WITH "task_list" AS (
+            INSERT INTO "{TABLE_TASK_LISTS}" ("owner_id", "title")
+            VALUES (%s, %s)
+            RETURNING {__TASK_LIST_COLUMNS}
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "task_lists" = "task_lists" + 1, "version" = "version" + 1
+            WHERE "user_id" = %s
+            RETURNING {__NOTIFY}
+        )
+        SELECT * FROM "task_list"
+    ''')
+
+    DeleteTaskList = Query('delete_task_list', f'''
+        WITH "task_list" AS (
+            UPDATE "{TABLE_TASK_LISTS}"
+            SET "deleted_at" = now()
+            WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+            RETURNING {__TASK_LIST_COLUMNS}, "tasks_amount", "done_tasks_amount"
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET
+                "task_lists" = "task_lists" - 1,
+                "tasks" = "tasks" - "task_list"."tasks_amount",
+                "done_tasks" = "done_tasks" - "task_list"."done_tasks_amount",
+                "version" = "version" + 1
+            FROM "task_list"
+            WHERE "user_id" = %s
+            RETURNING {__NOTIFY}
+        )
+        SELECT {__TASK_LIST_COLUMNS} FROM "task_list"
+    ''')
+
+    LockUserTaskList = Query('lock_user_task_list', f'''
+        SELECT 1
+        FROM "{TABLE_TASK_LISTS}"
+        WHERE "owner_id" = %s AND "id" = %s AND "deleted_at" IS NULL
+        FOR UPDATE
+    ''')
+
+    InsertTasks = Query('insert_tasks', f'''
+        WITH "task" AS (
+            INSERT INTO "{TABLE_TASKS}" ("task_list_id", "text", "is_done", "position")
+            SELECT %s, "task"."text", FALSE, "last"."position" + "task"."position"
+            FROM unnest(%s::text[]) WITH ORDINALITY AS "task"("text", "position"), (
+                SELECT COALESCE(MAX("position"), -1) AS "position"
+                FROM "{TABLE_TASKS}"
+                WHERE "task_list_id" = %s
+            ) AS "last"
+            ORDER BY "task"."position"
+            RETURNING {__TASK_COLUMNS}
+        ), "task_list_amounts" AS (
+            UPDATE "{TABLE_TASK_LISTS}"
+            SET "tasks_amount" = "tasks_amount" + (SELECT COUNT(1) FROM "task")
+            WHERE "id" IN (SELECT "task_list_id" FROM "task")
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "tasks" = "tasks" + %s, "version" = "version" + 1
+            WHERE "user_id" = %s
+            RETURNING {__NOTIFY}
+        )
+        SELECT * FROM "task"
+    ''')
+
+    # The changed rows are locked first so the done counters are adjusted from their latest state,
+    # and their lists are locked too so a concurrent delete subtracts the amounts left by this update
+    UpdateTasks = Query('update_tasks', f'''
+        WITH "change" AS (
+            SELECT *
+            FROM unnest(%s::uuid[], %s::text[], %s::boolean[], %s::int[]) AS "change"("id", "text", "is_done", "position")
+        ), "old" AS (
+            SELECT "{TABLE_TASKS}"."id", "{TABLE_TASKS}"."is_done"
+            FROM "{TABLE_TASKS}" JOIN "{TABLE_TASK_LISTS}" ON "{TABLE_TASK_LISTS}"."id" = "{TABLE_TASKS}"."task_list_id"
+            WHERE "{TABLE_TASKS}"."id" IN (SELECT "id" FROM "change") AND "{TABLE_TASK_LISTS}"."owner_id" = %s AND "{TABLE_TASK_LISTS}"."deleted_at" IS NULL
+            FOR UPDATE OF "{TABLE_TASKS}" FOR NO KEY UPDATE OF "{TABLE_TASK_LISTS}"
+        ), "task" AS (
+            UPDATE "{TABLE_TASKS}"
+            SET
+                "text" = COALESCE("change"."text", "{TABLE_TASKS}"."text"),
+                "is_done" = COALESCE("change"."is_done", "{TABLE_TASKS}"."is_done"),
+                "position" = COALESCE("change"."position", "{TABLE_TASKS}"."position")
+            FROM "change" JOIN "old" ON "old"."id" = "change"."id"
+            WHERE "{TABLE_TASKS}"."id" = "change"."id"
+            RETURNING "{TABLE_TASKS}"."id", "{TABLE_TASKS}"."task_list_id", "{TABLE_TASKS}"."text", "{TABLE_TASKS}"."is_done", "{TABLE_TASKS}"."position", "old"."is_done" AS "was_done"
+        ), "task_list_amounts" AS (
+            UPDATE "{TABLE_TASK_LISTS}"
+            SET "done_tasks_amount" = "done_tasks_amount" + "done"."delta"
+            FROM (
+                SELECT "task_list_id", COUNT(1) FILTER (WHERE "is_done") - COUNT(1) FILTER (WHERE "was_done") AS "delta"
+                FROM "task"
+                GROUP BY "task_list_id"
+            ) AS "done"
+            WHERE "{TABLE_TASK_LISTS}"."id" = "done"."task_list_id" AND "done"."delta" <> 0
+        ), "statistics" AS (
+            UPDATE "{TABLE_USER_STATISTICS}"
+            SET "done_tasks" = "done_tasks" + "done"."delta", "version" = "version" + 1
+            FROM (SELECT COUNT(1) FILTER (WHERE "is_done") - COUNT(1) FILTER (WHERE "was_done") AS "delta" FROM "task") AS "done"
+            WHERE "user_id" = %s AND EXISTS (SELECT 1 FROM "task")
+            RETURNING {__NOTIFY}
+        )
+        SELECT {__TASK_COLUMNS} FROM "task"
+    ''')
+
+
+    # Children of deleted books and task lists are removed a batch at a time, then the emptied parents themselves
+    PurgeNotes = Query('purge_notes', f'''
+        DELETE FROM "{TABLE_NOTES}"
+        WHERE "id" IN (
+            SELECT "{TABLE_NOTES}"."id"
+            FROM "{TABLE_BOOKS}" JOIN "{TABLE_NOTES}" ON "{TABLE_NOTES}"."book_id" = "{TABLE_BOOKS}"."id"
+            WHERE "{TABLE_BOOKS}"."deleted_at" IS NOT NULL
+            LIMIT %s
+            FOR UPDATE OF "{TABLE_NOTES}" SKIP LOCKED
+        )
+    ''')
+
+    PurgeBooks = Query('purge_books', f'''
+        DELETE FROM "{TABLE_BOOKS}"
+        WHERE "id" IN (
+            SELECT "id"
+            FROM "{TABLE_BOOKS}"
+            WHERE "deleted_at" IS NOT NULL AND NOT EXISTS (SELECT 1 FROM "{TABLE_NOTES}" WHERE "{TABLE_NOTES}"."book_id" = "{TABLE_BOOKS}"."id")
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    ''')
+
+    PurgeTasks = Query('purge_tasks', f'''
+        DELETE FROM "{TABLE_TASKS}"
+        WHERE "id" IN (
+            SELECT "{TABLE_TASKS}"."id"
+            FROM "{TABLE_TASK_LISTS}" JOIN "{TABLE_TASKS}" ON "{TABLE_TASKS}"."task_list_id" = "{TABLE_TASK_LISTS}"."id"
+            WHERE "{TABLE_TASK_LISTS}"."deleted_at" IS NOT NULL
+            LIMIT %s
+            FOR UPDATE OF "{TABLE_TASKS}" SKIP LOCKED
+        )
+    ''')
+
+    PurgeTaskLists = Query('purge_task_lists', f'''
+        DELETE FROM "{TABLE_TASK_LISTS}"
+        WHERE "id" IN (
+            SELECT "id"
+            FROM "{TABLE_TASK_LISTS}"
+            WHERE "deleted_at" IS NOT NULL AND NOT EXISTS (SELECT 1 FROM "{TABLE_TASKS}" WHERE "{TABLE_TASKS}"."task_list_id" = "{TABLE_TASK_LISTS}"."id")
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    ''')
+
+
+    # Exports are read through server-side cursors, which can't use prepared statements
+    ExportBooks = Query('export_books', f'''
+        SELECT {__BOOK_COLUMNS}
+        FROM "{TABLE_BOOKS}"
+        WHERE "owner_id" = %s AND "deleted_at" IS NULL
+        ORDER BY "id"
+    ''', prepare=False)
+
+    ExportNotes = Query('export_notes', f'''
+        SELECT "{TABLE_NOTES}"."id", "{TABLE_NOTES}"."book_id", "{TABLE_NOTES}"."title", "{TABLE_NOTES}"."text"
+        FROM "{TABLE_BOOKS}" JOIN "{TABLE_NOTES}" ON "{TABLE_NOTES}"."book_id" = "{TABLE_BOOKS}"."id"
+        WHERE "{TABLE_BOOKS}"."owner_id" = %s AND "{TABLE_BOOKS}"."deleted_at" IS NULL
+        ORDER BY "{TABLE_NOTES}"."book_id", "{TABLE_NOTES}"."id"
+    ''', prepare=False)
+
+    ExportTaskLists = Query('export_task_lists', f'''
+        SELECT {__TASK_LIST_COLUMNS}
+        FROM "{TABLE_TASK_LISTS}"
+        WHERE "owner_id" = %s AND "deleted_at" IS NULL
+        ORDER BY "id"
+    ''', prepare=False)
+
+    ExportTasks = Query('export_tasks', f'''
+        SELECT "{TABLE_TASKS}"."id", "{TABLE_TASKS}"."task_list_id", "{TABLE_TASKS}"."text", "{TABLE_TASKS}"."is_done", "{TABLE_TASKS}"."position"
+        FROM "{TABLE_TASK_LISTS}" JOIN "{TABLE_TASKS}" ON "{TABLE_TASKS}"."task_list_id" = "{TABLE_TASK_LISTS}"."id"
+        WHERE "{TABLE_TASK_LISTS}"."owner_id" = %s AND "{TABLE_TASK_LISTS}"."deleted_at" IS NULL
+        ORDER BY "{TABLE_TASKS}"."task_list_id", "{TABLE_TASKS}"."position"
+    ''', prepare=False)
+
+    CopyBooks = Query('copy_books', f'''
+        COPY "{TABLE_BOOKS}" ("id", "owner_id", "title", "notes_amount") FROM STDIN
+    ''', prepare=False)
+
+    CopyNotes = Query('copy_notes', f'''
+        COPY "{TABLE_NOTES}" ("book_id", "title", "text") FROM STDIN
+    ''', prepare=False)
+
+    CopyTaskLists = Query('copy_task_lists', f'''
+        COPY "{TABLE_TASK_LISTS}" ("id", "owner_id", "title", "tasks_amount", "done_tasks_amount") FROM STDIN
+    ''', prepare=False)
+
+    CopyTasks = Query('copy_tasks', f'''
+        COPY "{TABLE_TASKS}" ("task_list_id", "text", "is_done", "position") FROM STDIN
+    ''', prepare=False)
+
+    LockUser = Query('lock_user', f'''
+        SELECT 1
+        FROM "{TABLE_USERS}"
+        WHERE "id" = %s
+        FOR KEY SHARE
+    ''')
+
+    AddUserStatistics = Query('add_user_statistics', f'''
+        UPDATE "{TABLE_USER_STATISTICS}"
+        SET
+            "books" = "books" + %s,
+            "notes" = "notes" + %s,
+            "task_lists" = "task_lists" + %s,
+            "tasks" = "tasks" + %s,
+            "done_tasks" = "done_tasks" + %s,
+            "version" = "version" + 1
+        WHERE "user_id" = %s
+        RETURNING {__NOTIFY}
+    ''')
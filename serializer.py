@@ -0,0 +1,89 @@
+import json
+import logging
+from json.encoder import encode_basestring_ascii
+from typing import Any
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_string(value: str | None) -> str:
+    return encode_basestring_ascii(value) if value is not None else 'null'
+
+
+# orjson is the backend to run with, the stdlib one is a compatibility fallback for hosts without it
+# and benchmarks/serialization.py shows it within noise of plain json.dumps, not faster
+class Serializer:
+
+    name = 'json'
+
+
+    def dumps(self, obj: Any) -> bytes:
+        out: list[str] = []
+        self.__write(obj, out)
+        return ''.join(out).encode()
+
+
+    def loads(self, data: bytes | str) -> Any:
+        return json.loads(data)
+
+
+    def __write(self, obj: Any, out: list[str]):
+        kind = type(obj)
+        if kind is str:
+            out.append(encode_basestring_ascii(obj))
+        elif obj is None:
+            out.append('null')
+        elif kind is bool:
+            out.append('true' if obj else 'false')
+        elif kind is int:
+            out.append(int.__repr__(obj))
+        elif kind is dict:
+            out.append('{')
+            for i, (key, value) in enumerate(obj.items()):
+                out.append(f'{"," if i else ""}{encode_basestring_ascii(str(key))}:')
+                self.__write(value, out)
+            out.append('}')
+        elif kind is list or kind is tuple:
+            out.append('[')
+            for i, value in enumerate(obj):
+                if i:
+                    out.append(',')
+                self.__write(value, out)
+            out.append(']')
+        elif kind is UUID:
+            out.append(f'"{obj}"')
+        elif (to_json_string := getattr(kind, 'to_json_string', None)) is not None:
+            # Models render themselves straight to JSON text, no intermediate dict is built per row
+            out.append(to_json_string(obj))
+        else:
+            out.append(json.dumps(obj))
+
+
+class ORJSONSerializer(Serializer):
+
+    name = 'orjson'
+
+
+    def dumps(self, obj: Any) -> bytes:
+        # Models are slotted dataclasses, which orjson writes natively field by field
+        return orjson.dumps(obj) # type: ignore
+
+
+    def loads(self, data: bytes | str) -> Any:
+        return orjson.loads(data) # type: ignore
+
+
+def create_serializer(backend: str = 'auto') -> Serializer:
+    if backend == 'orjson' or (backend == 'auto' and orjson is not None):
+        if orjson is None:
+            raise RuntimeError('orjson is not installed')
+        return ORJSONSerializer()
+    if backend not in ('auto', 'json'):
+        raise ValueError(f'unknown JSON serializer {backend!r}')
+    if backend == 'auto':
+        logging.getLogger('notes.serializer').warning('orjson is not installed, falling back to the slower stdlib JSON serializer')
+    return Serializer()
@@ -0,0 +1,13 @@
+-- migration: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_book_owner_id_title"
+    ON "books" ("owner_id", "title");
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_note_book_id"
+    ON "notes" ("book_id");
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_task_list_owner_id"
+    ON "task_lists" ("owner_id");
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_task_task_list_id"
+    ON "tasks" ("task_list_id");
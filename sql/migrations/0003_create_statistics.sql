@@ -0,0 +1,59 @@
+LOCK TABLE "notes", "task_lists" IN SHARE ROW EXCLUSIVE MODE;
+
+
+CREATE TABLE IF NOT EXISTS "statistics"
+(
+    "name" VARCHAR(32) NOT NULL,
+    "value" BIGINT NOT NULL,
+
+    CONSTRAINT "pk_statistic_name"
+        PRIMARY KEY ("name")
+);
+
+
+INSERT INTO "statistics" ("name", "value")
+VALUES
+    ('notes', (SELECT COUNT(1) FROM "notes")),
+    ('task_lists', (SELECT COUNT(1) FROM "task_lists"))
+ON CONFLICT ("name") DO UPDATE SET "value" = EXCLUDED."value";
+
+
+CREATE OR REPLACE FUNCTION "statistics_count_inserted"() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE "statistics"
+    SET "value" = "value" + (SELECT COUNT(1) FROM "inserted")
+    WHERE "name" = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION "statistics_count_deleted"() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE "statistics"
+    SET "value" = "value" - (SELECT COUNT(1) FROM "deleted")
+    WHERE "name" = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE TRIGGER "trg_note_statistics_insert"
+    AFTER INSERT ON "notes"
+    REFERENCING NEW TABLE AS "inserted"
+    FOR EACH STATEMENT EXECUTE FUNCTION "statistics_count_inserted"();
+
+CREATE OR REPLACE TRIGGER "trg_note_statistics_delete"
+    AFTER DELETE ON "notes"
+    REFERENCING OLD TABLE AS "deleted"
+    FOR EACH STATEMENT EXECUTE FUNCTION "statistics_count_deleted"();
+
+CREATE OR REPLACE TRIGGER "trg_task_list_statistics_insert"
+    AFTER INSERT ON "task_lists"
+    REFERENCING NEW TABLE AS "inserted"
+    FOR EACH STATEMENT EXECUTE FUNCTION "statistics_count_inserted"();
+
+CREATE OR REPLACE TRIGGER "trg_task_list_statistics_delete"
+    AFTER DELETE ON "task_lists"
+    REFERENCING OLD TABLE AS "deleted"
+    FOR EACH STATEMENT EXECUTE FUNCTION "statistics_count_deleted"();
@@ -0,0 +1,31 @@
+LOCK TABLE "users", "books", "notes", "task_lists", "tasks" IN SHARE ROW EXCLUSIVE MODE;
+
+
+CREATE TABLE IF NOT EXISTS "user_statistics"
+(
+    "user_id" INT NOT NULL,
+
+    "books" INT NOT NULL DEFAULT 0,
+    "notes" INT NOT NULL DEFAULT 0,
+    "task_lists" INT NOT NULL DEFAULT 0,
+    "tasks" INT NOT NULL DEFAULT 0,
+    "done_tasks" INT NOT NULL DEFAULT 0,
+
+    CONSTRAINT "pk_user_statistic_user_id"
+        PRIMARY KEY ("user_id"),
+
+    CONSTRAINT "fk_user_statistic_user_id"
+        FOREIGN KEY ("user_id") REFERENCES "users"("id") ON DELETE CASCADE
+);
+
+
+INSERT INTO "user_statistics" ("user_id", "books", "notes", "task_lists", "tasks", "done_tasks")
+SELECT
+    "users"."id",
+    (SELECT COUNT(1) FROM "books" WHERE "books"."owner_id" = "users"."id"),
+    (SELECT COUNT(1) FROM "notes" JOIN "books" ON "notes"."book_id" = "books"."id" WHERE "books"."owner_id" = "users"."id"),
+    (SELECT COUNT(1) FROM "task_lists" WHERE "task_lists"."owner_id" = "users"."id"),
+    (SELECT COUNT(1) FROM "tasks" JOIN "task_lists" ON "tasks"."task_list_id" = "task_lists"."id" WHERE "task_lists"."owner_id" = "users"."id"),
+    (SELECT COUNT(1) FROM "tasks" JOIN "task_lists" ON "tasks"."task_list_id" = "task_lists"."id" WHERE "task_lists"."owner_id" = "users"."id" AND "tasks"."is_done")
+FROM "users"
+ON CONFLICT ("user_id") DO NOTHING;
@@ -0,0 +1,11 @@
+-- migration: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_book_owner_id_title_id"
+    ON "books" ("owner_id", "title", "id");
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_note_book_id_id"
+    ON "notes" ("book_id", "id");
+
+DROP INDEX CONCURRENTLY IF EXISTS "idx_book_owner_id_title";
+
+DROP INDEX CONCURRENTLY IF EXISTS "idx_note_book_id";
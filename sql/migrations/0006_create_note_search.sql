@@ -0,0 +1,15 @@
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM "pg_ts_config" WHERE "cfgname" = 'notes_search') THEN
+        -- Stems Cyrillic words with the Russian snowball stemmer and ASCII words with the English one
+        CREATE TEXT SEARCH CONFIGURATION "notes_search" (COPY = pg_catalog.russian);
+    END IF;
+END;
+$$;
+
+
+ALTER TABLE "notes"
+    ADD COLUMN IF NOT EXISTS "search" TSVECTOR
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('notes_search', "title"), 'A') || setweight(to_tsvector('notes_search', "text"), 'B')
+        ) STORED;
@@ -0,0 +1,4 @@
+-- migration: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_note_search"
+    ON "notes" USING GIN ("search");
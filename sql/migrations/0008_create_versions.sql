@@ -0,0 +1,5 @@
+ALTER TABLE "user_statistics"
+    ADD COLUMN IF NOT EXISTS "version" BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE "books"
+    ADD COLUMN IF NOT EXISTS "version" BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,12 @@
+ALTER TABLE "tasks"
+    ADD COLUMN IF NOT EXISTS "position" INT NOT NULL DEFAULT 0;
+
+
+-- Existing lists keep the order they were returned in so far
+UPDATE "tasks"
+SET "position" = "ordered"."position"
+FROM (
+    SELECT "id", ROW_NUMBER() OVER (PARTITION BY "task_list_id" ORDER BY "ctid") - 1 AS "position"
+    FROM "tasks"
+) AS "ordered"
+WHERE "tasks"."id" = "ordered"."id";
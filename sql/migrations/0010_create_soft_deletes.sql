@@ -0,0 +1,5 @@
+ALTER TABLE "books"
+    ADD COLUMN IF NOT EXISTS "deleted_at" TIMESTAMPTZ;
+
+ALTER TABLE "task_lists"
+    ADD COLUMN IF NOT EXISTS "deleted_at" TIMESTAMPTZ;
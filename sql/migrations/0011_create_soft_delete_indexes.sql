@@ -0,0 +1,7 @@
+-- migration: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_book_deleted_at"
+    ON "books" ("deleted_at") WHERE "deleted_at" IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_task_list_deleted_at"
+    ON "task_lists" ("deleted_at") WHERE "deleted_at" IS NOT NULL;
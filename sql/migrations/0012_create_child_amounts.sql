@@ -0,0 +1,28 @@
+LOCK TABLE "books", "notes", "task_lists", "tasks" IN SHARE ROW EXCLUSIVE MODE;
+
+
+ALTER TABLE "books"
+    ADD COLUMN IF NOT EXISTS "notes_amount" INT NOT NULL DEFAULT 0;
+
+ALTER TABLE "task_lists"
+    ADD COLUMN IF NOT EXISTS "tasks_amount" INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS "done_tasks_amount" INT NOT NULL DEFAULT 0;
+
+
+UPDATE "books"
+SET "notes_amount" = "counted"."amount"
+FROM (
+    SELECT "book_id", COUNT(1) AS "amount"
+    FROM "notes"
+    GROUP BY "book_id"
+) AS "counted"
+WHERE "books"."id" = "counted"."book_id";
+
+UPDATE "task_lists"
+SET "tasks_amount" = "counted"."amount", "done_tasks_amount" = "counted"."done"
+FROM (
+    SELECT "task_list_id", COUNT(1) AS "amount", COUNT(1) FILTER (WHERE "is_done") AS "done"
+    FROM "tasks"
+    GROUP BY "task_list_id"
+) AS "counted"
+WHERE "task_lists"."id" = "counted"."task_list_id";
@@ -0,0 +1,37 @@
+LOCK TABLE "statistics", "notes", "task_lists" IN SHARE ROW EXCLUSIVE MODE;
+
+
+-- Every counter is split over 16 rows summed on read, so concurrent writers from different connections don't queue on one row
+ALTER TABLE "statistics"
+    ADD COLUMN IF NOT EXISTS "shard" SMALLINT NOT NULL DEFAULT 0,
+    DROP CONSTRAINT IF EXISTS "pk_statistic_name";
+
+ALTER TABLE "statistics"
+    ADD CONSTRAINT "pk_statistic_name_shard"
+        PRIMARY KEY ("name", "shard");
+
+
+INSERT INTO "statistics" ("name", "shard", "value")
+SELECT "statistics"."name", "new"."shard", 0
+FROM "statistics", generate_series(1, 15) AS "new"("shard")
+ON CONFLICT ("name", "shard") DO NOTHING;
+
+
+CREATE OR REPLACE FUNCTION "statistics_count_inserted"() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE "statistics"
+    SET "value" = "value" + (SELECT COUNT(1) FROM "inserted")
+    WHERE "name" = TG_TABLE_NAME AND "shard" = pg_backend_pid() % 16;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION "statistics_count_deleted"() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE "statistics"
+    SET "value" = "value" - (SELECT COUNT(1) FROM "deleted")
+    WHERE "name" = TG_TABLE_NAME AND "shard" = pg_backend_pid() % 16;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from hashlib import sha256
+import hmac
+from threading import Lock
+from time import time
+from typing import Any
+
+
+class TelegramAuth:
+
+    MAX_AGE = 300
+
+
+    def __init__(self, bot_token: str, max_size: int = 100000) -> None:
+        # The HMAC key only depends on the bot token, so it is derived once instead of on every login
+        self.__secret_key = sha256(bot_token.encode()).digest()
+        self.__max_size = max_size
+
+        self.__lock = Lock()
+        self.__seen: OrderedDict[str, float] = OrderedDict()
+
+
+    def check_hash(self, params: dict[str, Any]) -> bool:
+        data_check_string = '\n'.join(f'{k}={params[k]}' for k in sorted(params) if k != 'hash')
+        expected = hmac.new(self.__secret_key, data_check_string.encode(), sha256).hexdigest()
+        return hmac.compare_digest(expected, str(params.get('hash', '')))
+
+
+    def is_outdated(self, auth_date: int, timestamp: float | None = None) -> bool:
+        return (timestamp if timestamp is not None else time()) - auth_date > TelegramAuth.MAX_AGE
+
+
+    def claim(self, hash: str, auth_date: int) -> bool:
+        now = time()
+        with self.__lock:
+            # Entries are inserted roughly in auth_date order, so expired ones gather at the front
+            while self.__seen and (next(iter(self.__seen.values())) <= now or len(self.__seen) >= self.__max_size):
+                self.__seen.popitem(last=False)
+            if hash in self.__seen:
+                return False
+            self.__seen[hash] = auth_date + TelegramAuth.MAX_AGE
+            return True
+
+
+    def release(self, hash: str):
+        with self.__lock:
+            self.__seen.pop(hash, None)
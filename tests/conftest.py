@@ -0,0 +1,108 @@
+import json
+import os
+import sys
+from collections.abc import Iterator
+from itertools import count
+from time import time
+from typing import Any
+
+import psycopg
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Migrations are read relative to the working directory
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DBHelper
+
+
+POSTGRES = {
+    'host': os.environ.get('POSTGRES_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('POSTGRES_PORT', 5432)),
+    'user': os.environ.get('POSTGRES_USER', 'postgres'),
+    'password': os.environ.get('POSTGRES_PASSWD', 'x'),
+    'dbname': os.environ.get('POSTGRES_TEST_DBNAME', 'notes_test')
+}
+
+user_ids = count(1_000_000_100)
+
+
+@pytest.fixture(scope='session')
+def postgres() -> Iterator[dict]:
+    try:
+        connection = psycopg.connect(f'host={POSTGRES["host"]} port={POSTGRES["port"]} user={POSTGRES["user"]} password={POSTGRES["password"]} dbname=postgres', autocommit=True, connect_timeout=3)
+    except psycopg.OperationalError as e:
+        pytest.skip(f'postgres is not available: {e}')
+
+    # Every run starts from a freshly migrated database
+    connection.execute(f'DROP DATABASE IF EXISTS "{POSTGRES["dbname"]}" WITH (FORCE)') # type: ignore
+    DBHelper(**POSTGRES).close()
+    yield POSTGRES
+    connection.execute(f'DROP DATABASE IF EXISTS "{POSTGRES["dbname"]}" WITH (FORCE)') # type: ignore
+    connection.close()
+
+
+@pytest.fixture
+def sql(postgres: dict) -> Iterator[psycopg.Connection]:
+    with psycopg.connect(f'host={postgres["host"]} port={postgres["port"]} user={postgres["user"]} password={postgres["password"]} dbname={postgres["dbname"]}', autocommit=True) as connection:
+        yield connection
+
+
+@pytest.fixture
+def user_id() -> int:
+    return next(user_ids)
+
+
+@pytest.fixture(scope='session')
+def app(postgres: dict) -> Iterator[Flask]:
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for name, value in (('APP_KEY', 'test'), ('BOT_TOKEN', '1:test'), ('POSTGRES_HOST', postgres['host']), ('POSTGRES_PORT', str(postgres['port'])), ('POSTGRES_USER', postgres['user']), ('POSTGRES_PASSWD', postgres['password']), ('POSTGRES_DBNAME', postgres['dbname']), ('USER_CACHE_SIZE', '100'), ('PURGE_INTERVAL', '0'), ('DEBUG_ASSETS', '1')):
+            monkeypatch.setenv(name, value)
+        import app as app_module
+        app = app_module.create_app()
+        yield app
+        app_module.close_database()
+
+
+@pytest.fixture
+def client(app: Flask, user_id: int) -> FlaskClient:
+    import app as app_module
+    with app.app_context():
+        app_module.database.upsert_user(user_id, None, 'test', None)
+    client = app.test_client()
+    client.environ_base['HTTP_X_NOTES_AUTH_TOKEN'] = app.extensions['token_cache'].encode({'sub': user_id, 'iat': int(time()), 'exp': int(time()) + 3600})
+    return client
+
+
+def call(client: FlaskClient, method: str, etag: str | None = None, **params: Any):
+    return client.post(f'/method/{method}', data=json.dumps(params), headers={'If-None-Match': f'"{etag}"'} if etag else {})
+
+
+def live_statistics(connection: psycopg.Connection, user_id: int) -> tuple[int, int, int, int, int]:
+    # Counted from the rows themselves, soft deleted books and task lists and everything under them excluded
+    return connection.execute('''
+        SELECT
+            (SELECT COUNT(1) FROM "books" WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL),
+            (SELECT COUNT(1) FROM "notes" JOIN "books" ON "books"."id" = "notes"."book_id" WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL),
+            (SELECT COUNT(1) FROM "task_lists" WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL),
+            (SELECT COUNT(1) FROM "tasks" JOIN "task_lists" ON "task_lists"."id" = "tasks"."task_list_id" WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL),
+            (SELECT COUNT(1) FROM "tasks" JOIN "task_lists" ON "task_lists"."id" = "tasks"."task_list_id" WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL AND "is_done")
+    ''', {'user': user_id}).fetchone() # type: ignore
+
+
+def stale_amounts(connection: psycopg.Connection, user_id: int) -> list[tuple]:
+    # Books and task lists whose stored child amounts differ from their rows
+    return connection.execute('''
+        SELECT "books"."id"
+        FROM "books"
+        WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL
+            AND "notes_amount" <> (SELECT COUNT(1) FROM "notes" WHERE "book_id" = "books"."id")
+        UNION ALL
+        SELECT "task_lists"."id"
+        FROM "task_lists"
+        WHERE "owner_id" = %(user)s AND "deleted_at" IS NULL AND ("tasks_amount", "done_tasks_amount") <> (
+            SELECT COUNT(1), COUNT(1) FILTER (WHERE "is_done") FROM "tasks" WHERE "task_list_id" = "task_lists"."id"
+        )
+    ''', {'user': user_id}).fetchall()
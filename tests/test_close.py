@@ -0,0 +1,15 @@
+import gc
+
+import psycopg
+import pytest
+
+from database import DBHelper
+
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnraisableExceptionWarning')
+def test_failed_init_is_collected_cleanly(postgres: dict):
+    with pytest.raises(psycopg.OperationalError):
+        DBHelper(**(postgres | {'port': 1}))
+    with pytest.raises(TypeError):
+        DBHelper(**postgres, unknown=True)
+    gc.collect()
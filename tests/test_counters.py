@@ -0,0 +1,66 @@
+from collections.abc import Iterator
+
+import psycopg
+import pytest
+
+from conftest import live_statistics, stale_amounts
+from database import DBHelper
+
+
+@pytest.fixture
+def database(postgres: dict, user_id: int) -> Iterator[DBHelper]:
+    database = DBHelper(**postgres, pool_max_size=4, cache_size=100, migrate=False)
+    database.upsert_user(user_id, None, 'test', None)
+    yield database
+    database.close()
+
+
+def assert_consistent(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    statistics = database.get_user_statistics(user_id)
+    assert statistics is not None
+    assert (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks) == live_statistics(sql, user_id)
+    assert stale_amounts(sql, user_id) == []
+
+
+def test_create_and_delete(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    first = database.create_book(user_id, 'first')
+    second = database.create_book(user_id, 'second')
+    note = database.create_note(user_id, first.id, 'note', 'text')
+    database.create_notes(user_id, first.id, [('bulk', 'text')] * 5)
+    database.create_notes(user_id, second.id, [('other', 'text')] * 3)
+    assert_consistent(database, sql, user_id)
+
+    task_list, tasks = database.create_task_list(user_id, 'list', ['a', 'b', 'c'])
+    database.create_tasks(user_id, task_list.id, ['d', 'e'])
+    database.update_tasks(user_id, [(tasks[0].id, None, True, None), (tasks[1].id, None, True, None)])
+    database.update_tasks(user_id, [(tasks[1].id, None, False, None)])
+    kept, _ = database.create_task_list(user_id, 'kept', ['f'])
+    assert_consistent(database, sql, user_id)
+
+    assert database.delete_note(user_id, first.id, note.id) is not None
+    assert database.delete_note(user_id, first.id, note.id) is None
+    assert_consistent(database, sql, user_id)
+
+    assert database.delete_book(user_id, first.id) is not None
+    assert database.delete_book(user_id, first.id) is None
+    assert database.delete_task_list(user_id, task_list.id) is not None
+    assert database.delete_task_list(user_id, task_list.id) is None
+    assert_consistent(database, sql, user_id)
+
+    statistics = database.get_user_statistics(user_id)
+    assert (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks) == (1, 3, 1, 1, 0) # type: ignore
+    assert [entry[0].id for entry in database.get_task_lists(user_id)] == [kept.id]
+
+
+def test_global_statistics(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    book = database.create_book(user_id, 'book')
+    database.create_notes(user_id, book.id, [('note', 'text')] * 3)
+    database.create_task_list(user_id, 'list', [])
+
+    # The counters are spread over shards, the sum of them follows the rows
+    assert database.get_statistics() == dict(sql.execute('''
+        SELECT 'notes', COUNT(1) FROM "notes"
+        UNION ALL
+        SELECT 'task_lists', COUNT(1) FROM "task_lists"
+    ''').fetchall())
+    assert sql.execute('SELECT COUNT(DISTINCT "shard") FROM "statistics"').fetchone()[0] == 16 # type: ignore
@@ -0,0 +1,69 @@
+import json
+from collections.abc import Iterator
+from uuid import uuid4
+
+import psycopg
+import pytest
+
+from conftest import live_statistics, stale_amounts
+from database import DBHelper
+from handlers import ImportSpool
+from serializer import create_serializer
+
+
+@pytest.fixture
+def database(postgres: dict, user_id: int) -> Iterator[DBHelper]:
+    database = DBHelper(**postgres, pool_max_size=4, cache_size=100, migrate=False)
+    database.upsert_user(user_id, None, 'test', None)
+    yield database
+    database.close()
+
+
+def assert_consistent(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    statistics = database.get_user_statistics(user_id)
+    assert statistics is not None
+    assert (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks) == live_statistics(sql, user_id)
+    assert stale_amounts(sql, user_id) == []
+
+
+def import_lines(database: DBHelper, user_id: int, lines: list[dict]):
+    spool = ImportSpool(create_serializer('auto'), user_id, False)
+    try:
+        statistics = spool.read([b'\n'.join(json.dumps(line).encode() for line in lines)])
+        database.import_data(user_id, spool.rows, statistics)
+    finally:
+        spool.close()
+
+
+def test_import(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    existing = database.create_book(user_id, 'existing')
+    database.create_note(user_id, existing.id, 'note', 'text')
+
+    book_id, task_list_id = str(uuid4()), str(uuid4())
+    import_lines(database, user_id, [
+        {'book': {'id': book_id, 'title': 'imported'}},
+        *({'note': {'id': str(uuid4()), 'book_id': book_id, 'title': f'note {i}', 'text': 'line\nbreak\ttab\\'}} for i in range(4)),
+        {'task_list': {'id': task_list_id, 'title': 'imported'}},
+        *({'task': {'id': str(uuid4()), 'task_list_id': task_list_id, 'title': f'task {i}', 'is_done': i % 2 == 0, 'position': i}} for i in range(3))
+    ])
+    assert_consistent(database, sql, user_id)
+
+    statistics = database.get_user_statistics(user_id)
+    assert (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks) == (2, 5, 1, 3, 2) # type: ignore
+
+    # Text goes through COPY escaping, so control characters and backslashes have to come back unchanged
+    imported = next(book for book, _ in database.get_books(user_id) if book.title == 'imported')
+    assert {note.text for note in database.get_notes(user_id, imported.id)} == {'line\nbreak\ttab\\'}
+
+
+def test_rejected_import_changes_nothing(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    database.create_book(user_id, 'existing')
+    before = live_statistics(sql, user_id)
+
+    with pytest.raises(ValueError):
+        import_lines(database, user_id, [
+            {'book': {'id': str(uuid4()), 'title': 'imported'}},
+            {'note': {'id': str(uuid4()), 'book_id': str(uuid4()), 'title': 'orphan', 'text': 'text'}}
+        ])
+    assert live_statistics(sql, user_id) == before
+    assert_consistent(database, sql, user_id)
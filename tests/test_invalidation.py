@@ -0,0 +1,79 @@
+from collections.abc import Iterator
+from time import monotonic, sleep
+from uuid import uuid4
+
+import psycopg
+import pytest
+
+from database import DBHelper, NotExistsException
+from user_cache import CHANNEL
+
+
+@pytest.fixture
+def listener(postgres: dict) -> Iterator[psycopg.Connection]:
+    with psycopg.connect(f'host={postgres["host"]} port={postgres["port"]} user={postgres["user"]} password={postgres["password"]} dbname={postgres["dbname"]}', autocommit=True) as connection:
+        connection.execute(f'LISTEN "{CHANNEL}"')
+        yield connection
+
+
+def received(listener: psycopg.Connection, sql: psycopg.Connection) -> list[str]:
+    # A marker sent last, everything before it has been delivered once it arrives
+    sql.execute('SELECT pg_notify(%s, %s)', (CHANNEL, 'marker'))
+    payloads: list[str] = []
+    for notify in listener.notifies():
+        if notify.payload == 'marker':
+            return payloads
+        payloads.append(notify.payload)
+    return payloads
+
+
+def test_writes_notify_when_they_commit(postgres: dict, sql: psycopg.Connection, listener: psycopg.Connection, user_id: int):
+    database = DBHelper(**postgres, cache_size=100, migrate=False)
+    try:
+        database.upsert_user(user_id, None, 'test', None)
+        book = database.create_book(user_id, 'book')
+        received(listener, sql)
+
+        database.create_note(user_id, book.id, 'note', 'text')
+        payloads = received(listener, sql)
+        assert len(payloads) == 1 and payloads[0].split(' ')[1:] == [str(user_id), f'books,notes:{book.id},version']
+
+        # Nothing was written, so nobody is told to drop anything
+        with pytest.raises(NotExistsException):
+            database.create_note(user_id, uuid4(), 'note', 'text')
+        assert database.delete_task_list(user_id, uuid4()) is None
+        assert received(listener, sql) == []
+
+        database.create_task_list(user_id, 'list', ['a', 'b'])
+        assert len(received(listener, sql)) == 1
+    finally:
+        database.close()
+
+
+def test_no_notifications_without_cache(postgres: dict, sql: psycopg.Connection, listener: psycopg.Connection, user_id: int):
+    database = DBHelper(**postgres, migrate=False)
+    try:
+        database.upsert_user(user_id, None, 'test', None)
+        database.create_note(user_id, database.create_book(user_id, 'book').id, 'note', 'text')
+        assert received(listener, sql) == []
+    finally:
+        database.close()
+
+
+def test_other_workers_drop_their_entries(postgres: dict, user_id: int):
+    reader = DBHelper(**postgres, cache_size=100, migrate=False)
+    writer = DBHelper(**postgres, cache_size=100, migrate=False)
+    try:
+        writer.upsert_user(user_id, None, 'test', None)
+        book = writer.create_book(user_id, 'book')
+        assert reader.get_book_version(user_id, book.id) == reader.get_book_version(user_id, book.id)
+        version = reader.get_book_version(user_id, book.id)
+
+        writer.create_note(user_id, book.id, 'note', 'text')
+        deadline = monotonic() + 5.0
+        while reader.get_book_version(user_id, book.id) == version and monotonic() < deadline:
+            sleep(0.01)
+        assert reader.get_book_version(user_id, book.id) != version
+    finally:
+        reader.close()
+        writer.close()
@@ -0,0 +1,32 @@
+import hmac
+import json
+from hashlib import sha256
+from time import time
+
+import psycopg
+import pytest
+from flask import Flask
+
+
+def login(app: Flask, user_id: int):
+    params = {'id': user_id, 'first_name': 'test', 'auth_date': int(time())}
+    data_check_string = '\n'.join(f'{k}={params[k]}' for k in sorted(params))
+    params['hash'] = hmac.new(sha256(b'1:test').digest(), data_check_string.encode(), sha256).hexdigest()
+    return app.test_client().post('/method/login', data=json.dumps(params))
+
+
+def test_login_is_claimed_once(app: Flask, user_id: int):
+    assert login(app, user_id).status_code == 200
+    assert login(app, user_id).get_json()['description'] == 'data has already been used'
+
+
+def test_failed_login_can_be_retried(app: Flask, user_id: int, monkeypatch: pytest.MonkeyPatch):
+    import app as app_module
+
+    def upsert_user(*_):
+        raise psycopg.OperationalError
+
+    with app.app_context(), monkeypatch.context() as patch:
+        patch.setattr(app_module.database, 'upsert_user', upsert_user)
+        assert login(app, user_id).status_code == 500
+    assert login(app, user_id).status_code == 200
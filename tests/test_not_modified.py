@@ -0,0 +1,57 @@
+from flask.testing import FlaskClient
+
+from conftest import call
+
+
+def test_get_books(client: FlaskClient):
+    first = call(client, 'get_books')
+    assert first.status_code == 200 and first.get_etag()[0]
+
+    etag = first.get_etag()[0]
+    cached = call(client, 'get_books', etag)
+    assert (cached.status_code, cached.get_data(), cached.get_etag()[0]) == (304, b'', etag)
+
+    # Other arguments are another resource, they never match the first one's tag
+    assert call(client, 'get_books', etag, limit=1).status_code == 200
+
+    assert call(client, 'create_book', title='new').status_code == 200
+    changed = call(client, 'get_books', etag)
+    assert changed.status_code == 200 and changed.get_etag()[0] != etag
+    assert [entry[0]['title'] for entry in changed.get_json()['result']['entries']] == ['new']
+
+
+def test_get_notes(client: FlaskClient):
+    book = call(client, 'create_book', title='book').get_json()['result']['book']
+    other = call(client, 'create_book', title='other').get_json()['result']['book']
+    etag = call(client, 'get_notes', book_id=book['id']).get_etag()[0]
+    assert call(client, 'get_notes', etag, book_id=book['id']).status_code == 304
+
+    # Notes are versioned per book, writing to another one keeps this tag valid
+    assert call(client, 'create_note', book_id=other['id'], title='note', text='text').status_code == 200
+    assert call(client, 'get_notes', etag, book_id=book['id']).status_code == 304
+
+    assert call(client, 'create_note', book_id=book['id'], title='note', text='text').status_code == 200
+    changed = call(client, 'get_notes', etag, book_id=book['id'])
+    assert changed.status_code == 200 and len(changed.get_json()['result']['notes']) == 1
+
+    assert call(client, 'delete_book', id=book['id']).status_code == 200
+    assert call(client, 'get_notes', changed.get_etag()[0], book_id=book['id']).status_code == 404
+
+
+def test_errors_are_not_cached(client: FlaskClient):
+    response = call(client, 'get_notes', book_id='not a uuid')
+    assert response.status_code == 400 and not response.get_etag()[0]
+
+
+def test_batch(client: FlaskClient):
+    etag = call(client, 'get_books').get_etag()[0]
+    calls = [{'method': 'get_books', 'etag': etag}, {'method': 'get_task_lists'}]
+
+    result = call(client, 'batch', calls=calls).get_json()['result']
+    assert result[0] == {'ok': True, 'not_modified': True}
+    assert result[1]['ok'] and result[1]['etag']
+
+    assert call(client, 'create_book', title='new').status_code == 200
+    result = call(client, 'batch', calls=calls).get_json()['result']
+    assert result[0]['ok'] and result[0]['etag'] != etag
+    assert [entry[0]['title'] for entry in result[0]['result']['entries']] == ['new']
@@ -0,0 +1,46 @@
+import pytest
+from flask.testing import FlaskClient
+
+from conftest import call
+
+
+def test_pages_follow_the_cursor(client: FlaskClient):
+    for title in 'abcde':
+        call(client, 'create_book', title=title)
+
+    titles: list[str] = []
+    after = None
+    while True:
+        result = call(client, 'get_books', limit=2, **({'after': after} if after else {})).get_json()['result']
+        titles += [entry[0]['title'] for entry in result['entries']]
+        if not (after := result['next']):
+            break
+    assert titles == list('abcde')
+
+
+@pytest.mark.parametrize('limit', [None, [1], {'a': 1}, True, 1.5, 0, 'x', -1, 10 ** 6])
+def test_invalid_limit(client: FlaskClient, limit):
+    book = call(client, 'create_book', title='book').get_json()['result']['book']
+    for method, params in (('get_books', {}), ('get_notes', {'book_id': book['id']}), ('search_notes', {'query': 'text'})):
+        response = call(client, method, limit=limit, **params)
+        assert (response.status_code, response.get_json()) == (400, {'ok': False, 'description': 'invalid argument value'})
+
+
+def test_invalid_arguments(client: FlaskClient):
+    book = call(client, 'create_book', title='book').get_json()['result']['book']
+    for method, params in (('get_notes', {'book_id': 5}), ('get_notes', {'book_id': None}), ('get_books', {'after': 'not a cursor'}), ('get_books', {'stream': True, 'limit': 1}), ('get_notes', {'book_id': book['id'], 'stream': True, 'after': 'x'})):
+        assert call(client, method, **params).status_code == 400
+
+
+@pytest.mark.parametrize('body', [b'[]', b'1', b'"text"', b'null', b'{'])
+def test_body_is_not_an_object(client: FlaskClient, body: bytes):
+    response = client.post('/method/get_books', data=body)
+    assert (response.status_code, response.get_json()) == (400, {'ok': False, 'description': 'invalid request format'})
+
+
+def test_bad_call_inside_batch(client: FlaskClient):
+    response = call(client, 'batch', calls=[{'method': 'get_books', 'params': {'limit': None}}, {'method': 'get_books', 'params': {'limit': 1}}])
+    assert response.status_code == 200
+    first, second = response.get_json()['result']
+    assert first == {'ok': False, 'description': 'invalid argument value'}
+    assert second['ok']
@@ -0,0 +1,84 @@
+from collections.abc import Iterator
+from threading import Event, Thread
+from time import monotonic, sleep
+
+import psycopg
+import pytest
+
+from conftest import live_statistics, stale_amounts
+from database import DBHelper, NotExistsException
+
+
+@pytest.fixture
+def database(postgres: dict, user_id: int) -> Iterator[DBHelper]:
+    database = DBHelper(**postgres, pool_max_size=8, cache_size=100, purge_interval=0.2, purge_batch_size=50, purge_delay=0.001, migrate=False)
+    database.upsert_user(user_id, None, 'test', None)
+    yield database
+    database.close()
+
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.05)
+    return True
+
+
+def test_purge_while_writing(database: DBHelper, sql: psycopg.Connection, user_id: int):
+    doomed = database.create_book(user_id, 'doomed')
+    kept = database.create_book(user_id, 'kept')
+    database.create_notes(user_id, doomed.id, [('note', 'text')] * 500)
+    database.create_notes(user_id, kept.id, [('note', 'text')] * 10)
+    task_list, _ = database.create_task_list(user_id, 'doomed', ['a', 'b', 'c'])
+
+    stopped = Event()
+    rejected = Event()
+
+    def write(book_id):
+        while not stopped.is_set():
+            try:
+                database.create_note(user_id, book_id, 'racing', 'text')
+            except NotExistsException:
+                rejected.set()
+
+    writers = [Thread(target=write, args=(book_id, )) for book_id in (doomed.id, doomed.id, doomed.id, kept.id)]
+    for writer in writers:
+        writer.start()
+    try:
+        sleep(0.2)
+        assert database.delete_book(user_id, doomed.id) is not None
+        assert database.delete_task_list(user_id, task_list.id) is not None
+        # Writers keep going after the delete, every insert into the deleted book has to be refused from now on
+        assert wait_for(rejected.is_set)
+        sleep(0.2)
+    finally:
+        stopped.set()
+        for writer in writers:
+            writer.join()
+
+    def purged() -> bool:
+        return sql.execute('''
+            SELECT
+                NOT EXISTS (SELECT 1 FROM "notes" WHERE "book_id" = %s)
+                AND NOT EXISTS (SELECT 1 FROM "books" WHERE "id" = %s)
+                AND NOT EXISTS (SELECT 1 FROM "task_lists" WHERE "id" = %s)
+        ''', (doomed.id, doomed.id, task_list.id)).fetchone()[0] # type: ignore
+
+    assert wait_for(purged)
+
+    assert [book.id for book, _ in database.get_books(user_id)] == [kept.id]
+    assert len(database.get_notes(user_id, kept.id)) > 10
+    assert database.get_task_lists(user_id) == []
+
+    statistics = database.get_user_statistics(user_id)
+    assert (statistics.books, statistics.notes, statistics.task_lists, statistics.tasks, statistics.done_tasks) == live_statistics(sql, user_id) # type: ignore
+    assert stale_amounts(sql, user_id) == []
+
+    # The global counters follow the physical rows, soft deleted ones are counted until the purger removes them
+    assert sql.execute('''
+        SELECT
+            (SELECT SUM("value") FROM "statistics" WHERE "name" = 'notes') = (SELECT COUNT(1) FROM "notes")
+            AND (SELECT SUM("value") FROM "statistics" WHERE "name" = 'task_lists') = (SELECT COUNT(1) FROM "task_lists")
+    ''').fetchone()[0] # type: ignore
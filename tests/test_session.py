@@ -0,0 +1,39 @@
+from threading import Event, Thread
+
+import pytest
+
+from database import DBHelper
+
+
+@pytest.mark.parametrize('pool_max_size', [0, 2])
+def test_snapshot_does_not_capture_other_threads(postgres: dict, user_id: int, pool_max_size: int):
+    database = DBHelper(**postgres, pool_max_size=pool_max_size, migrate=False)
+    database.upsert_user(user_id, None, 'test', None)
+    entered, release = Event(), Event()
+    seen: list[int] = []
+
+    def batch():
+        with database.session(snapshot=True):
+            seen.append(len(database.get_books(user_id)))
+            entered.set()
+            release.wait(5.0)
+            seen.append(len(database.get_books(user_id)))
+
+    reader = Thread(target=batch)
+    reader.start()
+    try:
+        assert entered.wait(5.0)
+        writer = Thread(target=database.create_book, args=(user_id, 'written meanwhile'))
+        writer.start()
+        # With a single shared connection the write has to wait for the snapshot instead of running inside it
+        writer.join(0.2)
+        assert writer.is_alive() == (pool_max_size == 0)
+        release.set()
+        writer.join(5.0)
+        reader.join(5.0)
+        assert not writer.is_alive() and not reader.is_alive()
+        assert seen == [0, 0]
+        assert len(database.get_books(user_id)) == 1
+    finally:
+        release.set()
+        database.close()
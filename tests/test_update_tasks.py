@@ -0,0 +1,41 @@
+from uuid import uuid4
+
+import pytest
+from flask.testing import FlaskClient
+
+from conftest import call
+
+
+def test_update_tasks(client: FlaskClient):
+    task_list = call(client, 'create_task_list', title='list', tasks=['a', 'b']).get_json()['result']
+    first, second = task_list['tasks']
+
+    response = call(client, 'update_tasks', tasks=[{'id': first['id'], 'is_done': True}, {'id': second['id'], 'title': 'renamed', 'position': 5}])
+    assert response.status_code == 200
+    assert [(task['title'], task['is_done'], task['position']) for task in response.get_json()['result']['tasks']] == [('a', True, 0), ('renamed', False, 5)]
+    assert call(client, 'get_user_statistics').get_json()['result']['statistics']['done_tasks'] == 1
+
+    # One missing task rolls back the whole update
+    assert call(client, 'update_tasks', tasks=[{'id': first['id'], 'is_done': False}, {'id': str(uuid4()), 'is_done': True}]).status_code == 404
+    assert call(client, 'get_user_statistics').get_json()['result']['statistics']['done_tasks'] == 1
+
+
+@pytest.mark.parametrize('tasks', [
+    [{'id': 5}],
+    [{'id': None, 'is_done': True}],
+    [{'id': ['x']}],
+    [{'id': 'not a uuid'}],
+    [5],
+    ['text'],
+    [],
+    {'id': 'x'},
+    None
+])
+def test_invalid_changes(client: FlaskClient, tasks):
+    response = call(client, 'update_tasks', tasks=tasks)
+    assert (response.status_code, response.get_json()) == (400, {'ok': False, 'description': 'invalid argument value'})
+
+
+@pytest.mark.parametrize('change', [{'is_done': True}, {'id': str(uuid4()), 'is_done': 'yes'}, {'id': str(uuid4()), 'position': -1}, {'id': str(uuid4()), 'title': ''}])
+def test_invalid_fields(client: FlaskClient, change):
+    assert call(client, 'update_tasks', tasks=[change]).status_code == 400
@@ -0,0 +1,119 @@
+from user_cache import UserCache
+
+
+def enabled_cache(max_size: int = 1000) -> UserCache:
+    cache = UserCache(max_size)
+    cache.clear(enabled=True)
+    return cache
+
+
+def test_disabled_until_cleared():
+    cache = UserCache(10)
+    cache.put((1, 'books'), 'value', cache.begin())
+    assert cache.get((1, 'books')) is None
+    assert cache.stats()['size'] == 0
+
+    cache.clear(enabled=True)
+    cache.put((1, 'books'), 'value', cache.begin())
+    assert cache.get((1, 'books')) == 'value'
+
+
+def test_evicts_least_recently_used():
+    cache = enabled_cache(2)
+    cache.put((1, 'books'), 'a', cache.begin())
+    cache.put((2, 'books'), 'b', cache.begin())
+    assert cache.get((1, 'books')) == 'a'
+
+    cache.put((3, 'books'), 'c', cache.begin())
+    assert cache.get((2, 'books')) is None
+    assert cache.get((1, 'books')) == 'a'
+    assert cache.get((3, 'books')) == 'c'
+
+    stats = cache.stats()
+    assert (stats['size'], stats['evictions'], stats['hits'], stats['misses']) == (2, 1, 3, 1)
+
+
+def test_invalidating_an_evicted_entry():
+    cache = enabled_cache(1)
+    cache.put((1, 'books', None), 'a', cache.begin())
+    cache.put((2, 'books', None), 'b', cache.begin())
+
+    cache.invalidate(1, ['books'])
+    cache.invalidate(2, ['books'])
+    assert cache.stats()['size'] == 0
+
+
+def test_invalidate_drops_only_its_topics():
+    cache = enabled_cache()
+    cache.put((1, 'books', None, 10), 'first page', cache.begin())
+    cache.put((1, 'books', None, 20), 'longer page', cache.begin())
+    cache.put((1, 'task_lists'), 'lists', cache.begin())
+    cache.put((2, 'books', None, 10), 'other user', cache.begin())
+
+    cache.invalidate(1, ['books'])
+    assert cache.get((1, 'books', None, 10)) is None
+    assert cache.get((1, 'books', None, 20)) is None
+    assert cache.get((1, 'task_lists')) == 'lists'
+    assert cache.get((2, 'books', None, 10)) == 'other user'
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    cache = enabled_cache()
+    started = cache.begin()
+    # The write commits and invalidates while the load is still reading the old rows
+    cache.invalidate(1, ['books'])
+    cache.put((1, 'books'), 'stale', started)
+    assert cache.get((1, 'books')) is None
+
+    cache.put((1, 'books'), 'fresh', cache.begin())
+    assert cache.get((1, 'books')) == 'fresh'
+
+
+def test_invalidation_of_another_topic_does_not_block_loads():
+    cache = enabled_cache()
+    started = cache.begin()
+    cache.invalidate(1, ['task_lists'])
+    cache.invalidate(2, ['books'])
+    cache.put((1, 'books'), 'value', started)
+    assert cache.get((1, 'books')) == 'value'
+
+
+def test_forgotten_topics_reject_older_loads():
+    cache = enabled_cache(2)
+    started = cache.begin()
+    cache.invalidate(1, ['books'])
+    # Remembering two topics at most, the invalidation of the first one is forgotten here
+    cache.invalidate(2, ['books'])
+    cache.invalidate(3, ['books'])
+
+    cache.put((1, 'books'), 'stale', started)
+    cache.put((4, 'books'), 'unrelated but as old', started)
+    assert cache.get((1, 'books')) is None
+    assert cache.get((4, 'books')) is None
+
+    cache.put((1, 'books'), 'fresh', cache.begin())
+    assert cache.get((1, 'books')) == 'fresh'
+
+
+def test_clear_rejects_loads_in_flight():
+    cache = enabled_cache()
+    started = cache.begin()
+    cache.put((1, 'user'), 'cached', started)
+
+    cache.clear(enabled=True)
+    assert cache.get((1, 'user')) is None
+
+    cache.put((1, 'user'), 'stale', started)
+    assert cache.get((1, 'user')) is None
+    cache.put((1, 'user'), 'fresh', cache.begin())
+    assert cache.get((1, 'user')) == 'fresh'
+
+
+def test_clear_can_disable():
+    cache = enabled_cache()
+    cache.put((1, 'user'), 'cached', cache.begin())
+    cache.clear(enabled=False)
+    cache.put((1, 'user'), 'ignored', cache.begin())
+    assert cache.get((1, 'user')) is None
+    assert not cache.stats()['enabled']
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter, time
+from typing import Any
+
+import jwt
+
+
+class TokenCache:
+
+    __DEFAULT_TTL = 300
+
+
+    def __init__(self, secret_key: str, algorithms: list[str], max_size: int = 10000) -> None:
+        self.__secret_key = secret_key
+        self.__algorithms = algorithms
+        self.__max_size = max_size
+
+        self.__lock = Lock()
+        self.__entries: OrderedDict[str, tuple[dict[str, Any], float]] = OrderedDict()
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__verifications = 0
+        self.__verification_time = 0.0
+
+
+    @property
+    def algorithm(self) -> str:
+        return self.__algorithms[0]
+
+
+    def encode(self, payload: dict[str, Any]) -> str:
+        return jwt.encode(payload, self.__secret_key, algorithm=self.algorithm)
+
+
+    def decode(self, raw_token: str) -> dict[str, Any]:
+        now = time()
+
+        with self.__lock:
+            if (entry := self.__entries.get(raw_token)) is not None:
+                token, expires_at = entry
+                if now < expires_at:
+                    self.__entries.move_to_end(raw_token)
+                    self.__hits += 1
+                    return token
+                del self.__entries[raw_token]
+            self.__misses += 1
+
+        # Only successfully verified tokens are cached, failures are re-verified (and rejected) every time
+        started = perf_counter()
+        try:
+            token: dict[str, Any] = jwt.decode(raw_token, self.__secret_key, algorithms=self.__algorithms)
+        finally:
+            elapsed = perf_counter() - started
+            with self.__lock:
+                self.__verifications += 1
+                self.__verification_time += elapsed
+
+        expires_at = float(token['exp']) if 'exp' in token else now + TokenCache.__DEFAULT_TTL
+        with self.__lock:
+            self.__entries[raw_token] = (token, expires_at)
+            if len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+        return token
+
+
+    def stats(self) -> dict[str, float]:
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'size': len(self.__entries),
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'hit_rate': self.__hits / lookups if lookups else 0.0,
+                'verifications': self.__verifications,
+                'verification_total_ms': self.__verification_time * 1000,
+                'verification_mean_ms': self.__verification_time * 1000 / self.__verifications if self.__verifications else 0.0
+            }
@@ -0,0 +1,118 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+
+CHANNEL = 'notes_cache'
+
+TOPIC_USER = 'user'
+TOPIC_VERSION = 'version'
+TOPIC_BOOKS = 'books'
+TOPIC_TASK_LISTS = 'task_lists'
+
+
+def notes_topic(book_id: Any) -> str:
+    return f'notes:{book_id}'
+
+
+class UserCache:
+
+    def __init__(self, max_size: int = 1000) -> None:
+        self.__max_size = max_size
+
+        self.__lock = Lock()
+        self.__enabled = False
+        # Keys are (user_id, topic, *arguments), a write to a topic drops every entry stored under it
+        self.__entries: OrderedDict[tuple[Any, ...], Any] = OrderedDict()
+        self.__topics: dict[tuple[int, str], set[tuple[Any, ...]]] = {}
+
+        # Sequence numbers of the latest invalidation per topic, so a load that raced with a write isn't stored
+        self.__sequence = 0
+        self.__invalidated: OrderedDict[tuple[int, str], int] = OrderedDict()
+        self.__invalidated_floor = 0
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__invalidations = 0
+
+
+    def get(self, key: tuple[Any, ...]) -> Any | None:
+        with self.__lock:
+            if not self.__enabled:
+                return None
+            if (value := self.__entries.get(key)) is None:
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return value
+
+
+    def begin(self) -> int:
+        with self.__lock:
+            return self.__sequence
+
+
+    def put(self, key: tuple[Any, ...], value: Any, started: int):
+        topic: tuple[int, str] = key[:2] # type: ignore
+        with self.__lock:
+            if not self.__enabled or self.__invalidated.get(topic, self.__invalidated_floor) > started:
+                return
+
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            self.__topics.setdefault(topic, set()).add(key)
+
+            while len(self.__entries) > self.__max_size:
+                evicted, _ = self.__entries.popitem(last=False)
+                self.__discard(evicted)
+                self.__evictions += 1
+
+
+    def invalidate(self, user_id: int, topics: list[str]):
+        with self.__lock:
+            self.__sequence += 1
+            for name in topics:
+                topic = (user_id, name)
+                for key in self.__topics.pop(topic, ()):
+                    del self.__entries[key]
+                    self.__invalidations += 1
+
+                self.__invalidated[topic] = self.__sequence
+                self.__invalidated.move_to_end(topic)
+                # Forgotten topics count as invalidated at the newest sequence that was dropped
+                if len(self.__invalidated) > self.__max_size:
+                    self.__invalidated_floor = self.__invalidated.popitem(last=False)[1]
+
+
+    def clear(self, enabled: bool = True):
+        with self.__lock:
+            self.__sequence += 1
+            self.__invalidated.clear()
+            self.__invalidated_floor = self.__sequence
+            self.__entries.clear()
+            self.__topics.clear()
+            self.__enabled = enabled
+
+
+    def stats(self) -> dict[str, float]:
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'enabled': self.__enabled,
+                'size': len(self.__entries),
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'hit_rate': self.__hits / lookups if lookups else 0.0,
+                'evictions': self.__evictions,
+                'invalidations': self.__invalidations
+            }
+
+
+    def __discard(self, key: tuple[Any, ...]):
+        topic: tuple[int, str] = key[:2] # type: ignore
+        if (keys := self.__topics.get(topic)) is not None:
+            keys.discard(key)
+            if not keys:
+                del self.__topics[topic]
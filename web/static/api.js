@@ -2,33 +2,75 @@ const METHOD_GET_STATISTICS = 'get_statistics';
 const METHOD_GET_USER_STATISTICS = 'get_user_statistics';
 const METHOD_LOGIN = 'login';
 const METHOD_GET_ME = 'get_me';
+const METHOD_BATCH = 'batch';
 
 const METHOD_GET_BOOKS = 'get_books';
 const METHOD_CREATE_BOOK = 'create_book';
 const METHOD_DELETE_BOOK = 'delete_book';
 
 const METHOD_GET_NOTES = 'get_notes';
+const METHOD_SEARCH_NOTES = 'search_notes';
 const METHOD_CREATE_NOTE = 'create_note';
+const METHOD_CREATE_NOTES = 'create_notes';
 const METHOD_DELETE_NOTE = 'delete_note';
 
 const METHOD_GET_TASK_LISTS = 'get_task_lists';
 const METHOD_CREATE_TASK_LIST = 'create_task_list';
+const METHOD_CREATE_TASKS = 'create_tasks';
 const METHOD_DELETE_TASK_LIST = 'delete_task_list';
+const METHOD_UPDATE_TASKS = 'update_tasks';
 
+const MAX_BATCH_SIZE = 32;
 
-const make_request = (method, args) => new Promise(async (resolve, reject) =>
+
+let pending_requests = [];
+
+
+const cache_key = (method, args) => `etag:${method}:${JSON.stringify(args? args : {})}`;
+
+
+const cached_response = (method, args) =>
+{
+    const entry = sessionStorage.getItem(cache_key(method, args));
+    return entry? JSON.parse(entry) : null;
+};
+
+
+const cache_response = (method, args, etag, result) =>
+{
+    if (!etag)
+        return;
+
+    // Storage may be full or disabled, the response is then just not cached
+    try {
+        sessionStorage.setItem(cache_key(method, args), JSON.stringify({etag: etag, result: result}));
+    }
+    catch {}
+};
+
+
+const send_request = (method, args) => new Promise(async (resolve, reject) =>
 {
     const headers = new Headers();
     headers.set('Content-Type', 'application/json');
     if ('auth_token' in sessionStorage)
         headers.set('X-Notes-Auth-Token', sessionStorage.getItem('auth_token'));
 
+    const cached = cached_response(method, args);
+    if (cached)
+        headers.set('If-None-Match', `"${cached.etag}"`);
+
     const response = await fetch(`/method/${method}`, {
         method: 'POST',
         headers: headers,
         body: JSON.stringify(args? args : {})
     });
 
+    if (response.status === 304 && cached) {
+        resolve(cached.result);
+        return;
+    }
+
     let json_response;
     try {
         json_response = await response.json();
@@ -43,6 +85,58 @@ const make_request = (method, args) => new Promise(async (resolve, reject) =>
         return;
     }
 
+    const etag = response.headers.get('ETag');
+    cache_response(method, args, etag? etag.replace(/^(W\/)?"|"$/g, '') : null, json_response.result);
     resolve(json_response.result);
 });
 
+
+
+const send_batch = requests =>
+{
+    if (requests.length === 1) {
+        send_request(requests[0].method, requests[0].args).then(requests[0].resolve, requests[0].reject);
+        return;
+    }
+
+    const cached = requests.map(request => cached_response(request.method, request.args));
+    const calls = requests.map((request, i) => ({method: request.method, params: request.args? request.args : {}, ...(cached[i]? {etag: cached[i].etag} : {})}));
+
+    send_request(METHOD_BATCH, {calls: calls})
+        .then(results => results.forEach((result, i) => {
+            if (result.ok && result.not_modified)
+                requests[i].resolve(cached[i].result);
+            else if (result.ok) {
+                cache_response(requests[i].method, requests[i].args, result.etag, result.result);
+                requests[i].resolve(result.result);
+            }
+            else
+                requests[i].reject({json: true, description: result.description});
+        }))
+        .catch(error => requests.forEach(request => request.reject(error)));
+};
+
+
+const flush_requests = () =>
+{
+    const requests = pending_requests;
+    pending_requests = [];
+
+    for (let i = 0; i < requests.length; i += MAX_BATCH_SIZE)
+        send_batch(requests.slice(i, i + MAX_BATCH_SIZE));
+};
+
+
+const make_request = (method, args) => new Promise((resolve, reject) =>
+{
+    // The batch method needs a token, so logins and anonymous calls are sent on their own
+    if (method === METHOD_LOGIN || !('auth_token' in sessionStorage)) {
+        send_request(method, args).then(resolve, reject);
+        return;
+    }
+
+    // Calls made in the same tick are coalesced into one batch request
+    if (pending_requests.length === 0)
+        queueMicrotask(flush_requests);
+    pending_requests.push({method: method, args: args, resolve: resolve, reject: reject});
+});
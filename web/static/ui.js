@@ -192,7 +192,24 @@ const create_task_list_list_item = (entry, on_remove) =>
     list.classList.add('list-group', 'list-group-flush');
 
     entry.tasks.forEach(element => {
-        list.innerHTML += `<div class="list-group-item">${element.title}</div>`;
+        const item = document.createElement('label');
+        item.classList.add('list-group-item');
+
+        const checkbox = document.createElement('input');
+        checkbox.classList.add('form-check-input', 'me-2');
+        checkbox.type = 'checkbox';
+        checkbox.checked = element.is_done;
+        checkbox.addEventListener('change', () =>
+        {
+            make_request(METHOD_UPDATE_TASKS, {tasks: [{id: element.id, is_done: checkbox.checked}]})
+                .catch(error => {
+                    checkbox.checked = !checkbox.checked;
+                    show_alert(error.json? `Ошибка API: ${error.description}` : `Ошибка HTTP: ${error.code} ${error.text}`);
+                });
+        });
+
+        item.append(checkbox, element.title);
+        list.append(item);
     });
 
     card_body.append(list);